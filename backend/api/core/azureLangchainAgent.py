@@ -1,25 +1,74 @@
+import asyncio
 import json
-from typing import List, Dict, Any
+import time
+import weakref
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional
 
-from openai import AzureOpenAI
 from decouple import config
-import time
 
-from .geminiTool import generate_image_with_gemini
-from .wikimediaTool import fetch_reference_images
+from .azureRouter import azure_router
+from .historyManager import format_transcript, window_history
+from .intentRouter import record_routing, route_intent
+from .latencyMetrics import span, tool_span
+from .renderJobs import render_queue
+from .singleFlight import tool_flights
+from .sqliteCache import make_cache_key
+from .imageSelection import (
+    INLINE_SELECTION_MESSAGE,
+    NO_IMAGE_MESSAGE,
+    PLAN_EMPTY,
+    PLAN_INLINE,
+    PLAN_SEPARATE,
+    PLAN_SINGLE,
+    SELECTION_SYSTEM_MESSAGE,
+    chosen_image_message,
+    parse_selection,
+    plan_selection,
+    selection_response_format,
+)
+from .toolRegistry import get_async_tool
 
 # -------------------------------------------------------------------
-# Azure OpenAI client
+# Azure OpenAI: every completion goes to the best deployment of the pool
+# (azureRouter), through its rate limit / retry / circuit breaker
+# (resilience); clients come from the shared registry
 # -------------------------------------------------------------------
 
-client = AzureOpenAI(
-    azure_endpoint=config("AZURE_ENDPOINT"),
-    api_key=config("AZURE_OPENAI_KEY"),
-    api_version=config("AZURE_API_VERSION"),
-    timeout=30,
+GPT_COMPLETION_MODEL = config("GPT_COMPLETION_MODEL")
+
+# "routed": a tool-routing call, then a separate narration stream
+# "stream": one streaming call with tools attached (see astream_turn)
+AGENT_MODE = config("AGENT_MODE", default="routed")
+
+async def _acreate_completion(**kwargs):
+    return await azure_router.acall(**kwargs)
+
+# -------------------------------------------------------------------
+# Tool execution limits
+# -------------------------------------------------------------------
+
+# Max tool calls running at once in this process (all turns combined)
+TOOL_MAX_CONCURRENCY = config("TOOL_MAX_CONCURRENCY", default=8, cast=int)
+
+# Per-tool timeouts (seconds); a call that exceeds it fails on its own.
+# generate_image only queues a render here (see RENDER_TIMEOUT in renderJobs)
+TOOL_TIMEOUTS = {
+    "fetch_reference_images": config("TOOL_TIMEOUT_REFERENCE", default=20.0, cast=float),
+}
+
+# One semaphore per event loop: an asyncio primitive is bound to the loop
+# that first uses it
+_tool_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
 )
 
-GPT_COMPLETION_MODEL = config("GPT_COMPLETION_MODEL")
+
+def _tool_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _tool_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _tool_semaphores[loop] = asyncio.Semaphore(TOOL_MAX_CONCURRENCY)
+    return semaphore
 
 # -------------------------------------------------------------------
 # Tool definitions (CRITICAL: contracts must be accurate)
@@ -81,168 +130,546 @@ REFERENCE_IMAGE_TOOL = {
     }
 }
 
+# -------------------------------------------------------------------
+# Progress phases (streamed to the client as "progress" events)
+# -------------------------------------------------------------------
+
+PHASE_THINKING = "thinking"
+PHASE_SEARCHING = "searching_references"
+PHASE_GENERATING = "generating_image"
+PHASE_SELECTING = "selecting"
+
+# on_progress(phase, status) with status "start" or "end"
+ProgressCallback = Callable[[str, str], None]
+
+PHASE_LABELS = {
+    PHASE_THINKING: "Thinking",
+    PHASE_SEARCHING: "Searching references",
+    PHASE_GENERATING: "Generating image",
+    PHASE_SELECTING: "Selecting",
+}
+
+TOOL_PHASES = {
+    "fetch_reference_images": PHASE_SEARCHING,
+    "generate_image": PHASE_GENERATING,
+}
+
+
+def _report(on_progress: Optional[ProgressCallback], phase: str, status: str):
+    if on_progress is not None:
+        on_progress(phase, status)
+
+# -------------------------------------------------------------------
+# Shared helpers
+# -------------------------------------------------------------------
+
+def _reference_tool_message(tool_call, candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+    if not candidates:
+        return {
+            "role": "tool",
+            "name": tool_call.function.name,
+            "tool_call_id": tool_call.id,
+            "content": json.dumps({
+                "instruction": "No reference images were found.",
+                "response_format": "Respond with NO_SUITABLE_IMAGE."
+            })
+        }
+
+    return {
+        "role": "tool",
+        "name": tool_call.function.name,
+        "tool_call_id": tool_call.id,
+        "content": json.dumps({
+            "instruction": (
+                "IMAGE SELECTION TASK.\n"
+                "Choose EXACTLY ONE image ID from the list below.\n"
+                "If none are suitable, respond with NO_SUITABLE_IMAGE."
+            ),
+            "response_format": selection_response_format(),
+            "candidates": candidates
+        })
+    }
+
+
+def _generated_tool_message(tool_call, image_id: str) -> Dict[str, Any]:
+    return {
+        "role": "tool",
+        "name": tool_call.function.name,
+        "tool_call_id": tool_call.id,
+        "content": (
+            f"Image {image_id} is being rendered and will be shown to the user "
+            "as soon as it is ready."
+        )
+    }
+
+
+def _failed_tool_message(tool_call, error: Exception) -> Dict[str, Any]:
+    return {
+        "role": "tool",
+        "name": tool_call.function.name,
+        "tool_call_id": tool_call.id,
+        "content": json.dumps({
+            "error": str(error) or type(error).__name__,
+            "instruction": (
+                "This tool call failed. Do NOT refer to its result; "
+                "briefly tell the user this step did not work."
+            ),
+        })
+    }
+
+
+def _user_text(history: List[Dict[str, Any]]) -> str:
+    # The turn's message is the last history entry
+    last = history[-1] if history else None
+    if isinstance(last, dict) and last.get("role") == "user" and isinstance(last.get("content"), str):
+        return last["content"]
+    return ""
+
+
+def _flight_key(name: str, kwargs: Dict[str, Any]) -> str:
+    # Identical arguments → one upstream call shared by every request
+    return make_cache_key({"tool": name, **kwargs})
+
+
+def _tool_kwargs(tool_call, reference_image_id: str) -> Optional[Dict[str, Any]]:
+    args = json.loads(tool_call.function.arguments)
+
+    if tool_call.function.name == "fetch_reference_images":
+        return {"query": args["query"]}
+
+    if tool_call.function.name == "generate_image":
+        needs_image = args.get("needs_image", False)
+        return {
+            "prompt": args["prompt"],
+            "needs_image": needs_image,
+            # Only refinements depend on the previous image
+            "reference_image_id": reference_image_id if needs_image else "",
+        }
+
+    return None
+
+
+async def _arun_tool(tool_call, reference_image_id: str):
+    name = tool_call.function.name
+    kwargs = _tool_kwargs(tool_call, reference_image_id)
+    if kwargs is None:
+        return None
+
+    if name == "generate_image":
+        # Off the loop: the first submit may still import the Gemini tool
+        return await asyncio.to_thread(render_queue.submit, _flight_key(name, kwargs), **kwargs)
+
+    # Off the loop as well: the first call may still import the tool's module
+    tool = await asyncio.to_thread(get_async_tool, name)
+    return await tool_flights[name].ado(_flight_key(name, kwargs), tool, **kwargs)
+
+
+def _record_tool_results(
+    history: List[Dict[str, Any]],
+    tool_calls,
+    results: List[Any],
+    reference_candidates_by_call: Dict[str, List[Dict[str, Any]]],
+    generated_images: List[Dict[str, Any]],
+):
+    """
+    Appends one tool message per call, in the original tool_call order.
+    A result that is an Exception means that call failed or timed out.
+    """
+    for tool_call, result in zip(tool_calls, results):
+        if isinstance(result, Exception):
+            print(f"Tool {tool_call.function.name} failed: {result!r}")
+            history.append(_failed_tool_message(tool_call, result))
+
+        # ---- Reference image retrieval
+        elif tool_call.function.name == "fetch_reference_images":
+            reference_candidates_by_call[tool_call.id] = result
+            history.append(_reference_tool_message(tool_call, result))
+
+        # ---- AI image generation (queued render job)
+        elif tool_call.function.name == "generate_image":
+            image_id = f"IMAGE_{len(generated_images) + 1}"
+
+            generated_images.append({
+                "id": image_id,
+                "job_id": result.id,
+            })
+
+            history.append(_generated_tool_message(tool_call, image_id))
+
+
+def _apply_selection(
+    history: List[Dict[str, Any]],
+    selection_message,
+    candidates: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Parses the selection reply, appends it to history and returns the chosen
+    reference images (at most one).
+    """
+    history.append(selection_message)
+
+    recognized, chosen_reference_images = parse_selection(
+        selection_message.content, candidates
+    )
+
+    if recognized and not chosen_reference_images:
+        # Prevent phantom image narration
+        history.append(NO_IMAGE_MESSAGE)
+
+    return chosen_reference_images
+
+
+def _plan_without_completion(
+    history: List[Dict[str, Any]],
+    plan: str,
+    candidates: List[Dict[str, Any]],
+):
+    """
+    Handles every plan that does not need a selection completion.
+
+    Returns (chosen_reference_images, pending_candidates); pending candidates
+    are picked by the narration stream (see asplit_selection_header).
+    """
+    if plan == PLAN_EMPTY:
+        history.append(NO_IMAGE_MESSAGE)
+    elif plan == PLAN_SINGLE:
+        history.append(chosen_image_message(candidates[0]))
+        return candidates, []
+    elif plan == PLAN_INLINE:
+        history.append(INLINE_SELECTION_MESSAGE)
+        return [], candidates
+
+    return [], []
+
 # -------------------------------------------------------------------
 # Tool-aware image handling
 # -------------------------------------------------------------------
 
-def maybe_generate_image(history: List[Dict[str, Any]], reference_image: str = ""):
+async def amaybe_generate_image(
+    history: List[Dict[str, Any]],
+    reference_image_id: str = "",
+    on_progress: Optional[ProgressCallback] = None,
+):
     """
     Azure-safe tool handling with strict image selection.
 
     Flow:
+    0. Plain chat skips tool routing (see intentRouter)
     1. Assistant decides which tools to call
-    2. Tools return candidates / generated images
-    3. Assistant performs STRICT image selection (machine-only)
+    2. Tools return candidates / queued render jobs (see renderJobs)
+    3. Image selection: decided locally when trivial, otherwise by the
+       narration stream (inline) or a STRICT selection call (separate)
     4. Normal narration happens later during streaming
+
+    Returns (history, chosen_reference_images, generated_images,
+    pending_candidates). pending_candidates is non-empty only for inline
+    selection; pass the narration stream through asplit_selection_header.
+
+    reference_image_id names the stored image a refinement starts from.
+    on_progress, if given, is called with (phase, "start" | "end") as each
+    step begins and ends.
     """
 
-    # ------------------------------------------------------------------
+    # 0️⃣ Local fast path for plain chat (see intentRouter)
+    message = _user_text(history)
+    decision = route_intent(message, bool(reference_image_id))
+    if decision.applied:
+        return history, [], [], []
+
     # 1️⃣ Initial assistant call (may contain tool calls)
-    # ------------------------------------------------------------------
-    response = client.chat.completions.create(
-        model=GPT_COMPLETION_MODEL,
-        messages=history,
-        tools=[REFERENCE_IMAGE_TOOL, GEMINI_IMAGE_TOOL],
-        tool_choice="auto",
-    )
+    _report(on_progress, PHASE_THINKING, "start")
+    started = time.perf_counter()
+    with span("tool_routing"):
+        response = await _acreate_completion(
+            model=GPT_COMPLETION_MODEL,
+            messages=window_history(history),
+            tools=[REFERENCE_IMAGE_TOOL, GEMINI_IMAGE_TOOL],
+            tool_choice="auto",
+        )
+    _report(on_progress, PHASE_THINKING, "end")
 
     assistant_message = response.choices[0].message
     history.append(assistant_message)
+    record_routing(
+        message, decision, bool(assistant_message.tool_calls), time.perf_counter() - started
+    )
+
+    if not assistant_message.tool_calls:
+        return history, [], [], []
+
+    return await _arun_tool_round(history, assistant_message, reference_image_id, on_progress)
+
 
+async def _arun_tool_round(
+    history: List[Dict[str, Any]],
+    assistant_message,
+    reference_image_id: str,
+    on_progress: Optional[ProgressCallback],
+):
+    """Steps 2️⃣-4️⃣ of amaybe_generate_image: run the tools, then select."""
     chosen_reference_images: List[Dict[str, Any]] = []
     generated_images: List[Dict[str, Any]] = []
 
-    # No tools → nothing to do
-    if not assistant_message.tool_calls:
-        return history, chosen_reference_images, generated_images
-
-    # ------------------------------------------------------------------
     # 2️⃣ Respond to ALL tool calls (Azure requirement)
-    # ------------------------------------------------------------------
     reference_candidates_by_call: Dict[str, List[Dict[str, Any]]] = {}
 
-    for tool_call in assistant_message.tool_calls:
-        args = json.loads(tool_call.function.arguments)
-
-        # ---- Reference image retrieval
-        if tool_call.function.name == "fetch_reference_images":
-            candidates = fetch_reference_images(query=args["query"])
-            reference_candidates_by_call[tool_call.id] = candidates
-
-            if not candidates:
-                history.append({
-                    "role": "tool",
-                    "name": tool_call.function.name,
-                    "tool_call_id": tool_call.id,
-                    "content": json.dumps({
-                        "instruction": "No reference images were found.",
-                        "response_format": "Respond with NO_SUITABLE_IMAGE."
-                    })
-                })
-            else:
-                history.append({
-                    "role": "tool",
-                    "name": tool_call.function.name,
-                    "tool_call_id": tool_call.id,
-                    "content": json.dumps({
-                        "instruction": (
-                            "IMAGE SELECTION TASK.\n"
-                            "Choose EXACTLY ONE image ID from the list below.\n"
-                            "If none are suitable, respond with NO_SUITABLE_IMAGE."
-                        ),
-                        "response_format": (
-                            "Respond with ONLY one of:\n"
-                            "CHOSEN_IMAGE_ID: <id>\n"
-                            "NO_SUITABLE_IMAGE"
-                        ),
-                        "candidates": candidates
-                    })
-                })
-
-        # ---- AI image generation
-        elif tool_call.function.name == "generate_image":
-            image_b64 = generate_image_with_gemini(prompt=args["prompt"], needs_image=args.get("needs_image", False), reference_image=reference_image)
-            image_id = f"IMAGE_{len(generated_images) + 1}"
+    # Independent calls run concurrently; gather keeps tool_call order
+    async def run_one(tool_call):
+        phase = TOOL_PHASES.get(tool_call.function.name, tool_call.function.name)
+        _report(on_progress, phase, "start")
+        try:
+            async with _tool_semaphore():
+                with tool_span(tool_call.function.name):
+                    return await asyncio.wait_for(
+                        _arun_tool(tool_call, reference_image_id),
+                        timeout=TOOL_TIMEOUTS.get(tool_call.function.name),
+                    )
+        except asyncio.TimeoutError:
+            return TimeoutError(f"{tool_call.function.name} timed out")
+        except Exception as exc:
+            return exc
+        finally:
+            _report(on_progress, phase, "end")
+
+    tool_calls = assistant_message.tool_calls
+    results = await asyncio.gather(*(run_one(tool_call) for tool_call in tool_calls))
+
+    _record_tool_results(
+        history, tool_calls, results, reference_candidates_by_call, generated_images
+    )
 
-            generated_images.append({
-                "id": image_id,
-                "b64": image_b64
-            })
+    # 3️⃣ Image selection (local, inline or STRICT selection call)
+    plan, candidates = plan_selection(reference_candidates_by_call)
+    chosen_reference_images, pending_candidates = _plan_without_completion(
+        history, plan, candidates
+    )
 
-            history.append({
-                "role": "tool",
-                "name": tool_call.function.name,
-                "tool_call_id": tool_call.id,
-                "content": f"Image generated and stored as {image_id}"
-            })
+    if plan == PLAN_SEPARATE:
+        _report(on_progress, PHASE_SELECTING, "start")
+        with span("selection"):
+            selection = await _acreate_completion(
+                model=GPT_COMPLETION_MODEL,
+                messages=window_history(history + [SELECTION_SYSTEM_MESSAGE]),
+            )
+        _report(on_progress, PHASE_SELECTING, "end")
 
-    # ------------------------------------------------------------------
-    # 3️⃣ STRICT image-selection call (NO narration allowed)
-    # ------------------------------------------------------------------
-    selection_prompt = history + [{
-        "role": "system",
-        "content": (
-            "IMAGE SELECTION MODE.\n\n"
-            "Respond with ONLY one of the following:\n"
-            "- CHOSEN_IMAGE_ID: <id>\n"
-            "- NO_SUITABLE_IMAGE\n\n"
-            "Do NOT include explanations or descriptions."
+        # 4️⃣ Parse selection
+        chosen_reference_images = _apply_selection(
+            history, selection.choices[0].message, candidates
         )
-    }]
 
-    selection = client.chat.completions.create(
-        model=GPT_COMPLETION_MODEL,
-        messages=selection_prompt,
-    )
+    return history, chosen_reference_images, generated_images, pending_candidates
 
-    selection_message = selection.choices[0].message
-    history.append(selection_message)
+# -------------------------------------------------------------------
+# Single streaming request (AGENT_MODE=stream)
+# -------------------------------------------------------------------
+
+def _merge_tool_call_deltas(calls: Dict[int, Dict[str, Any]], deltas):
+    """Builds tool calls up from streamed fragments (keyed by index)."""
+    for delta in deltas:
+        call = calls.setdefault(delta.index, {
+            "id": "",
+            "type": "function",
+            "function": {"name": "", "arguments": ""},
+        })
+        if delta.id:
+            call["id"] = delta.id
+        if delta.function is not None:
+            if delta.function.name:
+                call["function"]["name"] += delta.function.name
+            if delta.function.arguments:
+                call["function"]["arguments"] += delta.function.arguments
 
-    content = (selection_message.content or "").strip()
 
-    # ------------------------------------------------------------------
-    # 4️⃣ Parse selection
-    # ------------------------------------------------------------------
-    if content.startswith("CHOSEN_IMAGE_ID:"):
-        chosen_id = content.replace("CHOSEN_IMAGE_ID:", "").strip()
+def _tool_call_message(content: Optional[str], tool_calls: List[Dict[str, Any]]):
+    # Imported here, like the SDK clients, so importing this module stays cheap
+    from openai.types.chat import ChatCompletionMessage
 
-        for candidates in reference_candidates_by_call.values():
-            for img in candidates:
-                if img.get("id") == chosen_id:
-                    chosen_reference_images.append(img)
-                    break
-            if chosen_reference_images:
+    return ChatCompletionMessage(role="assistant", content=content, tool_calls=tool_calls)
+
+
+class StreamedAnswer:
+    """
+    A text answer from the single streaming request, forwarded delta by
+    delta. The model may still call tools after some text: those calls
+    are collected to the end of the stream (tool_calls), for the caller
+    to run afterwards (arun_late_tool_calls).
+    """
+
+    def __init__(self, first_delta: str, chunks, on_end: Optional[Callable[[bool], None]] = None):
+        self.text: List[str] = []
+        self.tool_calls: List[Dict[str, Any]] = []
+        self._first_delta = first_delta
+        self._chunks = chunks
+        self._on_end = on_end
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._stream()
+
+    async def _stream(self) -> AsyncIterator[str]:
+        self.text.append(self._first_delta)
+        yield self._first_delta
+
+        tool_call_parts: Dict[int, Dict[str, Any]] = {}
+        async for chunk in self._chunks:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                self.text.append(delta.content)
+                yield delta.content
+            if delta.tool_calls:
+                _merge_tool_call_deltas(tool_call_parts, delta.tool_calls)
+
+        self.tool_calls = [tool_call_parts[index] for index in sorted(tool_call_parts)]
+        if self.tool_calls:
+            print(f"Agent stream: {len(self.tool_calls)} tool call(s) after the text")
+        if self._on_end is not None:
+            self._on_end(bool(self.tool_calls))
+
+
+async def arun_late_tool_calls(
+    history: List[Dict[str, Any]],
+    answer: StreamedAnswer,
+    reference_image_id: str = "",
+    on_progress: Optional[ProgressCallback] = None,
+):
+    """
+    Runs the tool calls a streamed answer made after its text (steps
+    2️⃣-4️⃣). Returns amaybe_generate_image's tuple; the caller requests
+    the narration of the results.
+    """
+    assistant_message = _tool_call_message("".join(answer.text), answer.tool_calls)
+    history.append(assistant_message)
+    return await _arun_tool_round(history, assistant_message, reference_image_id, on_progress)
+
+
+async def astream_turn(
+    history: List[Dict[str, Any]],
+    reference_image_id: str = "",
+    on_progress: Optional[ProgressCallback] = None,
+):
+    """
+    amaybe_generate_image with one streaming request instead of a
+    routing call followed by a narration call.
+
+    The request has the tools attached. If the model starts answering in
+    text, that text IS the narration: it is returned still streaming (a
+    StreamedAnswer) and no further call is made, unless the model calls
+    tools after the text. If it calls tools first, the streamed fragments
+    are assembled into tool calls and the turn continues as usual (tools,
+    selection, then a narration call by the caller).
+
+    Returns amaybe_generate_image's tuple plus the narration: a
+    StreamedAnswer, or None when the caller must request it
+    (asend_chat_completion_stream).
+    """
+
+    # 0️⃣ Local fast path for plain chat (see intentRouter)
+    message = _user_text(history)
+    decision = route_intent(message, bool(reference_image_id))
+    if decision.applied:
+        return history, [], [], [], None
+
+    # 1️⃣ One streaming call: read until the model either talks or calls tools
+    _report(on_progress, PHASE_THINKING, "start")
+    started = time.perf_counter()
+    tool_call_parts: Dict[int, Dict[str, Any]] = {}
+    first_delta = None
+
+    with span("tool_routing"):
+        response = await _acreate_completion(
+            model=GPT_COMPLETION_MODEL,
+            messages=window_history(history),
+            tools=[REFERENCE_IMAGE_TOOL, GEMINI_IMAGE_TOOL],
+            tool_choice="auto",
+            stream=True,
+        )
+        # Iterated across two loops below; must be the same generator
+        chunks = response.__aiter__()
+
+        async for chunk in chunks:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.tool_calls:
+                _merge_tool_call_deltas(tool_call_parts, delta.tool_calls)
+            elif delta.content and not tool_call_parts:
+                first_delta = delta.content
                 break
+    _report(on_progress, PHASE_THINKING, "end")
+    routing_seconds = time.perf_counter() - started
+
+    # Text answer: keep streaming it. Whether it used a tool is only known
+    # once the stream ends
+    if first_delta is not None:
+        return history, [], [], [], StreamedAnswer(
+            first_delta,
+            chunks,
+            on_end=lambda used_tool: record_routing(message, decision, used_tool, routing_seconds),
+        )
 
-    elif content.upper() == "NO_SUITABLE_IMAGE":
-        # Prevent phantom image narration
-        history.append({
-            "role": "system",
-            "content": (
-                "No reference image was selected. "
-                "Do NOT refer to any image in your response."
-            )
-        })
+    record_routing(message, decision, bool(tool_call_parts), routing_seconds)
 
-    return history, chosen_reference_images, generated_images
+    if not tool_call_parts:
+        return history, [], [], [], None
+
+    assistant_message = _tool_call_message(
+        None, [tool_call_parts[index] for index in sorted(tool_call_parts)]
+    )
+    history.append(assistant_message)
+
+    return (
+        *await _arun_tool_round(history, assistant_message, reference_image_id, on_progress),
+        None,
+    )
 
 
 # -------------------------------------------------------------------
 # Streaming assistant text (tool-safe)
 # -------------------------------------------------------------------
 
-def send_chat_completion_stream(
+async def asend_chat_completion_stream(
     history: List[Dict[str, Any]],
     model: str = GPT_COMPLETION_MODEL
 ):
-    response = client.chat.completions.create(
+    response = await _acreate_completion(
         model=model,
-        messages=history,
+        messages=window_history(history),
         stream=True,
     )
 
-    for chunk in response:
+    # Deltas are forwarded as they arrive; see sseFramer.acoalesce_deltas
+    async for chunk in response:
         if chunk.choices and chunk.choices[0].delta.content:
-            for c in chunk.choices[0].delta.content:
-                yield c
-                time.sleep(0.01)  # slight delay for smoother streaming
+            yield chunk.choices[0].delta.content
+
+
+# -------------------------------------------------------------------
+# Rolling conversation summary (see historyManager.afold_turns)
+# -------------------------------------------------------------------
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a co-creative design conversation. "
+    "Update the previous summary with the new messages. Keep decisions, "
+    "preferences, named concepts and which images were generated or chosen. "
+    "Be concise (max ~200 words). Reply with the summary only."
+)
+
+
+async def asummarize_history(previous_summary: str, messages: List[Dict[str, Any]]) -> str:
+    response = await _acreate_completion(
+        model=GPT_COMPLETION_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": (
+                    f"PREVIOUS SUMMARY:\n{previous_summary or '(none)'}\n\n"
+                    f"NEW MESSAGES:\n{format_transcript(messages)}"
+                ),
+            },
+        ],
+    )
+
+    return (response.choices[0].message.content or previous_summary).strip()
@@ -0,0 +1,296 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from decouple import config
+
+from .clientRegistry import get_async_azure_client
+from .latencyMetrics import (
+    AZURE_DEPLOYMENT_ERRORS,
+    AZURE_DEPLOYMENT_LATENCY,
+    AZURE_HEDGES,
+    AZURE_ROUTED,
+    METRICS_ENABLED,
+)
+from .resilience import (
+    UPSTREAM_RETRIES_MAX,
+    Upstream,
+    UpstreamUnavailable,
+    deployment_upstream,
+    is_retryable,
+    upstreams,
+)
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Pool of Azure OpenAI deployments as a JSON list, e.g.
+#   [{"name": "swe", "endpoint": "https://swe.openai.azure.com", "deployment": "gpt-4o"},
+#    {"name": "us", "endpoint": "https://us.openai.azure.com", "deployment": "gpt-4o",
+#     "api_key": "...", "api_version": "2024-06-01"}]
+# api_key / api_version default to AZURE_OPENAI_KEY / AZURE_API_VERSION.
+# Empty: a single deployment, AZURE_ENDPOINT + the model each call names.
+AZURE_DEPLOYMENTS = config("AZURE_DEPLOYMENTS", default="")
+
+# Weight of the newest sample in the latency / error-rate averages
+AZURE_ROUTER_ALPHA = config("AZURE_ROUTER_ALPHA", default=0.2, cast=float)
+
+# Each point of error rate multiplies a deployment's score by this much
+AZURE_ROUTER_ERROR_PENALTY = config("AZURE_ROUTER_ERROR_PENALTY", default=4.0, cast=float)
+
+# Share of calls sent to a random healthy deployment, so the averages of
+# the ones not chosen stay current
+AZURE_ROUTER_EXPLORE = config("AZURE_ROUTER_EXPLORE", default=0.05, cast=float)
+
+# Send a second request to the next-best deployment when the first is
+# slower than this percentile of its recent latencies
+AZURE_HEDGE_ENABLED = config("AZURE_HEDGE_ENABLED", default=False, cast=bool)
+AZURE_HEDGE_PERCENTILE = config("AZURE_HEDGE_PERCENTILE", default=95.0, cast=float)
+AZURE_HEDGE_MIN_SAMPLES = config("AZURE_HEDGE_MIN_SAMPLES", default=20, cast=int)
+
+# Initial latency guess for a deployment with no samples yet (seconds)
+AZURE_ROUTER_EXPECTED_SECONDS = 1.0
+
+# Latency samples kept per deployment and kind (for the hedge percentile)
+AZURE_ROUTER_WINDOW = 200
+
+# Completions are timed separately from streams (time to first byte)
+KIND_COMPLETE = "complete"
+KIND_STREAM = "stream"
+
+# -------------------------------------------------------------------
+# Deployments
+# -------------------------------------------------------------------
+
+class Deployment:
+    def __init__(
+        self,
+        name: str,
+        endpoint: str = "",
+        model: str = "",
+        api_key: str = "",
+        api_version: str = "",
+        upstream: Optional[Upstream] = None,
+    ):
+        self.name = name
+        self.endpoint = endpoint
+        # Empty: keep the model the caller asked for
+        self.model = model
+        self.api_key = api_key
+        self.api_version = api_version
+        self.upstream = upstream or deployment_upstream(name)
+
+        self.latency = {KIND_COMPLETE: AZURE_ROUTER_EXPECTED_SECONDS, KIND_STREAM: AZURE_ROUTER_EXPECTED_SECONDS}
+        self.samples = {KIND_COMPLETE: deque(maxlen=AZURE_ROUTER_WINDOW), KIND_STREAM: deque(maxlen=AZURE_ROUTER_WINDOW)}
+        self.error_rate = 0.0
+        self._lock = threading.Lock()
+
+    def aclient(self):
+        return get_async_azure_client(self.endpoint, self.api_key, self.api_version)
+
+    @property
+    def available(self) -> bool:
+        breaker = self.upstream.breaker
+        return not (
+            breaker.state == breaker.OPEN
+            and time.monotonic() < breaker.opened_at + breaker.cooldown
+        )
+
+    def score(self, kind: str) -> float:
+        """Lower is better: smoothed latency, inflated by the error rate."""
+        return self.latency[kind] * (1 + AZURE_ROUTER_ERROR_PENALTY * self.error_rate)
+
+    def percentile(self, kind: str, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.samples[kind])
+        if len(samples) < AZURE_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(int(pct / 100 * len(samples)), len(samples) - 1)]
+
+    def record(self, kind: str, seconds: Optional[float] = None):
+        """seconds=None records a failure."""
+        alpha = AZURE_ROUTER_ALPHA
+        with self._lock:
+            if seconds is None:
+                self.error_rate = (1 - alpha) * self.error_rate + alpha
+            else:
+                self.error_rate = (1 - alpha) * self.error_rate
+                self.latency[kind] = (1 - alpha) * self.latency[kind] + alpha * seconds
+                self.samples[kind].append(seconds)
+
+        if METRICS_ENABLED:
+            AZURE_ROUTED.inc(deployment=self.name, kind=kind, outcome="error" if seconds is None else "ok")
+            AZURE_DEPLOYMENT_LATENCY.set(round(self.latency[kind], 4), deployment=self.name, kind=kind)
+            AZURE_DEPLOYMENT_ERRORS.set(round(self.error_rate, 4), deployment=self.name)
+
+    def kwargs(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {**kwargs, "model": self.model} if self.model else kwargs
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "available": self.available,
+            "latency_s": {kind: round(value, 3) for kind, value in self.latency.items()},
+            "error_rate": round(self.error_rate, 3),
+        }
+
+
+def _fails_over(exc: Exception) -> bool:
+    # Another deployment may well answer; a bad request fails everywhere
+    return isinstance(exc, UpstreamUnavailable) or is_retryable(exc)
+
+
+async def _aclose(result: Any):
+    # A stream that lost a hedge still holds a connection
+    close = getattr(result, "close", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception as exc:
+            print(f"Azure router: could not close hedged response ({exc!r})")
+
+# -------------------------------------------------------------------
+# Router
+# -------------------------------------------------------------------
+
+class AzureRouter:
+    """
+    Sends each chat completion to the deployment with the best score
+    (smoothed latency and error rate). A deployment that fails with a 429 /
+    5xx / timeout, or whose circuit is open, is skipped for the next best.
+    Optionally hedges: if the first request outlives AZURE_HEDGE_PERCENTILE
+    of that deployment's recent latencies, the next best one gets the same
+    request and the first answer wins.
+
+    Latencies are per process and per kind: the time to the whole answer
+    for completions, to the response headers for streams.
+    """
+
+    def __init__(self, deployments: List[Deployment]):
+        self.deployments = deployments
+
+    def endpoints(self) -> List[str]:
+        return sorted({d.endpoint or config("AZURE_ENDPOINT") for d in self.deployments})
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [deployment.status() for deployment in self.deployments]
+
+    def ranked(self, kind: str) -> List[Deployment]:
+        """Best first; deployments with an open circuit go last."""
+        ranked = sorted(self.deployments, key=lambda d: (not d.available, d.score(kind)))
+
+        healthy = [d for d in ranked if d.available]
+        if len(healthy) > 1 and random.random() < AZURE_ROUTER_EXPLORE:
+            pick = random.choice(healthy[1:])
+            ranked.remove(pick)
+            ranked.insert(0, pick)
+        return ranked
+
+    async def _aattempt(self, deployment: Deployment, kind: str, kwargs: Dict[str, Any]) -> Any:
+        # Only the upstream call is timed: a cold client or a wait for a
+        # rate-limit token says nothing about the deployment's speed
+        create = deployment.aclient().chat.completions.create
+        elapsed = None
+
+        async def timed(**call_kwargs):
+            nonlocal elapsed
+            started = time.perf_counter()
+            response = await create(**call_kwargs)
+            elapsed = time.perf_counter() - started
+            return response
+
+        try:
+            result = await deployment.upstream.acall(timed, **deployment.kwargs(kwargs))
+        except Exception as exc:
+            if _fails_over(exc):
+                deployment.record(kind)
+                print(f"Azure router: {deployment.name} failed ({type(exc).__name__})")
+            raise
+
+        deployment.record(kind, elapsed)
+        return result
+
+    async def _ahedged(
+        self, primary: Deployment, backup: Deployment, delay: float, kind: str, kwargs: Dict[str, Any]
+    ) -> Any:
+        first = asyncio.ensure_future(self._aattempt(primary, kind, kwargs))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        print(f"Azure router: {primary.name} slower than {delay:.2f}s, hedging to {backup.name}")
+        second = asyncio.ensure_future(self._aattempt(backup, kind, kwargs))
+        tasks = (first, second)
+        pending = set(tasks)
+        winner = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+
+            if METRICS_ENABLED:
+                AZURE_HEDGES.inc(winner="none" if winner is None else "primary" if winner is first else "hedge")
+            if winner is None:
+                # Both failed: report the primary's error
+                raise first.exception()
+            return winner.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            for task in tasks:
+                if task is winner or not task.done() or task.cancelled():
+                    continue
+                if task.exception() is None:
+                    await _aclose(task.result())
+
+    async def acall(self, **kwargs) -> Any:
+        kind = KIND_STREAM if kwargs.get("stream") else KIND_COMPLETE
+        ranked = self.ranked(kind)
+
+        error = None
+        while ranked:
+            deployment = ranked.pop(0)
+            hedge_after = (
+                deployment.percentile(kind, AZURE_HEDGE_PERCENTILE)
+                if AZURE_HEDGE_ENABLED and ranked and ranked[0].available else None
+            )
+            try:
+                if hedge_after is None:
+                    return await self._aattempt(deployment, kind, kwargs)
+                return await self._ahedged(deployment, ranked.pop(0), hedge_after, kind, kwargs)
+            except Exception as exc:
+                if not _fails_over(exc):
+                    raise
+                error = exc
+
+        raise error
+
+
+def _load_deployments() -> List[Deployment]:
+    entries = json.loads(AZURE_DEPLOYMENTS) if AZURE_DEPLOYMENTS.strip() else []
+    if not entries:
+        # Single deployment, guarded as plain "azure"
+        return [Deployment("default", upstream=upstreams["azure"])]
+
+    deployments = []
+    for entry in entries:
+        name = entry.get("name") or entry["deployment"]
+        deployments.append(Deployment(
+            name,
+            endpoint=entry["endpoint"],
+            model=entry["deployment"],
+            api_key=entry.get("api_key", ""),
+            api_version=entry.get("api_version", ""),
+            # In a pool the next deployment is the retry: fail over at once
+            upstream=deployment_upstream(name, retries=0 if len(entries) > 1 else UPSTREAM_RETRIES_MAX),
+        ))
+    return deployments
+
+
+azure_router = AzureRouter(_load_deployments())
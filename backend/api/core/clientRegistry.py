@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import importlib.util
+import threading
+from typing import Any, Callable, Dict
+
+from decouple import config
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Connection pool per upstream client
+UPSTREAM_MAX_CONNECTIONS = config("UPSTREAM_MAX_CONNECTIONS", default=100, cast=int)
+UPSTREAM_MAX_KEEPALIVE = config("UPSTREAM_MAX_KEEPALIVE", default=20, cast=int)
+UPSTREAM_KEEPALIVE_EXPIRY = config("UPSTREAM_KEEPALIVE_EXPIRY", default=120.0, cast=float)
+
+# HTTP/2 needs the optional "h2" package (httpx[http2])
+UPSTREAM_HTTP2 = (
+    config("UPSTREAM_HTTP2", default=True, cast=bool)
+    and importlib.util.find_spec("h2") is not None
+)
+
+# Open connections to every upstream when a worker boots
+UPSTREAM_WARMUP = config("UPSTREAM_WARMUP", default=True, cast=bool)
+UPSTREAM_WARMUP_TIMEOUT = config("UPSTREAM_WARMUP_TIMEOUT", default=5.0, cast=float)
+
+# Per-upstream request timeouts (seconds)
+AZURE_TIMEOUT = config("AZURE_TIMEOUT", default=30.0, cast=float)
+GEMINI_TIMEOUT = config("GEMINI_TIMEOUT", default=120.0, cast=float)
+SERPAPI_TIMEOUT = config("SERPAPI_TIMEOUT", default=15.0, cast=float)
+REFERENCE_FETCH_TIMEOUT = config("REFERENCE_FETCH_TIMEOUT", default=10.0, cast=float)
+
+# Overridable so benchmarks can point the real clients at local stubs
+GEMINI_BASE_URL = config("GEMINI_BASE_URL", default="https://generativelanguage.googleapis.com/")
+SERPAPI_BASE_URL = config("SERPAPI_BASE_URL", default="https://serpapi.com/")
+
+# -------------------------------------------------------------------
+# Registry
+# -------------------------------------------------------------------
+# Clients are built on first use (or by warmup), once per process. Under
+# gunicorn --preload that means after the fork, so workers never share
+# sockets with the master.
+
+_clients: Dict[str, Any] = {}
+_lock = threading.RLock()
+
+
+def _get(name: str, factory: Callable[[], Any]) -> Any:
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def _limits():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+
+# ---- Azure OpenAI
+
+def _azure_async_http_client():
+    from openai import DefaultAsyncHttpxClient
+
+    return DefaultAsyncHttpxClient(limits=_limits(), http2=UPSTREAM_HTTP2, timeout=AZURE_TIMEOUT)
+
+
+def _azure_name(base: str, endpoint: str, api_key: str, api_version: str) -> str:
+    # Two deployments on one endpoint may use different keys or API
+    # versions; the key itself stays out of the name
+    fingerprint = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+    return f"{base}:{endpoint}:{api_version}:{fingerprint}"
+
+
+def get_async_azure_client(endpoint: str = "", api_key: str = "", api_version: str = ""):
+    """
+    Client for one Azure OpenAI resource (default: AZURE_ENDPOINT). Every
+    endpoint shares the same pooled HTTP client.
+    """
+    endpoint = endpoint or config("AZURE_ENDPOINT")
+    api_key = api_key or config("AZURE_OPENAI_KEY")
+    api_version = api_version or config("AZURE_API_VERSION")
+
+    def build():
+        from openai import AsyncAzureOpenAI
+
+        return AsyncAzureOpenAI(
+            azure_endpoint=endpoint,
+            api_key=api_key,
+            api_version=api_version,
+            timeout=AZURE_TIMEOUT,
+            # Retries are done by resilience.upstreams["azure"]
+            max_retries=0,
+            http_client=_get("azure_async_http", _azure_async_http_client),
+        )
+
+    return _get(_azure_name("azure_async", endpoint, api_key, api_version), build)
+
+# ---- Gemini
+
+def _gemini_http_client():
+    import httpx
+
+    return httpx.Client(limits=_limits(), http2=UPSTREAM_HTTP2, timeout=GEMINI_TIMEOUT)
+
+
+def _gemini_async_http_client():
+    import httpx
+
+    return httpx.AsyncClient(limits=_limits(), http2=UPSTREAM_HTTP2, timeout=GEMINI_TIMEOUT)
+
+
+def get_gemini_client():
+    def build():
+        from google import genai
+        from google.genai import types
+
+        return genai.Client(
+            api_key=config("GEMINI_KEY"),
+            http_options=types.HttpOptions(
+                base_url=GEMINI_BASE_URL,
+                timeout=int(GEMINI_TIMEOUT * 1000),
+                httpx_client=_get("gemini_http", _gemini_http_client),
+                httpx_async_client=_get("gemini_async_http", _gemini_async_http_client),
+            ),
+        )
+
+    return _get("gemini", build)
+
+# ---- SerpAPI
+
+def get_serpapi_session():
+    def build():
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=UPSTREAM_MAX_KEEPALIVE,
+        )
+        session.mount("https://", adapter)
+        return session
+
+    return _get("serpapi", build)
+
+# ---- Reference image origins (arbitrary third-party hosts)
+
+def get_reference_http_client():
+    def build():
+        import httpx
+
+        return httpx.Client(
+            limits=_limits(),
+            http2=UPSTREAM_HTTP2,
+            timeout=REFERENCE_FETCH_TIMEOUT,
+            follow_redirects=True,
+            # Some image hosts reject requests without a browser-like agent
+            headers={"User-Agent": "Mozilla/5.0 (compatible; EVA-VR image proxy)"},
+        )
+
+    return _get("reference_http", build)
+
+# -------------------------------------------------------------------
+# Warmup / shutdown (called from backend/asgi.py lifespan)
+# -------------------------------------------------------------------
+
+async def _preconnect(name: str, request):
+    try:
+        await asyncio.wait_for(request(), timeout=UPSTREAM_WARMUP_TIMEOUT)
+        print(f"Warmup: connected to {name}")
+    except Exception as exc:
+        # Warmup is best effort; the first real request just pays the handshake
+        print(f"Warmup: {name} failed ({type(exc).__name__})")
+
+
+async def awarmup():
+    """
+    Builds every client and opens a pooled connection to each upstream,
+    so the first user request doesn't pay DNS + TLS handshakes.
+    """
+    from .azureRouter import azure_router
+
+    azure_endpoints = azure_router.endpoints()
+
+    # Build the SDK clients (and their pools) up front, one per deployment
+    # of the Azure pool
+    for deployment in azure_router.deployments:
+        deployment.aclient()
+    get_gemini_client()
+    serpapi = get_serpapi_session()
+
+    azure_async_http = _clients["azure_async_http"]
+    gemini_async_http = _clients["gemini_async_http"]
+    gemini_http = _clients["gemini_http"]
+
+    # Any response (even 404) leaves a warm connection in the pool
+    await asyncio.gather(
+        *(
+            _preconnect(f"azure {endpoint} (async)", lambda endpoint=endpoint: azure_async_http.head(endpoint))
+            for endpoint in azure_endpoints
+        ),
+        _preconnect("gemini (async)", lambda: gemini_async_http.head(GEMINI_BASE_URL)),
+        _preconnect("gemini", lambda: asyncio.to_thread(gemini_http.head, GEMINI_BASE_URL)),
+        _preconnect("serpapi", lambda: asyncio.to_thread(
+            serpapi.head, SERPAPI_BASE_URL, timeout=SERPAPI_TIMEOUT
+        )),
+    )
+
+
+async def aclose():
+    with _lock:
+        clients = dict(_clients)
+        _clients.clear()
+
+    for name in ("azure_async_http", "gemini_async_http"):
+        if name in clients:
+            await clients[name].aclose()
+    for name in ("gemini_http", "serpapi", "reference_http"):
+        if name in clients:
+            clients[name].close()
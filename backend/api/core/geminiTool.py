@@ -1,37 +1,23 @@
-from google import genai
-import base64
-from decouple import config
 
-gemini_client = genai.Client(
-    api_key=config("GEMINI_KEY")
-)
+import time
+from typing import Optional
 
-def generate_image_with_gemini(
-    prompt: str,
-    model: str = "gemini-2.5-flash-image",
-    needs_image: bool = False,
-    reference_image: str = ""
-) -> str:
-    """
-    Returns a base64-encoded PNG image string (NOT saved to disk).
-
-    If needs_image=True and reference_image is provided, this performs
-    an image-to-image refinement by sending the previous image + prompt.
-    """
-
-    print("Gemini Tool: generating image...")
+from .clientRegistry import get_gemini_client
+from .imageStore import put_image
+from .imageVariants import prepare_reference_image
+from .resilience import upstreams
 
+def _build_contents(prompt: str, needs_image: bool, reference_image_id: str) -> list:
     contents = []
 
-    # If we need to refine, attach the reference image as inline_data
-    print(f"Needs image: {needs_image}, reference image provided: {reference_image != ''}")
-    if needs_image and reference_image:
-        contents.append({
-            "inline_data": {
-                "mime_type": "image/png",
-                "data": reference_image,
-            }
-        })
+    # Refinements load the previous image from the local store by id;
+    # the client never re-uploads it. It is downscaled and cached once,
+    # then reused by every later refinement.
+    inline_data = prepare_reference_image(reference_image_id) if needs_image else None
+
+    print(f"Needs image: {needs_image}, reference image found: {inline_data is not None}")
+    if inline_data is not None:
+        contents.append({"inline_data": inline_data})
 
         # Important: prompt should clearly describe *changes*, not restate everything
         # (but you can still do either).
@@ -40,17 +26,54 @@ def generate_image_with_gemini(
         # Prompt-only generation (your previous behavior)
         contents = [prompt]
 
-    response = gemini_client.models.generate_content(
-        model=model,
-        contents=contents,
-    )
+    return contents
 
+def _extract_image_bytes(response) -> bytes:
     # Gemini responses can include multiple parts; return the first image part found
     for part in response.parts:
         if getattr(part, "inline_data", None) is not None:
-            out_bytes = part.inline_data.data
-            out_b64 = base64.b64encode(out_bytes).decode("utf-8")
             print("Done")
-            return out_b64
+            return part.inline_data.data
 
     raise RuntimeError("Gemini did not return an image")
+
+def generate_image_with_gemini(
+    prompt: str,
+    model: str = "gemini-2.5-flash-image",
+    needs_image: bool = False,
+    reference_image_id: str = "",
+    deadline: Optional[float] = None
+) -> str:
+    """
+    Generates an image and returns its id in the local image store
+    (see imageStore.put_image); the bytes are served by /api/images/<id>.
+
+    If needs_image=True and reference_image_id names a stored image, this
+    performs an image-to-image refinement by sending that image + prompt.
+
+    deadline (time.monotonic()) bounds the render, retries included: each
+    attempt's HTTP timeout is cut to the time left, so the calling thread
+    is free by then (see renderJobs).
+    """
+
+    print("Gemini Tool: generating image...")
+
+    def generate_content(**kwargs):
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("No time left to render the image")
+            from google.genai import types
+            kwargs["config"] = types.GenerateContentConfig(
+                http_options=types.HttpOptions(timeout=int(remaining * 1000))
+            )
+        return get_gemini_client().models.generate_content(**kwargs)
+
+    response = upstreams["gemini"].call(
+        generate_content,
+        model=model,
+        contents=_build_contents(prompt, needs_image, reference_image_id),
+        deadline=deadline,
+    )
+
+    return put_image(_extract_image_bytes(response))
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from decouple import config
+
+from .sessionStore import to_message_dict
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Max prompt tokens of history sent with each completion (system included)
+HISTORY_TOKEN_BUDGET = config("HISTORY_TOKEN_BUDGET", default=8000, cast=int)
+
+# Stored turns beyond this many tokens get folded into the rolling summary
+HISTORY_SUMMARY_TRIGGER = config("HISTORY_SUMMARY_TRIGGER", default=6000, cast=int)
+
+# After folding, keep roughly this many tokens of recent turns verbatim
+HISTORY_SUMMARY_KEEP = config("HISTORY_SUMMARY_KEEP", default=3000, cast=int)
+
+HISTORY_TOKENIZER = config("HISTORY_TOKENIZER", default="o200k_base")
+
+# After a failed tokenizer load, estimate and try again this much later (seconds)
+HISTORY_TOKENIZER_RETRY = config("HISTORY_TOKENIZER_RETRY", default=300.0, cast=float)
+
+SUMMARY_PREFIX = "SUMMARY OF EARLIER CONVERSATION:\n"
+
+# Fixed per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# -------------------------------------------------------------------
+# Token counting (cached per message)
+# -------------------------------------------------------------------
+
+_encoding = None
+_encoding_retry_at = 0.0
+_encoding_loading = False
+_encoding_lock = threading.Lock()
+
+_token_counts: "OrderedDict[str, int]" = OrderedDict()
+_token_counts_lock = threading.Lock()
+TOKEN_COUNT_CACHE_SIZE = 10000
+
+
+def load_tokenizer():
+    """
+    Loads the tokenizer (blocking: tiktoken may download its BPE file).
+    Called from worker warmup in a thread; see TIKTOKEN_CACHE_DIR in the
+    Dockerfile for the copy baked into the image.
+    """
+    global _encoding, _encoding_retry_at, _encoding_loading
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(HISTORY_TOKENIZER)
+    except Exception as exc:
+        # No tokenizer files and no network: estimate until the next try
+        print(f"History manager: tokenizer unavailable ({type(exc).__name__}), estimating")
+        encoding = None
+
+    with _encoding_lock:
+        _encoding = encoding
+        _encoding_retry_at = time.monotonic() + HISTORY_TOKENIZER_RETRY
+        _encoding_loading = False
+
+
+def _get_encoding():
+    """The tokenizer, or None while it is (re)loading in the background."""
+    global _encoding_loading
+    if _encoding is not None:
+        return _encoding
+
+    with _encoding_lock:
+        if _encoding_loading or time.monotonic() < _encoding_retry_at:
+            return _encoding
+        _encoding_loading = True
+
+    # Never load on the caller's thread: it is usually the event loop
+    threading.Thread(target=load_tokenizer, name="tokenizer-load", daemon=True).start()
+    return None
+
+
+def count_text_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message) -> int:
+    message = to_message_dict(message)
+    content = message.get("content") or ""
+    text = content if isinstance(content, str) else json.dumps(content)
+    if message.get("tool_calls"):
+        text += json.dumps(message["tool_calls"], default=str)
+
+    key = hashlib.sha1(f"{message.get('role')}\0{text}".encode("utf-8")).hexdigest()
+
+    with _token_counts_lock:
+        cached = _token_counts.get(key)
+        if cached is not None:
+            _token_counts.move_to_end(key)
+            return cached
+
+    tokens = count_text_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+    if _encoding is None:
+        # Estimate: count it again once the tokenizer is loaded
+        return tokens
+
+    with _token_counts_lock:
+        _token_counts[key] = tokens
+        while len(_token_counts) > TOKEN_COUNT_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+
+    return tokens
+
+
+def _role(message) -> Optional[str]:
+    return message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+
+# -------------------------------------------------------------------
+# Windowing (applied to every completion)
+# -------------------------------------------------------------------
+
+def window_history(history: List[Any], budget: int = HISTORY_TOKEN_BUDGET) -> List[Any]:
+    """
+    Returns the slice of history that fits the token budget.
+
+    Always kept: leading system messages (prompt + rolling summary) and the
+    current turn (from the last user message on). Older turns are added
+    newest-first while they fit. The kept part never starts in the middle
+    of a tool-call exchange.
+    """
+    head_end = 0
+    while head_end < len(history) and _role(history[head_end]) == "system":
+        head_end += 1
+
+    head = history[:head_end]
+    body = history[head_end:]
+
+    current_start = len(body)
+    for index in range(len(body) - 1, -1, -1):
+        if _role(body[index]) == "user":
+            current_start = index
+            break
+
+    used = sum(count_message_tokens(m) for m in head)
+    used += sum(count_message_tokens(m) for m in body[current_start:])
+
+    start = current_start
+    while start > 0:
+        tokens = count_message_tokens(body[start - 1])
+        if used + tokens > budget:
+            break
+        used += tokens
+        start -= 1
+
+    # Don't open with orphaned tool results / assistant replies
+    while start < current_start and _role(body[start]) != "user":
+        start += 1
+
+    if start == 0:
+        return history
+
+    return head + body[start:]
+
+# -------------------------------------------------------------------
+# Incremental summarization (stored session turns)
+# -------------------------------------------------------------------
+
+def is_summary_message(message) -> bool:
+    return (
+        _role(message) == "system"
+        and (to_message_dict(message).get("content") or "").startswith(SUMMARY_PREFIX)
+    )
+
+
+def summary_message(summary: str) -> Dict[str, Any]:
+    return {"role": "system", "content": SUMMARY_PREFIX + summary}
+
+
+def plan_fold(turns: List[Dict[str, Any]]):
+    """
+    Decides which stored turns to fold into the summary.
+
+    Returns (previous_summary, to_fold, fold_end) or None when the stored
+    turns still fit. fold_end counts from the start of turns (including
+    the existing summary message), so callers can replace that prefix.
+    """
+    offset = 1 if turns and is_summary_message(turns[0]) else 0
+    previous_summary = turns[0]["content"][len(SUMMARY_PREFIX):] if offset else ""
+    rest = turns[offset:]
+
+    if sum(count_message_tokens(m) for m in rest) <= HISTORY_SUMMARY_TRIGGER:
+        return None
+
+    kept = 0
+    cut = len(rest)
+    while cut > 0 and kept + count_message_tokens(rest[cut - 1]) <= HISTORY_SUMMARY_KEEP:
+        kept += count_message_tokens(rest[cut - 1])
+        cut -= 1
+
+    # Keep whole turns: the verbatim part starts at a user message
+    while cut < len(rest) and _role(rest[cut]) != "user":
+        cut += 1
+
+    if cut == 0:
+        return None
+
+    return previous_summary, rest[:cut], offset + cut
+
+
+async def afold_turns(
+    turns: List[Dict[str, Any]],
+    summarize: Callable[[str, List[Dict[str, Any]]], Awaitable[str]],
+):
+    """
+    Folds the oldest turns into the rolling summary.
+
+    Only the newly dropped turns are sent to summarize() along with the
+    previous summary, so each fold costs about the same regardless of
+    session length. Returns (fold_end, summary_message) or None.
+    """
+    plan = plan_fold(turns)
+    if plan is None:
+        return None
+
+    previous_summary, to_fold, fold_end = plan
+    summary = await summarize(previous_summary, to_fold)
+    return fold_end, summary_message(summary)
+
+
+def format_transcript(messages: List[Dict[str, Any]], max_chars: int = 800) -> str:
+    lines = []
+    for message in messages:
+        message = to_message_dict(message)
+        if message.get("tool_calls"):
+            calls = ", ".join(
+                f"{c['function']['name']}({c['function']['arguments']})"
+                for c in message["tool_calls"]
+            )
+            lines.append(f"assistant called tools: {calls}")
+        content = message.get("content")
+        if content:
+            lines.append(f"{message.get('role')}: {str(content)[:max_chars]}")
+    return "\n".join(lines)
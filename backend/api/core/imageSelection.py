@@ -0,0 +1,223 @@
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from decouple import config
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# "inline": the narration completion also makes the choice (header line)
+# "separate": dedicated IMAGE SELECTION MODE completion (previous behavior)
+SELECTION_STRATEGY = config("IMAGE_SELECTION_STRATEGY", default="inline")
+
+CHOSEN_PREFIX = "CHOSEN_IMAGE_ID:"
+NO_IMAGE = "NO_SUITABLE_IMAGE"
+
+# Give up looking for a header line after this many characters
+MAX_HEADER_CHARS = 200
+
+# Markdown the model sometimes wraps the header in (**bold**, `code`, _italic_)
+HEADER_MARKDOWN = "*_`"
+
+# Plan outcomes
+PLAN_NONE = "none"          # no reference search ran → nothing to select
+PLAN_EMPTY = "empty"        # searches returned no candidates
+PLAN_SINGLE = "single"      # exactly one candidate → take it
+PLAN_INLINE = "inline"      # choose within the narration stream
+PLAN_SEPARATE = "separate"  # extra selection completion
+
+# -------------------------------------------------------------------
+# Prompts
+# -------------------------------------------------------------------
+
+SELECTION_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": (
+        "IMAGE SELECTION MODE.\n\n"
+        "Respond with ONLY one of the following:\n"
+        "- CHOSEN_IMAGE_ID: <id>\n"
+        "- NO_SUITABLE_IMAGE\n\n"
+        "Do NOT include explanations or descriptions."
+    )
+}
+
+INLINE_SELECTION_MESSAGE = {
+    "role": "system",
+    "content": (
+        "IMAGE SELECTION + RESPONSE.\n\n"
+        "The FIRST line of your reply MUST be exactly one of:\n"
+        "- CHOSEN_IMAGE_ID: <id>\n"
+        "- NO_SUITABLE_IMAGE\n\n"
+        "Then write a blank line, then your normal response to the user.\n"
+        "The first line is hidden from the user. If you chose "
+        "NO_SUITABLE_IMAGE, do NOT refer to any image in your response."
+    )
+}
+
+NO_IMAGE_MESSAGE = {
+    "role": "system",
+    "content": (
+        "No reference image was selected. "
+        "Do NOT refer to any image in your response."
+    )
+}
+
+
+def selection_response_format() -> str:
+    if SELECTION_STRATEGY == PLAN_INLINE:
+        return (
+            "Start your reply with ONE line, either:\n"
+            "CHOSEN_IMAGE_ID: <id>\n"
+            "NO_SUITABLE_IMAGE"
+        )
+    return (
+        "Respond with ONLY one of:\n"
+        "CHOSEN_IMAGE_ID: <id>\n"
+        "NO_SUITABLE_IMAGE"
+    )
+
+
+def chosen_image_message(image: Dict[str, Any]) -> Dict[str, Any]:
+    title = image.get("title")
+    return {
+        "role": "system",
+        "content": (
+            f"Reference image {image['id']}"
+            + (f" ({title})" if title else "")
+            + " was selected and is shown to the user."
+        )
+    }
+
+# -------------------------------------------------------------------
+# Strategy
+# -------------------------------------------------------------------
+
+def plan_selection(
+    reference_candidates_by_call: Dict[str, List[Dict[str, Any]]],
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Decides how the reference image gets chosen for this turn.
+
+    Returns (plan, candidates): the trivial plans never need the model,
+    the others carry the full candidate list.
+    """
+    if not reference_candidates_by_call:
+        return PLAN_NONE, []
+
+    candidates = [
+        img
+        for call_candidates in reference_candidates_by_call.values()
+        for img in call_candidates
+    ]
+
+    if not candidates:
+        return PLAN_EMPTY, []
+    if len(candidates) == 1:
+        return PLAN_SINGLE, candidates
+    if SELECTION_STRATEGY == PLAN_SEPARATE:
+        return PLAN_SEPARATE, candidates
+    return PLAN_INLINE, candidates
+
+
+def _unwrap(text: str) -> str:
+    return text.strip(HEADER_MARKDOWN + " \t\r\n")
+
+
+def parse_selection(content: str, candidates: List[Dict[str, Any]]) -> Tuple[bool, List[Dict[str, Any]]]:
+    """
+    Parses a selection reply.
+
+    Returns (recognized, chosen): recognized is False when the text is not
+    a selection answer at all, chosen holds at most one candidate. An id
+    that names no candidate counts as NO_SUITABLE_IMAGE.
+    """
+    content = _unwrap(content or "")
+
+    if content.startswith(CHOSEN_PREFIX):
+        chosen_id = _unwrap(content[len(CHOSEN_PREFIX):])
+        for img in candidates:
+            if img.get("id") == chosen_id:
+                return True, [img]
+        print(f"Image selection: unknown id {chosen_id!r}, treated as {NO_IMAGE}")
+        return True, []
+
+    if content.upper() == NO_IMAGE:
+        return True, []
+
+    return False, []
+
+# -------------------------------------------------------------------
+# Inline header parsing (narration stream)
+# -------------------------------------------------------------------
+
+def _header_state(buffer: str) -> str:
+    """
+    "pending" while the buffer may still become a header line,
+    "header" once a full header line is buffered, "text" otherwise.
+    """
+    head = buffer.lstrip(HEADER_MARKDOWN + " \t\r\n")
+    markers = (CHOSEN_PREFIX, NO_IMAGE)
+
+    if not any(m.startswith(head[:len(m)]) for m in markers):
+        return "text"
+    if "\n" in head:
+        return "header"
+    if len(head) > MAX_HEADER_CHARS:
+        return "text"
+    return "pending"
+
+
+def _split_header(buffer: str, candidates: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], str]:
+    head, _, rest = buffer.lstrip().partition("\n")
+    _, chosen = parse_selection(head, candidates)
+    return chosen, rest
+
+
+async def asplit_selection_header(
+    deltas: AsyncIterator[str],
+    candidates: List[Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], AsyncIterator[str]]:
+    """
+    Reads the hidden selection line off the start of a narration stream.
+
+    Returns (chosen, remaining_deltas). If the model skipped the header,
+    nothing is chosen and the stream is passed through untouched.
+    """
+    iterator = deltas.__aiter__()
+    buffer = ""
+    state = "pending"
+
+    async for delta in iterator:
+        buffer += delta
+        state = _header_state(buffer)
+        if state != "pending":
+            break
+
+    # Stream ended on a bare header line (no narration after it)
+    if state == "pending":
+        recognized, _ = parse_selection(buffer, candidates)
+        state = "header" if recognized else "text"
+
+    chosen: List[Dict[str, Any]] = []
+    if state == "header":
+        chosen, buffer = _split_header(buffer, candidates)
+
+    async def remaining():
+        # Drop the blank line(s) between header and narration, even when
+        # they arrive in later deltas
+        stripping = state == "header"
+        pending = buffer
+        if stripping:
+            pending = pending.lstrip("\n")
+        if pending:
+            stripping = False
+            yield pending
+        async for delta in iterator:
+            if stripping:
+                delta = delta.lstrip("\n")
+                if not delta:
+                    continue
+                stripping = False
+            yield delta
+
+    return chosen, remaining()
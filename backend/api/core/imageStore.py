@@ -0,0 +1,166 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from decouple import config
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+IMAGE_STORE_DIR = Path(config(
+    "IMAGE_STORE_DIR",
+    default=str(Path(__file__).resolve().parents[2] / ".cache" / "images"),
+))
+
+# Store caps: files not written or read for IMAGE_STORE_MAX_AGE seconds
+# are deleted, then the least recently used ones until the store fits in
+# IMAGE_STORE_MAX_BYTES (0 = no cap)
+IMAGE_STORE_MAX_AGE = config("IMAGE_STORE_MAX_AGE", default=7 * 24 * 3600, cast=float)
+IMAGE_STORE_MAX_BYTES = config("IMAGE_STORE_MAX_BYTES", default=2 * 1024 ** 3, cast=int)
+
+# The caps are checked on write, at most this often per process (seconds)
+IMAGE_STORE_PRUNE_INTERVAL = config("IMAGE_STORE_PRUNE_INTERVAL", default=300.0, cast=float)
+
+IMAGE_URL_PREFIX = "/api/images/"
+
+IMAGE_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# -------------------------------------------------------------------
+# Helpers
+# -------------------------------------------------------------------
+
+def sniff_mime_type(data: bytes) -> str:
+    """Detects the image format from its magic bytes (PNG if unknown)."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    return "image/png"
+
+def is_image_id(image_id: str) -> bool:
+    return bool(image_id) and bool(IMAGE_ID_RE.match(image_id))
+
+def image_url(image_id: str) -> str:
+    return f"{IMAGE_URL_PREFIX}{image_id}"
+
+def image_path(image_id: str) -> Path:
+    # Two-level fan-out keeps directories small
+    return IMAGE_STORE_DIR / image_id[:2] / image_id
+
+# -------------------------------------------------------------------
+# Store
+# -------------------------------------------------------------------
+
+def write_atomic(path: Path, data: bytes):
+    """Other workers never see a half-written file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def _touch(path: Path):
+    # Modification time doubles as last use, for eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def put_image(data: bytes) -> str:
+    """
+    Stores image bytes under their SHA-256 and returns that id.
+
+    Writing the same bytes twice is a no-op, so an id always names the
+    same bytes; it stays available until evicted (see prune_images).
+    """
+    image_id = hashlib.sha256(data).hexdigest()
+    path = image_path(image_id)
+
+    if path.exists():
+        _touch(path)
+    else:
+        write_atomic(path, data)
+        _maybe_prune()
+
+    return image_id
+
+def get_image(image_id: str) -> Optional[bytes]:
+    if not is_image_id(image_id):
+        return None
+
+    path = image_path(image_id)
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    _touch(path)
+    return data
+
+# -------------------------------------------------------------------
+# Eviction
+# -------------------------------------------------------------------
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+def prune_images() -> int:
+    """
+    Applies IMAGE_STORE_MAX_AGE and IMAGE_STORE_MAX_BYTES to every file in
+    the store (images and their manifests), oldest first. Returns the
+    number of files deleted. Safe to run from several workers at once.
+    """
+    files = []
+    for path in IMAGE_STORE_DIR.glob("*/*"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+
+    cutoff = time.time() - IMAGE_STORE_MAX_AGE
+    total = sum(size for _, size, _ in files)
+    deleted = 0
+    for mtime, size, path in files:
+        over_cap = IMAGE_STORE_MAX_BYTES and total > IMAGE_STORE_MAX_BYTES
+        if mtime >= cutoff and not over_cap:
+            break
+        try:
+            path.unlink()
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+
+    return deleted
+
+def _maybe_prune():
+    global _last_prune
+    if time.monotonic() - _last_prune < IMAGE_STORE_PRUNE_INTERVAL:
+        return
+    # One pruning thread per process; the others just write
+    if not _prune_lock.acquire(blocking=False):
+        return
+    try:
+        _last_prune = time.monotonic()
+        deleted = prune_images()
+        if deleted:
+            print(f"Image store: evicted {deleted} file(s)")
+    except OSError as exc:
+        print(f"Image store: pruning failed ({exc!r})")
+    finally:
+        _prune_lock.release()
@@ -0,0 +1,260 @@
+import base64
+import io
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from decouple import config
+
+from .imageStore import (
+    get_image,
+    image_path,
+    image_url,
+    is_image_id,
+    put_image,
+    sniff_mime_type,
+    write_atomic,
+)
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# "webp" or "jpeg"
+IMAGE_VARIANT_FORMAT = config("IMAGE_VARIANT_FORMAT", default="webp").lower()
+IMAGE_VARIANT_QUALITY = config("IMAGE_VARIANT_QUALITY", default=80, cast=int)
+
+# Longest side (pixels) of each variant; "full" keeps the original size.
+# Smallest first: clients show the first one while the rest load.
+IMAGE_VARIANT_SIZES = {
+    "thumb": config("IMAGE_THUMB_SIZE", default=256, cast=int),
+    "preview": config("IMAGE_PREVIEW_SIZE", default=1024, cast=int),
+    "full": None,
+}
+
+# Reference images sent to Gemini for refinement: the model works at about
+# 1024 px, so anything bigger is only upload time
+GEMINI_REFERENCE_MAX_SIDE = config("GEMINI_REFERENCE_MAX_SIDE", default=1024, cast=int)
+GEMINI_REFERENCE_FORMAT = config("GEMINI_REFERENCE_FORMAT", default="jpeg").lower()
+GEMINI_REFERENCE_QUALITY = config("GEMINI_REFERENCE_QUALITY", default=90, cast=int)
+
+# Uploaded reference images larger than this (pixels) are refused
+UPLOAD_MAX_PIXELS = config("UPLOAD_MAX_PIXELS", default=4096 * 4096, cast=int)
+UPLOAD_FORMATS = ("JPEG", "PNG", "WEBP", "GIF")
+
+# Prepared (base64) reference images kept in memory per worker
+REFERENCE_CACHE_SIZE = config("REFERENCE_CACHE_SIZE", default=32, cast=int)
+
+VARIANT_MIME_TYPES = {
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+}
+
+# -------------------------------------------------------------------
+# Transcoding
+# -------------------------------------------------------------------
+
+def _manifest_path(image_id: str, kind: str):
+    # Settings are part of the name so a config change re-encodes
+    return image_path(image_id).with_name(f"{image_id}.{kind}.json")
+
+
+def _open(data: bytes):
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    return image
+
+
+def _encode(image, max_side, image_format: str, quality: int) -> tuple:
+    from PIL import Image
+
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    if image_format == "jpeg" and image.mode != "RGB":
+        # JPEG has no alpha: flatten onto white
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        if image.mode in ("RGBA", "LA"):
+            background.paste(image, mask=image.getchannel("A"))
+        else:
+            background.paste(image.convert("RGB"))
+        image = background
+
+    out = io.BytesIO()
+    image.save(out, format=image_format.upper(), quality=quality, optimize=True)
+    return out.getvalue(), image.size
+
+
+def make_variants(image_id: str) -> List[Dict[str, Any]]:
+    """
+    Transcodes a stored image into the configured variants and returns
+    them (name, image_id, url, width, height, mime_type, bytes).
+
+    Variants are stored like any other image, so they are served by
+    /api/images/<id>. The list is cached next to the source image, so
+    each image is transcoded once. Returns [] if Pillow is missing or the
+    image can't be decoded; clients then fall back to the original.
+    """
+    if not is_image_id(image_id):
+        return []
+
+    sizes = "-".join(f"{name}{side}" for name, side in IMAGE_VARIANT_SIZES.items() if side)
+    manifest_path = _manifest_path(
+        image_id, f"variants-{IMAGE_VARIANT_FORMAT}-q{IMAGE_VARIANT_QUALITY}-{sizes}"
+    )
+    try:
+        variants = json.loads(manifest_path.read_text(encoding="utf-8"))
+        # A variant may have been evicted from the store: transcode again
+        if all(image_path(v["image_id"]).exists() for v in variants):
+            return variants
+    except (FileNotFoundError, ValueError):
+        pass
+
+    data = get_image(image_id)
+    if data is None:
+        return []
+
+    try:
+        source = _open(data)
+
+        variants = []
+        for name, max_side in IMAGE_VARIANT_SIZES.items():
+            encoded, (width, height) = _encode(
+                source, max_side, IMAGE_VARIANT_FORMAT, IMAGE_VARIANT_QUALITY
+            )
+            variant_id = put_image(encoded)
+            variants.append({
+                "name": name,
+                "image_id": variant_id,
+                "url": image_url(variant_id),
+                "width": width,
+                "height": height,
+                "mime_type": VARIANT_MIME_TYPES[IMAGE_VARIANT_FORMAT],
+                "bytes": len(encoded),
+            })
+    except Exception as exc:
+        print(f"Image variants: transcoding {image_id[:12]} failed ({exc!r})")
+        return []
+
+    write_atomic(manifest_path, json.dumps(variants).encode("utf-8"))
+    print(
+        f"Image variants: {image_id[:12]} {len(data)} B → "
+        + ", ".join(f"{v['name']} {v['bytes']} B" for v in variants)
+    )
+    return variants
+
+# -------------------------------------------------------------------
+# Uploads
+# -------------------------------------------------------------------
+
+def is_valid_upload(data: bytes) -> bool:
+    """
+    Whether client-uploaded bytes are a well-formed JPEG, PNG, WebP or GIF
+    of at most UPLOAD_MAX_PIXELS. The header and structure are checked
+    without decoding the pixels.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format not in UPLOAD_FORMATS:
+                return False
+            if image.width * image.height > UPLOAD_MAX_PIXELS:
+                return False
+            image.verify()
+    except Exception:
+        return False
+    return True
+
+# -------------------------------------------------------------------
+# Reference images for Gemini refinement
+# -------------------------------------------------------------------
+
+_prepared: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+_prepared_lock = threading.Lock()
+
+
+def _prepare_bytes(image_id: str, data: bytes) -> bytes:
+    """
+    Returns the downscaled, re-encoded bytes for a reference image. The
+    prepared image is stored like any other, keyed by the source hash, so
+    other workers and restarts skip the decode too.
+    """
+    kind = (
+        f"reference-{GEMINI_REFERENCE_FORMAT}-q{GEMINI_REFERENCE_QUALITY}"
+        f"-{GEMINI_REFERENCE_MAX_SIDE}"
+    )
+    manifest_path = _manifest_path(image_id, kind)
+    try:
+        prepared = get_image(json.loads(manifest_path.read_text(encoding="utf-8")))
+        if prepared is not None:
+            return prepared
+    except (FileNotFoundError, ValueError):
+        pass
+
+    try:
+        source = _open(data)
+        encoded, _ = _encode(
+            source, GEMINI_REFERENCE_MAX_SIDE, GEMINI_REFERENCE_FORMAT, GEMINI_REFERENCE_QUALITY
+        )
+    except Exception as exc:
+        # Send the original rather than fail the refinement
+        print(f"Reference image: preparing {image_id[:12]} failed ({exc!r})")
+        return data
+
+    # Already small, compact and in a format Gemini takes: re-encoding
+    # would only lose quality
+    if (
+        len(encoded) >= len(data)
+        and max(source.size) <= GEMINI_REFERENCE_MAX_SIDE
+        and sniff_mime_type(data) in VARIANT_MIME_TYPES.values()
+    ):
+        encoded = data
+
+    write_atomic(manifest_path, json.dumps(put_image(encoded)).encode("utf-8"))
+    print(f"Reference image: {image_id[:12]} {len(data)} B → {len(encoded)} B")
+    return encoded
+
+
+def prepare_reference_image(image_id: str) -> Optional[Dict[str, str]]:
+    """
+    Returns Gemini inline_data ({"mime_type", "data"}) for a stored image,
+    or None if there is no such image.
+
+    The image is decoded once, capped at GEMINI_REFERENCE_MAX_SIDE and
+    re-encoded; its MIME type comes from the actual bytes. Results are
+    cached by content hash, so repeated refinements of the same image skip
+    both the decode and the base64 encoding.
+    """
+    if not is_image_id(image_id):
+        return None
+
+    with _prepared_lock:
+        inline_data = _prepared.get(image_id)
+        if inline_data is not None:
+            _prepared.move_to_end(image_id)
+            return inline_data
+
+    data = get_image(image_id)
+    if data is None:
+        return None
+
+    prepared = _prepare_bytes(image_id, data)
+    inline_data = {
+        "mime_type": sniff_mime_type(prepared),
+        "data": base64.b64encode(prepared).decode("utf-8"),
+    }
+
+    with _prepared_lock:
+        _prepared[image_id] = inline_data
+        while len(_prepared) > REFERENCE_CACHE_SIZE:
+            _prepared.popitem(last=False)
+
+    return inline_data
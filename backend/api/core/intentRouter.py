@@ -0,0 +1,310 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from typing import List, Optional
+
+from decouple import config
+
+from .latencyMetrics import (
+    INTENT_CHECKS,
+    INTENT_DECISIONS,
+    INTENT_SAVED_SECONDS,
+    METRICS_ENABLED,
+)
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# "on": skip the tool-routing completion when confident no tool is needed
+# "shadow": decide and log, but always run the routing completion
+# "off": always run the routing completion
+# Shadow until the logged decisions show the router is precise enough
+INTENT_ROUTER_MODE = config("INTENT_ROUTER_MODE", default="shadow")
+
+# In "on" mode, this fraction of the turns the router would skip still
+# run the routing completion, so its precision keeps being checked
+INTENT_ROUTER_SAMPLE_RATE = config("INTENT_ROUTER_SAMPLE_RATE", default=0.05, cast=float)
+
+# Minimum P(no tool) from the model to skip the routing completion
+INTENT_ROUTER_THRESHOLD = config("INTENT_ROUTER_THRESHOLD", default=0.9, cast=float)
+
+# Append every decision as a JSON line here, message included (empty =
+# stdout only, without the message)
+INTENT_ROUTER_LOG_PATH = config("INTENT_ROUTER_LOG_PATH", default="")
+
+# Messages the model learns from routing completions per process, on top
+# of the seed examples (0 = seed examples only)
+INTENT_ROUTER_LEARN_MAX = config("INTENT_ROUTER_LEARN_MAX", default=1000, cast=int)
+
+# The model stops adding new words past this vocabulary size
+INTENT_MODEL_MAX_VOCAB = 20000
+
+# Initial guess for a routing completion, refined as they are timed
+ROUTING_EXPECTED_SECONDS = 1.0
+
+# -------------------------------------------------------------------
+# Rules
+# -------------------------------------------------------------------
+
+# Anything that may ask for a picture goes to the LLM (English + Danish)
+TOOL_HINT_RE = re.compile(
+    r"\b("
+    r"show|see|look|view|picture|pictures|pic|image|images|photo|photos|"
+    r"draw|drawing|paint|sketch|render|generate|visuali[sz]e|illustrat\w*|"
+    r"create|make|design|change|add|remove|replace|instead|again|another|"
+    r"brighter|darker|bigger|smaller|colou?r|style of|example|examples|"
+    r"vis|se|billede|billeder|foto|tegn|lav|ændr|tilføj|fjern|igen"
+    r")\b"
+)
+
+# Short social messages that never need a tool. No yes / no / ok: those
+# usually answer the assistant's question ("yes please", "no, the other one")
+CHITCHAT_WORDS = {
+    "thanks", "thank", "thx", "ty", "tak",
+    "hi", "hello", "hey", "hej", "goodbye", "bye", "farvel",
+    "cool", "nice", "great", "perfect", "wow",
+    "english", "danish", "dansk", "engelsk",
+}
+CHITCHAT_MAX_WORDS = 4
+
+WORD_RE = re.compile(r"[a-zæøå0-9']+")
+
+# -------------------------------------------------------------------
+# Learned model (multinomial naive Bayes, words + word pairs)
+# -------------------------------------------------------------------
+
+# Seed examples; the model keeps learning from routing completions, up to
+# INTENT_ROUTER_LEARN_MAX of them
+SEED_EXAMPLES = {
+    False: [
+        "thanks that is lovely",
+        "tell me more about that style",
+        "why did you choose that",
+        "what does biophilic mean",
+        "how would people use this space",
+        "what do you think about quiet zones",
+        "can you explain the idea behind it",
+        "who designed the original library",
+        "what year is it in the story",
+        "i like it",
+        "that sounds interesting",
+        "how much would it cost",
+        "what materials would you use",
+        "tell me about the history of dokk1",
+        "what is the future of libraries",
+        "how do children use the library",
+        "why is that sustainable",
+        "can you summarize what we discussed",
+        "let's continue in english",
+        "what else could be in the library",
+        "how does it feel to be there",
+        "is that realistic",
+        "what would the librarians do",
+        "i don't understand",
+        "fortæl mere om det",
+        "hvorfor det",
+        "hvad betyder det",
+        "det lyder godt",
+        "hvordan ville folk bruge rummet",
+        "tak for det",
+    ],
+    True: [
+        "show me a mid-century living room",
+        "show me what it looks like",
+        "can i see a picture of a reading room",
+        "draw a futuristic library",
+        "generate an image of a green rooftop",
+        "make it brighter",
+        "make the walls blue",
+        "add more plants",
+        "change the lighting to sunset",
+        "remove the chairs",
+        "what does a scandinavian library look like",
+        "photo of aarhus harbour",
+        "render a kids corner",
+        "visualize the maker space",
+        "give me another version",
+        "try again with more wood",
+        "a picture of the old library",
+        "show an example of brutalist architecture",
+        "design a quiet reading nook",
+        "create a concept for the entrance",
+        "vis mig et billede af biblioteket",
+        "tegn et fremtidigt bibliotek",
+        "lav det lysere",
+        "tilføj flere planter",
+        "hvordan ser det ud",
+    ],
+}
+
+
+def _features(text: str) -> List[str]:
+    words = WORD_RE.findall(text.casefold())
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+class IntentModel:
+    """P(a tool is needed | message), learned from labelled messages."""
+
+    def __init__(self):
+        self.counts = {True: Counter(), False: Counter()}
+        self.totals = {True: 0, False: 0}
+        self.docs = {True: 0, False: 0}
+        self.vocab = set()
+        self.learned = 0
+        self._lock = threading.Lock()
+
+    def learn(self, text: str, needs_tool: bool):
+        features = _features(text)
+        with self._lock:
+            for feature in features:
+                if feature not in self.vocab:
+                    if len(self.vocab) >= INTENT_MODEL_MAX_VOCAB:
+                        continue
+                    self.vocab.add(feature)
+                self.counts[needs_tool][feature] += 1
+                self.totals[needs_tool] += 1
+            self.docs[needs_tool] += 1
+
+    def p_tool(self, text: str) -> float:
+        features = [f for f in _features(text) if f in self.vocab]
+        with self._lock:
+            docs = self.docs[True] + self.docs[False]
+            vocab = len(self.vocab) or 1
+            scores = {}
+            for label in (True, False):
+                score = math.log((self.docs[label] + 1) / (docs + 2))
+                for feature in features:
+                    score += math.log(
+                        (self.counts[label][feature] + 1) / (self.totals[label] + vocab)
+                    )
+                scores[label] = score
+
+        # Two-class softmax
+        return 1.0 / (1.0 + math.exp(scores[False] - scores[True]))
+
+
+    def learn_online(self, text: str, needs_tool: bool):
+        """learn() from a routing completion, until INTENT_ROUTER_LEARN_MAX."""
+        with self._lock:
+            if self.learned >= INTENT_ROUTER_LEARN_MAX:
+                return
+            self.learned += 1
+        self.learn(text, needs_tool)
+
+
+intent_model = IntentModel()
+for _label, _examples in SEED_EXAMPLES.items():
+    for _example in _examples:
+        intent_model.learn(_example, _label)
+
+# -------------------------------------------------------------------
+# Decisions
+# -------------------------------------------------------------------
+
+class IntentDecision:
+    def __init__(self, skip: bool, reason: str, p_tool: Optional[float] = None):
+        # skip: the router predicts no tool is needed
+        self.skip = skip
+        self.reason = reason
+        self.p_tool = p_tool
+        # A predicted skip that runs the routing completion anyway, as a check
+        self.sampled = (
+            skip and INTENT_ROUTER_MODE == "on"
+            and random.random() < INTENT_ROUTER_SAMPLE_RATE
+        )
+
+    @property
+    def applied(self) -> bool:
+        """Whether the routing completion is actually skipped."""
+        return self.skip and INTENT_ROUTER_MODE == "on" and not self.sampled
+
+
+_routing_seconds = ROUTING_EXPECTED_SECONDS
+
+
+def _log(message: str, decision: IntentDecision, **extra):
+    record = {
+        "at": round(time.time(), 3),
+        "mode": INTENT_ROUTER_MODE,
+        "predicted": "skip" if decision.skip else "llm",
+        "reason": decision.reason,
+        "p_tool": None if decision.p_tool is None else round(decision.p_tool, 3),
+        "sampled": decision.sampled,
+        **extra,
+    }
+    # User text stays out of stdout (container logs)
+    print(f"Intent router: {json.dumps(record, ensure_ascii=False)}")
+
+    if INTENT_ROUTER_LOG_PATH:
+        record["message"] = message[:200]
+        try:
+            with open(INTENT_ROUTER_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as exc:
+            print(f"Intent router: could not write log: {exc!r}")
+
+
+def route_intent(message: str, has_reference_image: bool) -> IntentDecision:
+    """
+    Decides whether the turn can skip the tool-routing completion.
+
+    Rules first (picture words → LLM, a previous image in play → LLM,
+    since almost anything could be a refinement; short chitchat → skip),
+    then the model.
+    """
+    if INTENT_ROUTER_MODE == "off" or not message:
+        return IntentDecision(False, "off")
+
+    text = message.casefold()
+    words = WORD_RE.findall(text)
+
+    if TOOL_HINT_RE.search(text):
+        decision = IntentDecision(False, "rule:tool_hint")
+    elif has_reference_image:
+        decision = IntentDecision(False, "reference_image")
+    elif words and len(words) <= CHITCHAT_MAX_WORDS and words[0] in CHITCHAT_WORDS:
+        decision = IntentDecision(True, "rule:chitchat")
+    else:
+        p_tool = intent_model.p_tool(message)
+        skip = 1.0 - p_tool >= INTENT_ROUTER_THRESHOLD
+        decision = IntentDecision(skip, "model", p_tool)
+
+    if METRICS_ENABLED:
+        INTENT_DECISIONS.inc(
+            decision="skip" if decision.applied else "llm", reason=decision.reason
+        )
+
+    if decision.applied:
+        if METRICS_ENABLED:
+            INTENT_SAVED_SECONDS.inc(_routing_seconds)
+        _log(message, decision, saved_s=round(_routing_seconds, 3))
+
+    return decision
+
+
+def record_routing(message: str, decision: IntentDecision, used_tool: bool, seconds: float):
+    """
+    Called after a routing completion ran: the LLM's choice checks the
+    prediction (precision) and trains the model; the timing refines the
+    latency-saved estimate.
+    """
+    global _routing_seconds
+    _routing_seconds = 0.8 * _routing_seconds + 0.2 * seconds
+
+    if not message or decision.reason == "off":
+        return
+
+    if METRICS_ENABLED:
+        INTENT_CHECKS.inc(
+            predicted="skip" if decision.skip else "llm",
+            actual="tool" if used_tool else "no_tool",
+        )
+    _log(message, decision, actual="tool" if used_tool else "no_tool", routing_s=round(seconds, 3))
+
+    intent_model.learn_online(message, used_tool)
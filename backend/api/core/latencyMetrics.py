@@ -0,0 +1,357 @@
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from decouple import config
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+METRICS_ENABLED = config("METRICS_ENABLED", default=True, cast=bool)
+
+# /api/metrics answers loopback clients only unless this is set
+METRICS_ALLOW_REMOTE = config("METRICS_ALLOW_REMOTE", default=False, cast=bool)
+
+# Histogram bucket upper bounds (seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# -------------------------------------------------------------------
+# Prometheus-style metrics (per process)
+# -------------------------------------------------------------------
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values → [per-bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    labels = _format_labels(self.labelnames, key, f'le="{bound:g}"')
+                    lines.append(f"{self.name}_bucket{labels} {count:g}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {entry[-1]:g}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {entry[-2]:.6f}")
+                lines.append(f"{self.name}_count{labels} {entry[-1]:g}")
+        return lines
+
+
+METRICS: List[Any] = []
+
+
+def _register(metric):
+    METRICS.append(metric)
+    return metric
+
+
+PHASE_SECONDS = _register(Histogram(
+    "eva_phase_seconds",
+    "Duration of each phase of a chat turn.",
+    ("phase",),
+))
+TOOL_SECONDS = _register(Histogram(
+    "eva_tool_seconds",
+    "Duration of each tool call.",
+    ("tool", "outcome"),
+))
+TURN_SECONDS = _register(Histogram(
+    "eva_turn_seconds",
+    "Duration of a whole chat turn, request to [DONE].",
+    ("outcome",),
+))
+STREAM_CHUNK_INTERVAL_SECONDS = _register(Histogram(
+    "eva_stream_chunk_interval_seconds",
+    "Gap between consecutive narration text events.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+))
+STREAM_CHUNKS = _register(Counter(
+    "eva_stream_chunks_total",
+    "Narration text events sent.",
+))
+STREAM_BYTES = _register(Counter(
+    "eva_stream_bytes_total",
+    "Narration text bytes sent (UTF-8).",
+))
+SSE_FRAMES = _register(Counter(
+    "eva_sse_frames_total",
+    "SSE events (and comments) written, by content-encoding.",
+    ("encoding",),
+))
+SSE_WRITES = _register(Counter(
+    "eva_sse_writes_total",
+    "Flushed SSE response writes, by content-encoding (frames are batched).",
+    ("encoding",),
+))
+SSE_BYTES = _register(Counter(
+    "eva_sse_bytes_total",
+    "SSE response bytes before (raw) and after (sent) content-encoding.",
+    ("encoding", "stage"),
+))
+TOOL_CALLS_JOINED = _register(Counter(
+    "eva_tool_calls_joined_total",
+    "Tool calls that joined an identical call already in flight.",
+    ("tool",),
+))
+TURNS = _register(Counter(
+    "eva_turns_total",
+    "Chat turns by outcome.",
+    ("outcome",),
+))
+STREAM_RESUMES = _register(Counter(
+    "eva_stream_resumes_total",
+    "Reconnects with Last-Event-ID, by outcome.",
+    ("outcome",),
+))
+TURN_CACHE = _register(Counter(
+    "eva_turn_cache_total",
+    "Turn cache lookups (hit / miss) and stored turns.",
+    ("outcome",),
+))
+INTENT_DECISIONS = _register(Counter(
+    "eva_intent_router_decisions_total",
+    "Local intent router: turns that skipped or ran the tool-routing call.",
+    ("decision", "reason"),
+))
+INTENT_CHECKS = _register(Counter(
+    "eva_intent_router_checks_total",
+    "Router predictions checked against the tool-routing call that ran.",
+    ("predicted", "actual"),
+))
+INTENT_SAVED_SECONDS = _register(Counter(
+    "eva_intent_router_saved_seconds_total",
+    "Estimated tool-routing time saved by skipped calls.",
+))
+CACHE_STATS = _register(Gauge(
+    "eva_cache",
+    "SQLite caches: hits, misses, evictions (since start) and hit ratio.",
+    ("cache", "stat"),
+))
+UPSTREAM_CALLS = _register(Counter(
+    "eva_upstream_calls_total",
+    "Upstream requests by outcome (ok, error, rejected, circuit_open).",
+    ("upstream", "outcome"),
+))
+UPSTREAM_RETRIES = _register(Counter(
+    "eva_upstream_retries_total",
+    "Upstream requests retried after a 429 / 5xx / timeout.",
+    ("upstream",),
+))
+UPSTREAM_QUEUE_SECONDS = _register(Histogram(
+    "eva_upstream_queue_seconds",
+    "Wait for a rate-limit token before an upstream request.",
+    ("upstream",),
+))
+UPSTREAM_QUEUED = _register(Gauge(
+    "eva_upstream_queued",
+    "Requests currently waiting for a rate-limit token.",
+    ("upstream",),
+))
+UPSTREAM_TOKENS = _register(Gauge(
+    "eva_upstream_tokens",
+    "Rate-limit tokens left in the bucket (at last use).",
+    ("upstream",),
+))
+UPSTREAM_CIRCUIT = _register(Gauge(
+    "eva_upstream_circuit_state",
+    "Circuit breaker: 0 closed, 1 half-open, 2 open.",
+    ("upstream",),
+))
+AZURE_ROUTED = _register(Counter(
+    "eva_azure_routed_total",
+    "Azure completions by deployment, kind (complete, stream) and outcome.",
+    ("deployment", "kind", "outcome"),
+))
+AZURE_HEDGES = _register(Counter(
+    "eva_azure_hedges_total",
+    "Hedged Azure requests by which one answered first (primary, hedge, none).",
+    ("winner",),
+))
+AZURE_DEPLOYMENT_LATENCY = _register(Gauge(
+    "eva_azure_deployment_latency_seconds",
+    "Smoothed (EWMA) time to response per deployment and kind.",
+    ("deployment", "kind"),
+))
+AZURE_DEPLOYMENT_ERRORS = _register(Gauge(
+    "eva_azure_deployment_error_rate",
+    "Smoothed (EWMA) error rate per deployment.",
+    ("deployment",),
+))
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# -------------------------------------------------------------------
+# Timing spans (per turn)
+# -------------------------------------------------------------------
+
+class TurnTimings:
+    """
+    Spans recorded during one chat turn, in the order they ended.
+
+    Rendered as a Server-Timing header value and sent to the client as
+    the final "timing" event.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.spans.append((name, seconds))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        with self._lock:
+            return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans)
+
+    def as_dict(self) -> Dict[str, float]:
+        # Repeated spans (e.g. two searches) are summed
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for name, seconds in self.spans:
+                totals[name] = totals.get(name, 0.0) + seconds
+        return {name: round(seconds * 1000, 1) for name, seconds in totals.items()}
+
+
+# The turn being served; asyncio tasks and to_thread calls inherit it
+current_timings: contextvars.ContextVar[Optional[TurnTimings]] = contextvars.ContextVar(
+    "current_timings", default=None
+)
+
+
+def record_span(name: str, seconds: float):
+    if METRICS_ENABLED:
+        PHASE_SECONDS.observe(seconds, phase=name)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def span(name: str):
+    """Times the block as phase `name` (works around awaits too)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+@contextmanager
+def tool_span(tool: str):
+    """Like span(), plus the per-tool histogram with the call's outcome."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (TimeoutError, asyncio.TimeoutError):
+        outcome = "timeout"
+        raise
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        if METRICS_ENABLED:
+            TOOL_SECONDS.observe(seconds, tool=tool, outcome=outcome)
+        record_span(f"tool_{tool}", seconds)
+
+
+async def atime_first_delta(deltas: AsyncIterator[str], name: str) -> AsyncIterator[str]:
+    """Passes deltas through, recording the wait for the first one as `name`."""
+    started = time.perf_counter()
+    first = True
+    async for delta in deltas:
+        if first:
+            record_span(name, time.perf_counter() - started)
+            first = False
+        yield delta
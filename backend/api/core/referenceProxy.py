@@ -0,0 +1,200 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from decouple import config
+
+from .clientRegistry import get_reference_http_client
+from .imageStore import image_path, is_image_id, put_image, sniff_mime_type
+from .singleFlight import SingleFlight
+from .sqliteCache import SqliteCache
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Drop search candidates whose host doesn't serve an image quickly
+REFERENCE_PROBE_ENABLED = config("REFERENCE_PROBE_ENABLED", default=True, cast=bool)
+REFERENCE_PROBE_TIMEOUT = config("REFERENCE_PROBE_TIMEOUT", default=2.0, cast=float)
+REFERENCE_PROBE_CONCURRENCY = config("REFERENCE_PROBE_CONCURRENCY", default=10, cast=int)
+
+# Probe results are reused for this long (seconds)
+REFERENCE_PROBE_TTL = config("REFERENCE_PROBE_TTL", default=600.0, cast=float)
+REFERENCE_PROBE_CACHE_SIZE = 2000
+
+# Larger origin images are refused
+REFERENCE_MAX_BYTES = config("REFERENCE_MAX_BYTES", default=10 * 1024 * 1024, cast=int)
+
+REFERENCE_URL_PREFIX = "/api/references/"
+
+PROBE_BYTES = 1024
+
+probe_executor = ThreadPoolExecutor(
+    max_workers=REFERENCE_PROBE_CONCURRENCY,
+    thread_name_prefix="reference-probe",
+)
+
+# Proxy key → origin url (+ local image id once fetched), shared by workers
+reference_cache = SqliteCache(
+    path=config(
+        "REFERENCE_CACHE_PATH",
+        default=str(Path(__file__).resolve().parents[2] / ".cache" / "references.sqlite3"),
+    ),
+    table="reference_proxy",
+    ttl=config("REFERENCE_CACHE_TTL", default=7 * 24 * 3600, cast=float),
+    max_entries=config("REFERENCE_CACHE_MAX_ENTRIES", default=20000, cast=int),
+)
+
+
+class ReferenceFetchError(RuntimeError):
+    pass
+
+# -------------------------------------------------------------------
+# Helpers
+# -------------------------------------------------------------------
+
+def _is_image_bytes(head: bytes) -> bool:
+    # sniff_mime_type() falls back to PNG, so check the PNG magic explicitly
+    return head.startswith(b"\x89PNG") or sniff_mime_type(head) != "image/png"
+
+def reference_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+def reference_url(key: str) -> str:
+    return f"{REFERENCE_URL_PREFIX}{key}"
+
+# -------------------------------------------------------------------
+# Reachability probes (before candidates go to the LLM)
+# -------------------------------------------------------------------
+
+_probes: "OrderedDict[str, tuple]" = OrderedDict()
+_probes_lock = threading.Lock()
+
+
+def _probe(url: str) -> bool:
+    with _probes_lock:
+        cached = _probes.get(url)
+        if cached is not None and time.monotonic() - cached[1] < REFERENCE_PROBE_TTL:
+            return cached[0]
+
+    alive = False
+    try:
+        # A partial GET, not HEAD: many image hosts answer HEAD differently,
+        # and hotlink protection only shows in the body (an HTML page)
+        with get_reference_http_client().stream(
+            "GET",
+            url,
+            headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"},
+            timeout=REFERENCE_PROBE_TIMEOUT,
+        ) as response:
+            if response.status_code in (200, 206):
+                head = b""
+                for chunk in response.iter_bytes():
+                    head += chunk
+                    if len(head) >= 16:
+                        break
+                alive = _is_image_bytes(head)
+    except Exception as exc:
+        print(f"Reference probe: {url} failed ({type(exc).__name__})")
+
+    with _probes_lock:
+        _probes[url] = (alive, time.monotonic())
+        _probes.move_to_end(url)
+        while len(_probes) > REFERENCE_PROBE_CACHE_SIZE:
+            _probes.popitem(last=False)
+
+    return alive
+
+
+def filter_reachable(candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Probes every candidate url in parallel and keeps, in order, the ones
+    that answer with image bytes within REFERENCE_PROBE_TIMEOUT.
+    """
+    if not REFERENCE_PROBE_ENABLED or not candidates:
+        return candidates
+
+    started = time.perf_counter()
+    alive = list(probe_executor.map(_probe, [c["url"] for c in candidates]))
+    reachable = [c for c, ok in zip(candidates, alive) if ok]
+
+    print(
+        f"Reference probe: {len(reachable)}/{len(candidates)} reachable "
+        f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+    return reachable
+
+# -------------------------------------------------------------------
+# Proxy (chosen image is fetched once, then served locally)
+# -------------------------------------------------------------------
+
+# Concurrent requests for one image share a single origin fetch
+reference_fetches = SingleFlight("reference_fetch")
+
+
+def register_reference(url: str) -> str:
+    """Returns our proxy url for an origin image url."""
+    key = reference_key(url)
+    if reference_cache.get(key) is None:
+        reference_cache.set(key, {"url": url, "image_id": None})
+    return reference_url(key)
+
+
+def _download(url: str) -> bytes:
+    with get_reference_http_client().stream("GET", url) as response:
+        if response.status_code != 200:
+            raise ReferenceFetchError(f"origin answered {response.status_code}")
+
+        data = bytearray()
+        for chunk in response.iter_bytes():
+            data.extend(chunk)
+            if len(data) > REFERENCE_MAX_BYTES:
+                raise ReferenceFetchError("image too large")
+
+    if not _is_image_bytes(bytes(data[:16])):
+        raise ReferenceFetchError("origin did not return an image")
+    return bytes(data)
+
+
+def _fetch(key: str, entry: Dict[str, Any]) -> str:
+    # Another request may have fetched it since we looked
+    entry = reference_cache.get(key) or entry
+    if entry.get("image_id") and image_path(entry["image_id"]).exists():
+        return entry["image_id"]
+
+    started = time.perf_counter()
+    try:
+        image_id = put_image(_download(entry["url"]))
+        reference_cache.set(key, {"url": entry["url"], "image_id": image_id})
+    except ReferenceFetchError:
+        raise
+    except Exception as exc:
+        raise ReferenceFetchError(f"{type(exc).__name__}: {exc}") from exc
+
+    print(
+        f"Reference proxy: cached {entry['url']} "
+        f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+    return image_id
+
+
+def fetch_reference(key: str) -> Optional[str]:
+    """
+    Returns the local image id for a proxy key, fetching it from the origin
+    on first use. None if the key is unknown; raises ReferenceFetchError if
+    the origin fails. Concurrent requests for one key share a single fetch.
+    """
+    if not is_image_id(key):
+        return None
+
+    entry = reference_cache.get(key)
+    if entry is None:
+        return None
+    if entry.get("image_id") and image_path(entry["image_id"]).exists():
+        return entry["image_id"]
+
+    return reference_fetches.do(key, _fetch, key, entry)
@@ -0,0 +1,248 @@
+import asyncio
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Dict, Optional
+
+from decouple import config
+
+from .imageStore import image_url
+from .imageVariants import make_variants
+from .latencyMetrics import record_span
+from .toolRegistry import get_tool, load_tool
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Gemini renders run on this many worker threads per process
+RENDER_WORKERS = config("RENDER_WORKERS", default=2, cast=int)
+
+# Jobs waiting for a worker; more than this and new renders are refused
+RENDER_QUEUE_MAX = config("RENDER_QUEUE_MAX", default=16, cast=int)
+
+# Finished jobs stay available for polling / re-attach this long (seconds)
+RENDER_JOB_TTL = config("RENDER_JOB_TTL", default=3600.0, cast=float)
+
+# A render still running this long after it started is failed (seconds).
+# The render itself gets the same deadline (Gemini timeout and retries
+# included), so the worker thread is free again by then
+RENDER_TIMEOUT = config("TOOL_TIMEOUT_IMAGE", default=90.0, cast=float)
+
+# Initial guess for a render's duration, refined from finished renders
+RENDER_EXPECTED_SECONDS = config("RENDER_EXPECTED_SECONDS", default=15.0, cast=float)
+
+# How often a subscribed stream reports job progress (seconds)
+RENDER_PROGRESS_INTERVAL = config("RENDER_PROGRESS_INTERVAL", default=1.0, cast=float)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# -------------------------------------------------------------------
+# Jobs
+# -------------------------------------------------------------------
+
+class RenderQueueFull(RuntimeError):
+    pass
+
+
+class RenderJob:
+    def __init__(self, key: str, kwargs: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.kwargs = kwargs
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        # Resolved when the job finishes (either way); threads and event
+        # loops can both wait on it
+        self.future: Future = Future()
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+
+class RenderQueue:
+    """
+    Bounded queue of Gemini renders served by a small thread pool.
+
+    submit() returns at once with a job; the render, storage and variant
+    transcoding happen on a worker. An identical render already queued or
+    running is returned instead of starting another. Finished jobs are kept
+    for RENDER_JOB_TTL so a client can poll or re-attach after a disconnect.
+    Jobs live in this process only. A render that outlives RENDER_TIMEOUT
+    is reported failed; its late result is dropped.
+    """
+
+    def __init__(self, workers: int, max_queued: int, job_ttl: float):
+        self.workers = workers
+        self.job_ttl = job_ttl
+        self.expected_seconds = RENDER_EXPECTED_SECONDS
+
+        self._queue: "queue.Queue[RenderJob]" = queue.Queue(maxsize=max_queued)
+        self._jobs: "OrderedDict[str, RenderJob]" = OrderedDict()
+        self._active: Dict[str, RenderJob] = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start_workers(self):
+        # Started on first use: under gunicorn --preload that is after the
+        # fork, and threads don't survive a fork
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"render-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if not job.done or job.finished_at > cutoff:
+                break
+            self._jobs.popitem(last=False)
+
+    def submit(self, key: str, **kwargs) -> RenderJob:
+        # Fail now, not inside the job, if the tool can't load
+        load_tool("generate_image")
+
+        with self._lock:
+            self._start_workers()
+            self._prune()
+
+            active = self._active.get(key)
+            if active is not None:
+                return active
+
+            job = RenderJob(key, kwargs)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise RenderQueueFull("The image renderer is busy, try again shortly")
+
+            self._jobs[job.id] = job
+            self._active[key] = job
+            return job
+
+    def get(self, job_id: str) -> Optional[RenderJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.started_at = time.time()
+            job.status = JOB_RUNNING
+            record_span("render_queue_wait", job.started_at - job.created_at)
+
+            result, error = None, None
+            try:
+                image_id = get_tool("generate_image")(
+                    **job.kwargs, deadline=time.monotonic() + RENDER_TIMEOUT
+                )
+                result = {
+                    "image_id": image_id,
+                    "url": image_url(image_id),
+                    "variants": make_variants(image_id),
+                }
+                print(f"Generated image {image_id}")
+            except Exception as exc:
+                print(f"Render job {job.id} failed: {exc!r}")
+                error = str(exc) or type(exc).__name__
+
+            finished_at = time.time()
+            seconds = finished_at - job.started_at
+            record_span("render", seconds)
+
+            with self._lock:
+                # Already failed by _expire: too late for anyone waiting
+                settled = not job.done
+                if settled:
+                    job.result, job.error = result, error
+                    job.status = JOB_FAILED if result is None else JOB_DONE
+                    job.finished_at = finished_at
+                if result is not None:
+                    # Smoothed, so one slow render doesn't skew estimates
+                    self.expected_seconds = 0.8 * self.expected_seconds + 0.2 * seconds
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+
+            if settled:
+                job.future.set_result(job.status)
+            self._queue.task_done()
+
+    def _expire(self, job: RenderJob):
+        """Fails a job that has been rendering for longer than RENDER_TIMEOUT."""
+        with self._lock:
+            if job.status != JOB_RUNNING or time.time() - job.started_at < RENDER_TIMEOUT:
+                return
+            job.status = JOB_FAILED
+            job.error = "The image took too long to render"
+            job.finished_at = time.time()
+            # An identical request starts a fresh render
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+
+        print(f"Render job {job.id} timed out after {RENDER_TIMEOUT:.0f}s")
+        job.future.set_result(job.status)
+
+    def snapshot(self, job: RenderJob) -> Dict[str, Any]:
+        """Public view of a job (status endpoint, stream events)."""
+        self._expire(job)
+        snapshot = {
+            "job_id": job.id,
+            "status": job.status,
+        }
+
+        if job.status == JOB_QUEUED:
+            with self._lock:
+                snapshot["queue_position"] = sum(
+                    1 for other in self._active.values()
+                    if other.status == JOB_QUEUED and other.created_at <= job.created_at
+                )
+            snapshot["progress"] = 0.0
+        elif job.status == JOB_RUNNING:
+            # Gemini reports no progress: estimate from typical render time
+            elapsed = time.time() - job.started_at
+            snapshot["progress"] = round(min(elapsed / self.expected_seconds, 0.95), 2)
+        elif job.status == JOB_DONE:
+            snapshot["progress"] = 1.0
+            snapshot.update(job.result)
+        else:
+            snapshot["error"] = job.error
+
+        return snapshot
+
+    async def awatch(self, job: RenderJob) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yields a snapshot every RENDER_PROGRESS_INTERVAL while the job is
+        pending, then the final one as soon as it finishes. Never blocks
+        the event loop.
+        """
+        finished = asyncio.wrap_future(job.future)
+        while True:
+            try:
+                await asyncio.wait_for(asyncio.shield(finished), RENDER_PROGRESS_INTERVAL)
+                break
+            except asyncio.TimeoutError:
+                yield self.snapshot(job)
+        yield self.snapshot(job)
+
+
+render_queue = RenderQueue(
+    workers=RENDER_WORKERS,
+    max_queued=RENDER_QUEUE_MAX,
+    job_ttl=RENDER_JOB_TTL,
+)
@@ -0,0 +1,428 @@
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from decouple import config
+
+from .latencyMetrics import (
+    METRICS_ENABLED,
+    UPSTREAM_CALLS,
+    UPSTREAM_CIRCUIT,
+    UPSTREAM_QUEUE_SECONDS,
+    UPSTREAM_QUEUED,
+    UPSTREAM_RETRIES,
+    UPSTREAM_TOKENS,
+)
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Rate limits, retries and circuit breakers around Azure, Gemini, SerpAPI
+RESILIENCE_ENABLED = config("RESILIENCE_ENABLED", default=True, cast=bool)
+
+# Retries after a 429 / 5xx / timeout / connection error
+UPSTREAM_RETRIES_MAX = config("UPSTREAM_RETRIES", default=2, cast=int)
+UPSTREAM_RETRY_BASE = config("UPSTREAM_RETRY_BASE", default=0.5, cast=float)
+
+# Longest wait before a retry (seconds); a longer Retry-After gives up
+UPSTREAM_RETRY_MAX_DELAY = config("UPSTREAM_RETRY_MAX_DELAY", default=8.0, cast=float)
+
+# Consecutive failures that open the circuit, and how long it stays open
+CIRCUIT_FAILURES = config("CIRCUIT_FAILURES", default=5, cast=int)
+CIRCUIT_COOLDOWN = config("CIRCUIT_COOLDOWN", default=30.0, cast=float)
+
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Shown to the user when an upstream is refused locally
+UPSTREAM_LABELS = {
+    "azure": "The assistant",
+    "gemini": "The image generator",
+    "serpapi": "Image search",
+}
+
+# -------------------------------------------------------------------
+# Errors
+# -------------------------------------------------------------------
+
+class UpstreamUnavailable(RuntimeError):
+    """Refused without calling the upstream (circuit open or queue full)."""
+
+    def __init__(self, upstream: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def _status(exc: Exception) -> Optional[int]:
+    # openai: status_code; google-genai: code; requests / httpx: response
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    value = getattr(getattr(exc, "response", None), "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    status = _status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    # SDK-specific timeout / connection errors, without importing the SDKs
+    name = type(exc).__name__
+    return "Timeout" in name or "Connect" in name
+
+# -------------------------------------------------------------------
+# Building blocks
+# -------------------------------------------------------------------
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """Takes a token and returns 0, or returns the wait until one is free."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class CircuitBreaker:
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+    def __init__(self, failures: int, cooldown: float):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> Tuple[Optional[float], bool]:
+        """
+        (None, probe) if a request may go out, probe being True for the
+        half-open trial request; else (seconds until one may, False).
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    return remaining, False
+                self.state = self.HALF_OPEN
+                self._probing = False
+
+            if self.state == self.HALF_OPEN:
+                # One trial request; everyone else keeps failing fast
+                if self._probing:
+                    return self.cooldown, False
+                self._probing = True
+                return None, True
+            return None, False
+
+    def release(self):
+        """Ends a trial request that got no answer (cancelled, or refused locally)."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.state == self.HALF_OPEN or self.consecutive >= self.failures:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+# -------------------------------------------------------------------
+# Upstream guard
+# -------------------------------------------------------------------
+
+class Upstream:
+    """
+    Wraps calls to one upstream: circuit breaker → rate-limit token
+    (waiting in a bounded queue, up to queue_timeout) → call → retry with
+    jittered exponential backoff, or the server's Retry-After.
+
+    Refusals raise UpstreamUnavailable; a failed call re-raises the
+    upstream's own exception. An optional deadline (time.monotonic())
+    bounds the whole call: no token wait or retry is started that would
+    end past it. State is per process.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        queue_max: int,
+        queue_timeout: float,
+        retries: int = UPSTREAM_RETRIES_MAX,
+        failures: int = CIRCUIT_FAILURES,
+        cooldown: float = CIRCUIT_COOLDOWN,
+    ):
+        self.name = name
+        self.label = UPSTREAM_LABELS.get(name.partition(":")[0], name)
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.queue_max = queue_max
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.breaker = CircuitBreaker(failures, cooldown)
+
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    # ---- metrics
+
+    def _count(self, outcome: str):
+        if METRICS_ENABLED:
+            UPSTREAM_CALLS.inc(upstream=self.name, outcome=outcome)
+
+    def _publish(self):
+        if METRICS_ENABLED:
+            UPSTREAM_QUEUED.set(self.waiting, upstream=self.name)
+            UPSTREAM_CIRCUIT.set(self.breaker.state, upstream=self.name)
+            if self.bucket is not None:
+                UPSTREAM_TOKENS.set(round(self.bucket.tokens, 2), upstream=self.name)
+
+    # ---- steps shared by call() and acall()
+
+    def _check_circuit(self) -> bool:
+        """Raises if the circuit refuses; returns whether this is the trial request."""
+        wait, probe = self.breaker.allow()
+        self._publish()
+        if wait is not None:
+            self._count("circuit_open")
+            raise UpstreamUnavailable(
+                self.name,
+                f"{self.label} is temporarily unavailable, please try again shortly",
+                retry_after=wait,
+            )
+        return probe
+
+    def _enter_queue(self):
+        with self._lock:
+            if self.waiting >= self.queue_max:
+                self._count("rejected")
+                raise UpstreamUnavailable(
+                    self.name, f"{self.label} is busy right now, please try again in a moment"
+                )
+            self.waiting += 1
+        self._publish()
+
+    def _leave_queue(self, started: float):
+        with self._lock:
+            self.waiting -= 1
+        self._publish()
+        if METRICS_ENABLED:
+            UPSTREAM_QUEUE_SECONDS.observe(time.monotonic() - started, upstream=self.name)
+
+    def _token_wait(self, deadline: float) -> float:
+        """Seconds to sleep before trying again (0 = token taken)."""
+        wait = self.bucket.take()
+        if wait and time.monotonic() + wait > deadline:
+            self._count("rejected")
+            raise UpstreamUnavailable(
+                self.name,
+                f"{self.label} is busy right now, please try again in a moment",
+                retry_after=wait,
+            )
+        return wait
+
+    def _retry_delay(
+        self, exc: Exception, attempt: int, deadline: Optional[float] = None
+    ) -> Optional[float]:
+        """Delay before the next attempt, or None to give up (re-raise)."""
+        if not is_retryable(exc):
+            # The request itself is wrong, but the upstream answered: healthy
+            self.breaker.success()
+            self._publish()
+            self._count("error")
+            return None
+
+        self.breaker.failure()
+        self._publish()
+
+        retry_after = _retry_after(exc)
+        delay = (
+            retry_after if retry_after is not None
+            else random.uniform(0, UPSTREAM_RETRY_BASE * 2 ** attempt)
+        )
+        if attempt >= self.retries or delay > UPSTREAM_RETRY_MAX_DELAY:
+            self._count("error")
+            return None
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            self._count("error")
+            return None
+
+        print(f"{self.name}: {type(exc).__name__} ({_status(exc)}), retry {attempt + 1} in {delay:.2f}s")
+        if METRICS_ENABLED:
+            UPSTREAM_RETRIES.inc(upstream=self.name)
+        return delay
+
+    def _succeeded(self):
+        self.breaker.success()
+        self._publish()
+        self._count("ok")
+
+    # ---- entry points
+
+    def call(self, fn: Callable[..., Any], *args, deadline: Optional[float] = None, **kwargs) -> Any:
+        if not RESILIENCE_ENABLED:
+            return fn(*args, **kwargs)
+
+        attempt = 0
+        while True:
+            probe = self._check_circuit()
+            settled = False
+            try:
+                if self.bucket is not None:
+                    started = time.monotonic()
+                    queue_deadline = started + self.queue_timeout
+                    if deadline is not None:
+                        queue_deadline = min(queue_deadline, deadline)
+                    self._enter_queue()
+                    try:
+                        while wait := self._token_wait(queue_deadline):
+                            time.sleep(wait)
+                    finally:
+                        self._leave_queue(started)
+
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as exc:
+                    settled = True
+                    delay = self._retry_delay(exc, attempt, deadline)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+
+                settled = True
+                self._succeeded()
+                return result
+            finally:
+                # Refused locally or interrupted: the trial told us nothing
+                if probe and not settled:
+                    self.breaker.release()
+
+    async def acall(self, fn: Callable[..., Awaitable[Any]], *args, deadline: Optional[float] = None, **kwargs) -> Any:
+        if not RESILIENCE_ENABLED:
+            return await fn(*args, **kwargs)
+
+        attempt = 0
+        while True:
+            probe = self._check_circuit()
+            settled = False
+            try:
+                if self.bucket is not None:
+                    started = time.monotonic()
+                    queue_deadline = started + self.queue_timeout
+                    if deadline is not None:
+                        queue_deadline = min(queue_deadline, deadline)
+                    self._enter_queue()
+                    try:
+                        while wait := self._token_wait(queue_deadline):
+                            await asyncio.sleep(wait)
+                    finally:
+                        self._leave_queue(started)
+
+                try:
+                    result = await fn(*args, **kwargs)
+                except Exception as exc:
+                    settled = True
+                    delay = self._retry_delay(exc, attempt, deadline)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+
+                settled = True
+                self._succeeded()
+                return result
+            finally:
+                # Cancelled (lost hedge, client gone) or refused locally:
+                # the trial told us nothing, let the next request try
+                if probe and not settled:
+                    self.breaker.release()
+
+
+def _upstream(
+    name: str,
+    rate: float,
+    burst: int,
+    queue_max: int,
+    queue_timeout: float,
+    prefix: str = "",
+    retries: int = UPSTREAM_RETRIES_MAX,
+) -> Upstream:
+    # e.g. AZURE_RATE_LIMIT (requests / second, 0 = unlimited), AZURE_BURST,
+    # AZURE_QUEUE_MAX, AZURE_QUEUE_TIMEOUT (seconds)
+    prefix = prefix or name.upper()
+    return Upstream(
+        name,
+        rate=config(f"{prefix}_RATE_LIMIT", default=rate, cast=float),
+        burst=config(f"{prefix}_BURST", default=burst, cast=int),
+        queue_max=config(f"{prefix}_QUEUE_MAX", default=queue_max, cast=int),
+        queue_timeout=config(f"{prefix}_QUEUE_TIMEOUT", default=queue_timeout, cast=float),
+        retries=retries,
+    )
+
+
+AZURE_LIMITS = {"rate": 20.0, "burst": 40, "queue_max": 200, "queue_timeout": 10.0}
+
+upstreams = {
+    "azure": _upstream("azure", **AZURE_LIMITS),
+    "gemini": _upstream("gemini", rate=0.5, burst=4, queue_max=16, queue_timeout=30.0),
+    "serpapi": _upstream("serpapi", rate=2.0, burst=5, queue_max=20, queue_timeout=5.0),
+}
+
+
+def deployment_upstream(deployment: str, retries: int = UPSTREAM_RETRIES_MAX) -> Upstream:
+    """
+    Guard for one deployment of an Azure pool (see azureRouter): same
+    AZURE_* settings, but its own quota, queue and circuit.
+    """
+    name = f"azure:{deployment}"
+    if name not in upstreams:
+        upstreams[name] = _upstream(name, prefix="AZURE", retries=retries, **AZURE_LIMITS)
+    return upstreams[name]
@@ -0,0 +1,125 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from decouple import config
+
+from .sqliteCache import SqliteCache
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+SESSION_MAX_ACTIVE = config("SESSION_MAX_ACTIVE", default=1000, cast=int)
+SESSION_TTL = config("SESSION_TTL", default=24 * 3600, cast=float)
+
+# "memory" (per worker) or "sqlite" (shared by workers, survives restarts)
+SESSION_BACKING = config("SESSION_BACKING", default="memory")
+
+# -------------------------------------------------------------------
+# Helpers
+# -------------------------------------------------------------------
+
+def to_message_dict(message) -> Dict[str, Any]:
+    """Converts SDK message objects (e.g. tool-call turns) to plain dicts."""
+    if isinstance(message, dict):
+        return message
+    return message.model_dump(exclude_none=True)
+
+# -------------------------------------------------------------------
+# Session store
+# -------------------------------------------------------------------
+
+class SessionStore:
+    """
+    Conversation turns per session id, without the system prompt.
+
+    Active sessions live in an in-memory LRU. An optional backing store
+    (anything with get(key) / set(key, value), e.g. SqliteCache) receives
+    every write and is consulted when a session is not in memory.
+    """
+
+    def __init__(self, max_sessions: int, ttl: float, backing=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.backing = backing
+
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _remember(self, session_id: str, messages: List[Dict[str, Any]]):
+        self._sessions[session_id] = {
+            "messages": messages,
+            "expires_at": time.time() + self.ttl,
+        }
+        self._sessions.move_to_end(session_id)
+
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and entry["expires_at"] >= time.time():
+                self._sessions.move_to_end(session_id)
+                return list(entry["messages"])
+            self._sessions.pop(session_id, None)
+
+        if self.backing is None:
+            return None
+
+        messages = self.backing.get(session_id)
+        if messages is None:
+            return None
+
+        with self._lock:
+            self._remember(session_id, messages)
+        return list(messages)
+
+    def create(self, messages: Optional[List[Dict[str, Any]]] = None) -> str:
+        session_id = uuid.uuid4().hex
+        self.save(session_id, messages or [])
+        return session_id
+
+    def save(self, session_id: str, messages: List[Dict[str, Any]]):
+        messages = [to_message_dict(m) for m in messages]
+        with self._lock:
+            self._remember(session_id, messages)
+        if self.backing is not None:
+            self.backing.set(session_id, messages)
+
+    def append(self, session_id: str, messages: List[Dict[str, Any]]):
+        """Adds one turn's messages after whatever is stored now."""
+        with self._lock:
+            stored = self.get(session_id) or []
+            self.save(session_id, stored + list(messages))
+
+    def compact(self, session_id: str, drop: int, head: List[Dict[str, Any]]):
+        """
+        Replaces the first `drop` stored messages with `head` (e.g. a
+        rolling summary). Turns appended meanwhile are kept, since appends
+        only ever add to the end.
+        """
+        with self._lock:
+            stored = self.get(session_id)
+            if stored is None or len(stored) < drop:
+                return
+            self.save(session_id, list(head) + stored[drop:])
+
+
+session_store = SessionStore(
+    max_sessions=SESSION_MAX_ACTIVE,
+    ttl=SESSION_TTL,
+    backing=SqliteCache(
+        path=config(
+            "SESSION_STORE_PATH",
+            default=str(Path(__file__).resolve().parents[2] / ".cache" / "sessions.sqlite3"),
+        ),
+        table="chat_sessions",
+        ttl=SESSION_TTL,
+        max_entries=config("SESSION_STORE_MAX_ENTRIES", default=20000, cast=int),
+    ) if SESSION_BACKING == "sqlite" else None,
+)
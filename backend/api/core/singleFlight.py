@@ -0,0 +1,171 @@
+import asyncio
+import copy
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from decouple import config
+
+from .latencyMetrics import METRICS_ENABLED, TOOL_CALLS_JOINED
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Join concurrent identical tool calls on one upstream request
+SINGLE_FLIGHT_ENABLED = config("SINGLE_FLIGHT_ENABLED", default=True, cast=bool)
+
+# -------------------------------------------------------------------
+# Single flight
+# -------------------------------------------------------------------
+
+class _Call:
+    __slots__ = ("future", "waiters", "task", "loop")
+
+    def __init__(self):
+        # A concurrent Future, so threads and any event loop can wait on it
+        self.future: Future = Future()
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; callers that arrive while it
+    is in flight wait for it and share its result (or exception).
+
+    Nothing is cached: once the call finishes, the next caller starts a
+    new one. Joiners get a deep copy, so nobody mutates another request's
+    result.
+
+    Works from threads (do) and from async tasks (ado), mixed freely.
+    An async caller that is cancelled just stops waiting; the shared call
+    is only cancelled when no one is left waiting for it.
+    """
+
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: str) -> Optional[_Call]:
+        call = self._calls.get(key)
+        if call is not None:
+            call.waiters += 1
+            if METRICS_ENABLED:
+                TOOL_CALLS_JOINED.inc(tool=self.name)
+        return call
+
+    def _finish(self, key: str, call: _Call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    # ---------------------------------------------------------------
+    # Threads
+    # ---------------------------------------------------------------
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        if not self.enabled:
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            call = self._join(key)
+            if call is None:
+                call = _Call()
+                call.waiters = 1
+                self._calls[key] = call
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            try:
+                return copy.deepcopy(call.future.result())
+            finally:
+                with self._lock:
+                    call.waiters -= 1
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            call.future.set_exception(exc)
+            raise
+        else:
+            call.future.set_result(result)
+            return result
+        finally:
+            self._finish(key, call)
+
+    # ---------------------------------------------------------------
+    # Async tasks
+    # ---------------------------------------------------------------
+
+    async def _lead(self, key: str, call: _Call, fn, args, kwargs):
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            call.future.cancel()
+            raise
+        except BaseException as exc:
+            call.future.set_exception(exc)
+        else:
+            call.future.set_result(result)
+        finally:
+            self._finish(key, call)
+
+    async def ado(self, key: str, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        if not self.enabled:
+            return await fn(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            call = self._join(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                call.waiters = 1
+                call.loop = loop
+                # The upstream call runs in its own task, so the caller that
+                # started it can go away without failing everyone else
+                call.task = loop.create_task(self._lead(key, call, fn, args, kwargs))
+                self._calls[key] = call
+
+        waiter = asyncio.wrap_future(call.future)
+        cancelled = False
+        try:
+            result = await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            cancelled = True
+            # Stop waiting without leaving an unretrieved exception behind
+            waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+            with self._lock:
+                call.waiters -= 1
+                # Only async leaders can be cancelled (threads can't)
+                abandoned = (
+                    call.waiters == 0
+                    and call.task is not None
+                    and not call.future.done()
+                )
+                if abandoned and self._calls.get(key) is call:
+                    # Nobody can join a call that is about to be cancelled
+                    del self._calls[key]
+            if abandoned:
+                call.loop.call_soon_threadsafe(call.task.cancel)
+            raise
+        finally:
+            if not cancelled:
+                with self._lock:
+                    call.waiters -= 1
+
+        return result if leader else copy.deepcopy(result)
+
+
+# generate_image is deduplicated by the render queue instead (see renderJobs)
+tool_flights = {
+    "fetch_reference_images": SingleFlight("fetch_reference_images", SINGLE_FLIGHT_ENABLED),
+}
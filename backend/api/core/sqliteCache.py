@@ -0,0 +1,143 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# -------------------------------------------------------------------
+# SQLite-backed TTL + LRU cache
+# -------------------------------------------------------------------
+
+def make_cache_key(payload: Dict[str, Any]) -> str:
+    """Stable key for a JSON-serializable dict of parameters."""
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# Every cache built in this process, by table (see cache_stats())
+caches: Dict[str, "SqliteCache"] = {}
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {table: cache.stats() for table, cache in sorted(caches.items())}
+
+
+class SqliteCache:
+    """
+    Small key → JSON value cache stored in a SQLite file.
+
+    The file is shared by every gunicorn worker and survives restarts.
+    Entries expire after ttl seconds; once more than max_entries are
+    stored, the least recently used ones are evicted.
+
+    Hit / miss / eviction counters are per process (see stats()).
+    """
+
+    def __init__(self, path: str, table: str, ttl: float, max_entries: int):
+        self.path = Path(path)
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        caches[table] = self
+
+    # ---------------------------------------------------------------
+    # Connection handling (one connection per thread)
+    # ---------------------------------------------------------------
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, "
+                "last_access REAL NOT NULL)"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_last_access "
+                f"ON {self.table} (last_access)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    # ---------------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        conn = self._connection()
+
+        row = conn.execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?",
+            (key,),
+        ).fetchone()
+
+        if row is None or row[1] < now:
+            if row is not None:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._count("misses")
+            return None
+
+        conn.execute(
+            f"UPDATE {self.table} SET last_access = ? WHERE key = ?",
+            (now, key),
+        )
+        self._count("hits")
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        conn = self._connection()
+
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access) "
+            "VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), expires_at, now),
+        )
+        self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+
+        (count,) = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY last_access LIMIT ?)",
+                (overflow,),
+            )
+            self._count("evictions", overflow)
+
+    def clear(self):
+        self._connection().execute(f"DELETE FROM {self.table}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+        }
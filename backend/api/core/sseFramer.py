@@ -0,0 +1,289 @@
+import asyncio
+import importlib.util
+import json
+import zlib
+from typing import Any, AsyncIterator, Dict
+
+from decouple import Csv, config
+
+from .latencyMetrics import METRICS_ENABLED, SSE_BYTES, SSE_FRAMES, SSE_WRITES
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Exactly the original wire format, for clients that match on the raw
+# bytes: json.dumps, one write per event, no compression, no "id:" lines
+# (turn replay off) and no heartbeat comments
+SSE_COMPAT_MODE = config("SSE_COMPAT_MODE", default=False, cast=bool)
+
+# Flush once this many UTF-8 bytes are buffered (0 = forward every delta)
+STREAM_FLUSH_BYTES = config("STREAM_FLUSH_BYTES", default=48, cast=int)
+
+# Flush whatever is buffered after this many seconds, even if small
+STREAM_FLUSH_INTERVAL = config("STREAM_FLUSH_INTERVAL", default=0.05, cast=float)
+
+# Optional artificial delay after each emitted frame (0 = off, client smooths)
+STREAM_PACING_DELAY = config("STREAM_PACING_DELAY", default=0.0, cast=float)
+
+# Send an SSE comment when nothing else was sent for this long (seconds),
+# so proxies don't drop the connection during long tool phases
+# (None = never)
+SSE_HEARTBEAT_INTERVAL = None if SSE_COMPAT_MODE else config(
+    "SSE_HEARTBEAT_INTERVAL", default=15.0, cast=float
+)
+
+# Event JSON: "orjson" (faster, needs the optional package) or "json"
+SSE_JSON = config("SSE_JSON", default="orjson")
+SSE_ORJSON = (
+    not SSE_COMPAT_MODE
+    and SSE_JSON == "orjson"
+    and importlib.util.find_spec("orjson") is not None
+)
+
+# Events produced close together go out in one write: up to this many
+# bytes, held at most this long (seconds). 0 bytes = one write per event
+SSE_BATCH_BYTES = config("SSE_BATCH_BYTES", default=16 * 1024, cast=int)
+SSE_BATCH_INTERVAL = config("SSE_BATCH_INTERVAL", default=0.01, cast=float)
+
+# Content-encodings offered, in order of preference ("br" needs the
+# optional brotli package); each write is flushed, so events still arrive
+# one by one
+SSE_COMPRESSION = [] if SSE_COMPAT_MODE else [
+    encoding for encoding in config("SSE_COMPRESSION", default="br,gzip", cast=Csv())
+    if encoding == "gzip" or (encoding == "br" and importlib.util.find_spec("brotli") is not None)
+]
+SSE_GZIP_LEVEL = config("SSE_GZIP_LEVEL", default=6, cast=int)
+SSE_BROTLI_QUALITY = config("SSE_BROTLI_QUALITY", default=5, cast=int)
+
+if SSE_ORJSON:
+    import orjson
+
+# -------------------------------------------------------------------
+# SSE helpers
+# -------------------------------------------------------------------
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    if SSE_ORJSON:
+        try:
+            return f"data: {orjson.dumps(payload).decode('utf-8')}\n\n"
+        except TypeError:
+            # e.g. an int beyond 64 bits; json copes
+            pass
+    return f"data: {json.dumps(payload)}\n\n"
+
+def sse_comment(text: str = "keepalive") -> str:
+    return f": {text}\n\n"
+
+# -------------------------------------------------------------------
+# Delta coalescing
+# -------------------------------------------------------------------
+
+async def acoalesce_deltas(
+    deltas: AsyncIterator[str],
+    max_bytes: int = STREAM_FLUSH_BYTES,
+    flush_interval: float = STREAM_FLUSH_INTERVAL,
+    pacing_delay: float = STREAM_PACING_DELAY,
+) -> AsyncIterator[str]:
+    """
+    Merges upstream text deltas into larger frames.
+
+    A frame is emitted as soon as max_bytes are buffered, or when
+    flush_interval seconds have passed since the first buffered delta,
+    whichever comes first. The interval is enforced with a timer, so a
+    stalled upstream never holds back text that already arrived.
+    """
+    loop = asyncio.get_running_loop()
+
+    # One reader task for the whole stream fills the queue (not a task per
+    # delta); the flush timer is a deadline on the queue read
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def read():
+        error = None
+        try:
+            async for delta in deltas:
+                queue.put_nowait((delta, None))
+        except Exception as exc:
+            error = exc
+        finally:
+            queue.put_nowait((finished, error))
+
+    buffer = []
+    buffered_bytes = 0
+    deadline = None
+
+    async def emit():
+        nonlocal buffer, buffered_bytes, deadline
+        frame = "".join(buffer)
+        buffer, buffered_bytes, deadline = [], 0, None
+        if pacing_delay > 0:
+            await asyncio.sleep(pacing_delay)
+        return frame
+
+    reader = asyncio.ensure_future(read())
+    try:
+        while True:
+            try:
+                async with asyncio.timeout_at(deadline):
+                    delta, error = await queue.get()
+            except TimeoutError:
+                # Interval elapsed while waiting on upstream → flush what we have
+                yield await emit()
+                continue
+
+            if delta is finished:
+                if error is not None:
+                    raise error
+                break
+
+            if not delta:
+                continue
+
+            buffer.append(delta)
+            buffered_bytes += len(delta.encode("utf-8"))
+            if deadline is None:
+                deadline = loop.time() + flush_interval
+
+            if buffered_bytes >= max_bytes:
+                yield await emit()
+
+        if buffer:
+            yield await emit()
+
+    finally:
+        reader.cancel()
+
+
+# -------------------------------------------------------------------
+# Stream merging
+# -------------------------------------------------------------------
+
+async def amerge(*streams: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """
+    Yields items from several async iterators as soon as each produces
+    them. Ends when all are exhausted; an exception in any of them is
+    raised here. Closing the merged iterator cancels the rest.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def pump(stream):
+        error = None
+        try:
+            async for item in stream:
+                queue.put_nowait((item, None))
+        except Exception as exc:
+            error = exc
+        finally:
+            # Even when cancelled, or the merge would wait for it forever
+            queue.put_nowait((finished, error))
+
+    tasks = [asyncio.ensure_future(pump(stream)) for stream in streams]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is finished:
+                remaining -= 1
+                continue
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# -------------------------------------------------------------------
+# Transport (batching + content-encoding)
+# -------------------------------------------------------------------
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """The preferred SSE_COMPRESSION the client accepts, or "" (identity)."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.strip().lower()] = q
+
+    for encoding in SSE_COMPRESSION:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return ""
+
+
+class SSEEncoder:
+    """
+    Turns batches of frames into response chunks. With an encoding, every
+    chunk ends in a flush, so the client can decode it right away.
+    """
+
+    def __init__(self, encoding: str = ""):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(SSE_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == "br":
+            import brotli
+
+            self._compressor = brotli.Compressor(quality=SSE_BROTLI_QUALITY)
+        else:
+            self._compressor = None
+
+    def encode(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        if self.encoding == "gzip":
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        elif self.encoding == "br":
+            data = self._compressor.process(data) + self._compressor.flush()
+        return data
+
+    def finish(self) -> bytes:
+        if self.encoding == "gzip":
+            return self._compressor.flush()
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return b""
+
+
+async def aencode_stream(frames: AsyncIterator[str], encoding: str = "") -> AsyncIterator[bytes]:
+    """
+    The bytes of an SSE response: frames batched into fewer writes (unless
+    SSE_COMPAT_MODE or SSE_BATCH_BYTES=0) and compressed with `encoding`.
+    Counts frames, writes and bytes before / after encoding.
+    """
+    encoder = SSEEncoder(encoding)
+    label = encoding or "identity"
+
+    if SSE_COMPAT_MODE or SSE_BATCH_BYTES <= 0:
+        batches = frames
+    else:
+        batches = acoalesce_deltas(
+            frames,
+            max_bytes=SSE_BATCH_BYTES,
+            flush_interval=SSE_BATCH_INTERVAL,
+            pacing_delay=0.0,
+        )
+
+    async for text in batches:
+        data = encoder.encode(text)
+        if METRICS_ENABLED:
+            SSE_FRAMES.inc(text.count("\n\n"), encoding=label)
+            SSE_WRITES.inc(encoding=label)
+            SSE_BYTES.inc(len(text.encode("utf-8")), encoding=label, stage="raw")
+            SSE_BYTES.inc(len(data), encoding=label, stage="sent")
+        yield data
+
+    tail = encoder.finish()
+    if tail:
+        if METRICS_ENABLED:
+            SSE_BYTES.inc(len(tail), encoding=label, stage="sent")
+        yield tail
@@ -0,0 +1,109 @@
+import importlib
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from decouple import config
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Import every tool during worker warmup instead of on first use
+TOOL_WARMUP = config("TOOL_WARMUP", default=True, cast=bool)
+
+# A tool that failed to load is retried after this many seconds
+TOOL_RETRY_AFTER = config("TOOL_RETRY_AFTER", default=30.0, cast=float)
+
+# Tool name (as exposed to the model) → module + entrypoints
+TOOLS: Dict[str, Dict[str, str]] = {
+    "fetch_reference_images": {
+        "module": ".wikimediaTool",
+        "sync": "fetch_reference_images",
+        "async": "afetch_reference_images",
+    },
+    # Rendered on the render queue's worker threads (see renderJobs)
+    "generate_image": {
+        "module": ".geminiTool",
+        "sync": "generate_image_with_gemini",
+    },
+}
+
+# -------------------------------------------------------------------
+# Registry
+# -------------------------------------------------------------------
+
+class ToolUnavailableError(RuntimeError):
+    pass
+
+
+_modules: Dict[str, Any] = {}
+_failures: Dict[str, Dict[str, Any]] = {}
+_load_times: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def load_tool(name: str):
+    """
+    Imports the tool's module the first time it is needed.
+
+    An import or config error only disables that tool (raised as
+    ToolUnavailableError) instead of taking the whole app down.
+    """
+    module = _modules.get(name)
+    if module is not None:
+        return module
+
+    if name not in TOOLS:
+        raise ToolUnavailableError(f"Unknown tool: {name}")
+
+    with _lock:
+        module = _modules.get(name)
+        if module is not None:
+            return module
+
+        failure = _failures.get(name)
+        if failure and time.monotonic() - failure["at"] < TOOL_RETRY_AFTER:
+            raise ToolUnavailableError(f"{name} is unavailable: {failure['error']}")
+
+        started = time.perf_counter()
+        try:
+            module = importlib.import_module(TOOLS[name]["module"], package=__package__)
+        except Exception as exc:
+            _failures[name] = {"error": f"{type(exc).__name__}: {exc}", "at": time.monotonic()}
+            print(f"Tool registry: failed to load {name}: {exc!r}")
+            raise ToolUnavailableError(f"{name} is unavailable: {exc}") from exc
+
+        _load_times[name] = time.perf_counter() - started
+        _failures.pop(name, None)
+        _modules[name] = module
+        print(f"Tool registry: loaded {name} in {_load_times[name] * 1000:.0f} ms")
+        return module
+
+
+def get_tool(name: str) -> Callable:
+    return getattr(load_tool(name), TOOLS[name]["sync"])
+
+
+def get_async_tool(name: str) -> Callable:
+    return getattr(load_tool(name), TOOLS[name]["async"])
+
+
+def warmup_tools():
+    for name in TOOLS:
+        try:
+            load_tool(name)
+        except ToolUnavailableError:
+            pass
+
+
+def tool_status() -> Dict[str, Dict[str, Any]]:
+    status = {}
+    for name in TOOLS:
+        if name in _modules:
+            status[name] = {"state": "loaded", "load_ms": round(_load_times[name] * 1000, 1)}
+        elif name in _failures:
+            status[name] = {"state": "failed", "error": _failures[name]["error"]}
+        else:
+            status[name] = {"state": "not_loaded"}
+    return status
@@ -0,0 +1,132 @@
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from decouple import Csv, config
+
+from .sessionStore import to_message_dict
+from .sqliteCache import SqliteCache, make_cache_key
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Replay whole turns for repeated prompts (demo / kiosk setups); off by default
+TURN_CACHE_ENABLED = config("TURN_CACHE_ENABLED", default=False, cast=bool)
+
+# Which kinds of turn may be stored: "text" (no tools), "reference"
+# (search results shown) and/or "generate" (Gemini render)
+TURN_CACHE_ROUTES = config("TURN_CACHE_ROUTES", default="text,reference,generate", cast=Csv())
+
+# Recent conversation messages that are part of the key
+TURN_CACHE_HISTORY_MESSAGES = config("TURN_CACHE_HISTORY_MESSAGES", default=4, cast=int)
+
+# Larger recorded turns are not stored (JSON bytes)
+TURN_CACHE_MAX_BYTES = config("TURN_CACHE_MAX_BYTES", default=256 * 1024, cast=int)
+
+ROUTE_TEXT = "text"
+ROUTE_REFERENCE = "reference"
+ROUTE_GENERATE = "generate"
+
+# Shared by all workers; least recently replayed turns are evicted first
+turn_cache = SqliteCache(
+    path=config(
+        "TURN_CACHE_PATH",
+        default=str(Path(__file__).resolve().parents[2] / ".cache" / "turns.sqlite3"),
+    ),
+    table="chat_turns",
+    ttl=config("TURN_CACHE_TTL", default=3600, cast=float),
+    max_entries=config("TURN_CACHE_MAX_ENTRIES", default=500, cast=int),
+)
+
+# -------------------------------------------------------------------
+# Keys
+# -------------------------------------------------------------------
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def turn_cache_key(
+    system_prompt: str,
+    stored_turns: List[Any],
+    message: str,
+    model: str,
+    reference_image_id: str = "",
+) -> str:
+    """
+    Same system prompt, same recent conversation, same message (up to
+    case and whitespace) and same reference image → same key. Tool
+    messages are left out: the conversation text already determines them.
+    Image ids are content hashes, so a refinement of the same image hits.
+    """
+    recent = []
+    for turn in map(to_message_dict, stored_turns):
+        content = turn.get("content")
+        if turn.get("role") in ("user", "assistant") and isinstance(content, str) and content:
+            recent.append([turn["role"], _normalize(content)])
+
+    return make_cache_key({
+        "model": model,
+        "system": _normalize(system_prompt),
+        "history": recent[-TURN_CACHE_HISTORY_MESSAGES:] if TURN_CACHE_HISTORY_MESSAGES else [],
+        "message": _normalize(message),
+        "reference_image_id": reference_image_id,
+    })
+
+# -------------------------------------------------------------------
+# Recording
+# -------------------------------------------------------------------
+
+class TurnRecorder:
+    """
+    Collects the events of a turn as it streams (see observe()).
+
+    Only what the user sees is kept: images and narration text. Session,
+    progress, job and timing events belong to one request and are made
+    fresh on replay. A turn with an error or a failed render is not
+    cacheable.
+    """
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.turn: List[Dict[str, Any]] = []
+        self.route = ROUTE_TEXT
+        self.cacheable = True
+
+    def observe(self, frame: str):
+        if not frame.startswith("data: {"):
+            return
+
+        payload = json.loads(frame[len("data: "):])
+        kind = payload.get("type")
+
+        if kind == "error":
+            self.cacheable = False
+        elif kind == "job" and payload.get("status") == "failed":
+            self.cacheable = False
+        elif kind == "image":
+            if payload.get("image_id"):
+                self.route = ROUTE_GENERATE
+                # The job is long gone when this is replayed
+                payload.pop("job_id", None)
+            elif self.route == ROUTE_TEXT:
+                self.route = ROUTE_REFERENCE
+            self.events.append(payload)
+        elif kind == "text":
+            self.events.append(payload)
+
+    def entry(self) -> Optional[Dict[str, Any]]:
+        """The cache entry for a completed turn, or None if it shouldn't be stored."""
+        if not self.cacheable or self.route not in TURN_CACHE_ROUTES:
+            return None
+
+        entry = {
+            "route": self.route,
+            "events": self.events,
+            "turn": self.turn,
+        }
+        if len(json.dumps(entry)) > TURN_CACHE_MAX_BYTES:
+            return None
+        return entry
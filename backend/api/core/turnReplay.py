@@ -0,0 +1,187 @@
+import asyncio
+import itertools
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Optional, Tuple
+
+from decouple import config
+
+from .sseFramer import SSE_COMPAT_MODE, SSE_HEARTBEAT_INTERVAL, sse_comment
+
+# -------------------------------------------------------------------
+# Configuration
+# -------------------------------------------------------------------
+
+# Keep each turn's events so a dropped stream can resume with Last-Event-ID
+# (adds an "id:" line to every event, so never in SSE_COMPAT_MODE)
+REPLAY_ENABLED = not SSE_COMPAT_MODE and config("REPLAY_ENABLED", default=True, cast=bool)
+
+# A finished turn can be resumed for this long (seconds)
+REPLAY_TTL = config("REPLAY_TTL", default=300.0, cast=float)
+
+# Per-turn ring buffer caps; the oldest events are dropped first
+REPLAY_MAX_EVENTS = config("REPLAY_MAX_EVENTS", default=2000, cast=int)
+REPLAY_MAX_BYTES = config("REPLAY_MAX_BYTES", default=1024 * 1024, cast=int)
+
+# All buffers together; the oldest finished turns are evicted first
+REPLAY_TOTAL_BYTES = config("REPLAY_TOTAL_BYTES", default=64 * 1024 * 1024, cast=int)
+
+# -------------------------------------------------------------------
+# Event ids
+# -------------------------------------------------------------------
+
+class ReplayUnavailable(LookupError):
+    pass
+
+
+def event_id(turn_id: str, seq: int) -> str:
+    return f"{turn_id}-{seq}"
+
+
+def parse_event_id(value: str) -> Optional[Tuple[str, int]]:
+    """"<turn_id>-<seq>" → (turn_id, seq), or None if malformed."""
+    turn_id, _, seq = value.strip().rpartition("-")
+    if not turn_id or not seq.isdigit():
+        return None
+    return turn_id, int(seq)
+
+# -------------------------------------------------------------------
+# Per-turn buffer
+# -------------------------------------------------------------------
+
+class TurnBuffer:
+    """
+    The SSE frames of one turn, numbered from 1, with an id line added.
+
+    Filled by the turn's producer whether or not a client is attached;
+    any number of subscribers can read it from any point still buffered.
+    Used from the event loop only.
+    """
+
+    def __init__(self, turn_id: str, max_events: int, max_bytes: int):
+        self.turn_id = turn_id
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+
+        self.events: "deque[Tuple[int, str]]" = deque()
+        self.bytes = 0
+        self.next_seq = 1
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self._wakeup = asyncio.Event()
+
+    def _notify(self):
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    def append(self, frame: str):
+        seq = self.next_seq
+        self.next_seq += 1
+
+        frame = f"id: {event_id(self.turn_id, seq)}\n{frame}"
+        self.events.append((seq, frame))
+        # Budgets are in encoded bytes: text may well be non-ASCII
+        self.bytes += len(frame.encode())
+
+        # Ring buffer: only the newest events are kept (at least one)
+        while len(self.events) > 1 and (
+            len(self.events) > self.max_events or self.bytes > self.max_bytes
+        ):
+            _, dropped = self.events.popleft()
+            self.bytes -= len(dropped.encode())
+
+        self._notify()
+
+    def close(self):
+        self.done = True
+        self.finished_at = time.time()
+        self._notify()
+
+    async def asubscribe(self, after: int = 0) -> AsyncIterator[str]:
+        """
+        Yields every frame after seq `after`, then new ones as they are
+        added, until the turn ends. Sends heartbeats while idle.
+        """
+        if after >= self.next_seq:
+            raise ReplayUnavailable(f"turn {self.turn_id} has no event {after}")
+
+        seq = after
+        while True:
+            # Taken before reading, so nothing appended meanwhile is missed
+            wakeup = self._wakeup
+
+            if self.events:
+                first = self.events[0][0]
+                if seq + 1 < first:
+                    raise ReplayUnavailable(
+                        f"events {seq + 1}-{first - 1} of turn {self.turn_id} were dropped"
+                    )
+                # Copied: the producer appends while we yield
+                for item_seq, frame in list(itertools.islice(self.events, seq + 1 - first, None)):
+                    seq = item_seq
+                    yield frame
+
+            if seq < self.next_seq - 1:
+                continue
+            if self.done:
+                return
+
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield sse_comment()
+
+
+async def arecord_turn(buffer: TurnBuffer, frames: AsyncIterator[str]):
+    """
+    Runs a turn's event stream to the end into `buffer`. Comments
+    (heartbeats) are not kept; subscribers send their own.
+    """
+    try:
+        async for frame in frames:
+            if not frame.startswith(":"):
+                buffer.append(frame)
+    except Exception as exc:
+        print(f"Turn {buffer.turn_id} failed: {exc!r}")
+    finally:
+        buffer.close()
+
+# -------------------------------------------------------------------
+# Store (per process)
+# -------------------------------------------------------------------
+
+class TurnReplayStore:
+    def __init__(self, ttl: float, total_bytes: int):
+        self.ttl = ttl
+        self.total_bytes = total_bytes
+        self._turns: "OrderedDict[str, TurnBuffer]" = OrderedDict()
+
+    def _evict(self):
+        now = time.time()
+        for turn_id, buffer in list(self._turns.items()):
+            if buffer.done and now - buffer.finished_at > self.ttl:
+                del self._turns[turn_id]
+
+        # Over the memory cap: drop the oldest finished turns; running
+        # turns are kept (each is capped on its own)
+        used = sum(buffer.bytes for buffer in self._turns.values())
+        for turn_id, buffer in list(self._turns.items()):
+            if used <= self.total_bytes:
+                break
+            if buffer.done:
+                used -= buffer.bytes
+                del self._turns[turn_id]
+
+    def create(self) -> TurnBuffer:
+        self._evict()
+        buffer = TurnBuffer(uuid.uuid4().hex, REPLAY_MAX_EVENTS, REPLAY_MAX_BYTES)
+        self._turns[buffer.turn_id] = buffer
+        return buffer
+
+    def get(self, turn_id: str) -> Optional[TurnBuffer]:
+        self._evict()
+        return self._turns.get(turn_id)
+
+
+turn_replay = TurnReplayStore(ttl=REPLAY_TTL, total_bytes=REPLAY_TOTAL_BYTES)
@@ -0,0 +1,435 @@
+import base64
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+# -------------------------------------------------------------------
+# Latency / payload profiles
+# -------------------------------------------------------------------
+# Local stand-ins for Azure OpenAI, Gemini and SerpAPI, used by
+# `manage.py bench_chat`. They speak the real wire formats, so the real
+# SDK clients, pools and parsers run unchanged. Every delay is in seconds
+# and multiplied by the latency scale.
+
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "realistic": {
+        "azure_routing": 0.9,        # tool-routing / selection completion
+        "azure_first_token": 0.45,   # stream start
+        "azure_token_interval": 0.02,
+        "azure_tokens": 120,
+        "gemini_render": 7.0,
+        "gemini_image_bytes": 1_500_000,
+        "serpapi_search": 0.8,
+        "serpapi_results": 10,
+        "origin_image": 0.15,
+        "origin_image_bytes": 250_000,
+        "origin_dead_every": 4,      # every Nth reference origin answers 403 HTML
+    },
+    "fast": {
+        "azure_routing": 0.05,
+        "azure_first_token": 0.03,
+        "azure_token_interval": 0.002,
+        "azure_tokens": 60,
+        "gemini_render": 0.2,
+        "gemini_image_bytes": 300_000,
+        "serpapi_search": 0.05,
+        "serpapi_results": 10,
+        "origin_image": 0.01,
+        "origin_image_bytes": 50_000,
+        "origin_dead_every": 4,
+    },
+}
+
+# Keywords in the user message that make the routing stub call a tool
+GENERATE_KEYWORDS = ("draw", "generate", "render", "create an image")
+REFERENCE_KEYWORDS = ("show", "photo", "picture", "look like")
+
+WORDS = (
+    "The design persona looks at the space and imagines how people will "
+    "move through it in twenty years, with light, plants and quiet corners "
+).split()
+
+CANDIDATE_ID_RE = re.compile(r'"id":\s*"(SERP_[^"]+)"')
+
+# -------------------------------------------------------------------
+# Payloads
+# -------------------------------------------------------------------
+
+def make_png(target_bytes: int, width: int = 1024) -> bytes:
+    """
+    A valid PNG of roughly target_bytes: noise rows don't compress, flat
+    rows do, so the mix sets the size.
+    """
+    rows = max(target_bytes // (width * 3), 1)
+    height = max(rows, 256)
+
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)
+        raw.extend(os.urandom(width * 3) if y < rows else bytes(width * 3))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data)) + tag + data
+            + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+        )
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(bytes(raw), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def make_jpeg_like(size: int) -> bytes:
+    # Only the magic bytes matter to the proxy; the rest is filler
+    return b"\xff\xd8\xff\xe0" + os.urandom(max(size - 6, 0)) + b"\xff\xd9"
+
+
+def _text(message) -> str:
+    content = message.get("content") or ""
+    return content if isinstance(content, str) else json.dumps(content)
+
+# -------------------------------------------------------------------
+# Server
+# -------------------------------------------------------------------
+
+class UpstreamStubs:
+    """
+    One threaded HTTP server answering as all three upstreams:
+
+    - Azure OpenAI  POST /openai/deployments/<model>/chat/completions
+    - Gemini        POST /v1beta/models/<model>:generateContent
+    - SerpAPI       GET  /search
+    - image origins GET  /origin/<n>.jpg (reference candidates)
+
+    calls counts requests per upstream. With deployments (name →
+    (latency multiplier, error rate)) Azure answers as that pool of
+    deployments (see azureRouter); each one's calls are counted as
+    "azure@<name>" and it fails with a 503 at its error rate.
+    """
+
+    def __init__(
+        self,
+        profile: str = "realistic",
+        latency_scale: float = 1.0,
+        deployments: Optional[Dict[str, Tuple[float, float]]] = None,
+    ):
+        self.profile = dict(PROFILES[profile])
+        self.latency_scale = latency_scale
+        self.deployments = deployments or {}
+        self.calls: Dict[str, int] = {}
+        self._calls_lock = threading.Lock()
+
+        self.gemini_image = make_png(self.profile["gemini_image_bytes"])
+        self.origin_image = make_jpeg_like(self.profile["origin_image_bytes"])
+
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------------------------------------------------------------
+    # Lifecycle
+    # ---------------------------------------------------------------
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "UpstreamStubs":
+        stubs = self
+
+        class Handler(_StubHandler):
+            pass
+
+        Handler.stubs = stubs
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="upstream-stubs", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def env(self) -> Dict[str, str]:
+        """Environment that points the backend at these stubs."""
+        return {
+            "AZURE_ENDPOINT": self.base_url,
+            "AZURE_OPENAI_KEY": "stub",
+            "AZURE_DEPLOYMENTS": json.dumps([
+                {"name": name, "endpoint": self.base_url, "deployment": name}
+                for name in self.deployments
+            ]) if self.deployments else "",
+            "GEMINI_KEY": "stub",
+            "GEMINI_BASE_URL": self.base_url + "/",
+            "SERPAPI_KEY": "stub",
+            "SERPAPI_BASE_URL": self.base_url,
+        }
+
+    # ---------------------------------------------------------------
+    # Helpers used by the handler
+    # ---------------------------------------------------------------
+
+    def count(self, upstream: str):
+        with self._calls_lock:
+            self.calls[upstream] = self.calls.get(upstream, 0) + 1
+
+    def sleep(self, key: str, factor: float = 1.0):
+        delay = self.profile[key] * self.latency_scale * factor
+        if delay > 0:
+            time.sleep(delay)
+
+    def routing_message(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        messages = body.get("messages", [])
+        last = messages[-1] if messages else {}
+
+        # Tool routing: only on a fresh user message
+        if body.get("tools") and last.get("role") == "user":
+            text = _text(last).lower()
+            if any(k in text for k in GENERATE_KEYWORDS):
+                name, args = "generate_image", {"prompt": _text(last), "needs_image": False}
+            elif any(k in text for k in REFERENCE_KEYWORDS):
+                name, args = "fetch_reference_images", {"query": _text(last)[:80]}
+            else:
+                name = None
+
+            if name:
+                return {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [{
+                        "id": f"call_{os.urandom(6).hex()}",
+                        "type": "function",
+                        "function": {"name": name, "arguments": json.dumps(args)},
+                    }],
+                }
+
+        # Separate selection mode: pick the first candidate
+        if any("IMAGE SELECTION MODE" in _text(m) for m in messages[-2:]):
+            return {"role": "assistant", "content": self.selection_header(messages) or "NO_SUITABLE_IMAGE"}
+
+        return {"role": "assistant", "content": " ".join(WORDS[:12])}
+
+    def selection_header(self, messages) -> Optional[str]:
+        for message in reversed(messages):
+            if message.get("role") == "tool":
+                match = CANDIDATE_ID_RE.search(_text(message))
+                if match:
+                    return f"CHOSEN_IMAGE_ID: {match.group(1)}"
+        return None
+
+    def narration_deltas(self, messages):
+        if any(_text(m).startswith("IMAGE SELECTION + RESPONSE") for m in messages[-3:]):
+            header = self.selection_header(messages)
+            yield (header or "NO_SUITABLE_IMAGE") + "\n\n"
+        for i in range(self.profile["azure_tokens"]):
+            yield WORDS[i % len(WORDS)] + " "
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stubs: UpstreamStubs = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---- plumbing
+
+    def _body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send(self, status: int, data: bytes, content_type: str, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _json(self, payload: Dict[str, Any], status: int = 200):
+        self._send(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    # ---- routes
+
+    def do_HEAD(self):
+        # Warmup pre-connects
+        self._send(404, b"", "text/plain")
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/search":
+            self._serpapi()
+        elif path.startswith("/origin/"):
+            self._origin(path)
+        else:
+            self._send(404, b"", "text/plain")
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path.startswith("/openai/deployments/") and path.endswith("/chat/completions"):
+            self._azure(self._body(), path.split("/")[3])
+        elif ":generateContent" in path:
+            self._gemini(self._body())
+        else:
+            self._send(404, b"", "text/plain")
+
+    # ---- Azure OpenAI
+
+    def _azure(self, body: Dict[str, Any], deployment: str):
+        stubs = self.stubs
+        model = body.get("model", "stub")
+
+        factor = 1.0
+        if deployment in stubs.deployments:
+            stubs.count(f"azure@{deployment}")
+            factor, error_rate = stubs.deployments[deployment]
+            if random.random() < error_rate:
+                stubs.sleep("azure_first_token", factor)
+                self._json({"error": {"code": "503", "message": "Service unavailable"}}, status=503)
+                return
+
+        if not body.get("stream"):
+            stubs.count("azure_completion")
+            stubs.sleep("azure_routing", factor)
+            self._json({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": stubs.routing_message(body),
+                    "finish_reason": "stop",
+                }],
+            })
+            return
+
+        stubs.count("azure_stream")
+
+        # Streaming with tools attached (AGENT_MODE=stream): tool calls
+        # arrive as fragments, like the real API sends them. Headers go
+        # out with the first delta, as with the real API
+        message = stubs.routing_message(body) if body.get("tools") else {}
+        stubs.sleep("azure_routing" if message.get("tool_calls") else "azure_first_token", factor)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_delta(delta: Dict[str, Any]):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            self._chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        if message.get("tool_calls"):
+            for index, call in enumerate(message["tool_calls"]):
+                arguments = call["function"]["arguments"]
+                send_delta({"tool_calls": [{
+                    "index": index,
+                    "id": call["id"],
+                    "type": "function",
+                    "function": {"name": call["function"]["name"], "arguments": ""},
+                }]})
+                for start in range(0, len(arguments), 16):
+                    send_delta({"tool_calls": [{
+                        "index": index,
+                        "function": {"arguments": arguments[start:start + 16]},
+                    }]})
+        else:
+            for delta in stubs.narration_deltas(body.get("messages", [])):
+                send_delta({"content": delta})
+                stubs.sleep("azure_token_interval", factor)
+
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    # ---- Gemini
+
+    def _gemini(self, body: Dict[str, Any]):
+        stubs = self.stubs
+        stubs.count("gemini")
+        stubs.sleep("gemini_render")
+        self._json({
+            "candidates": [{
+                "content": {
+                    "role": "model",
+                    "parts": [{
+                        "inlineData": {
+                            "mimeType": "image/png",
+                            "data": base64.b64encode(stubs.gemini_image).decode("ascii"),
+                        }
+                    }],
+                },
+                "finishReason": "STOP",
+            }],
+        })
+
+    # ---- SerpAPI + image origins
+
+    def _serpapi(self):
+        stubs = self.stubs
+        stubs.count("serpapi")
+        stubs.sleep("serpapi_search")
+
+        # Random origin ids, so searches don't share probe results
+        first = int.from_bytes(os.urandom(3), "big")
+        self._json({
+            "images_results": [
+                {
+                    "original": f"{stubs.base_url}/origin/{first + i}.jpg",
+                    "title": f"Reference {i + 1}",
+                    "link": f"{stubs.base_url}/page/{first + i}",
+                }
+                for i in range(stubs.profile["serpapi_results"])
+            ],
+        })
+
+    def _origin(self, path: str):
+        stubs = self.stubs
+        stubs.count("origin")
+        stubs.sleep("origin_image")
+
+        number = int(re.sub(r"\D", "", path) or 0)
+        dead_every = stubs.profile["origin_dead_every"]
+        if dead_every and number % dead_every == 0:
+            self._send(403, b"<html>hotlinking not allowed</html>", "text/html")
+            return
+
+        data = stubs.origin_image
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+            self._send(206, data[start:end + 1], "image/jpeg", {
+                "Content-Range": f"bytes {start}-{end}/{len(data)}",
+            })
+        else:
+            self._send(200, data, "image/jpeg")
@@ -1,15 +1,51 @@
+import asyncio
+from pathlib import Path
 from typing import List, Dict
 from serpapi import GoogleSearch
 from decouple import config
 
+from .clientRegistry import SERPAPI_BASE_URL, SERPAPI_TIMEOUT, get_serpapi_session
+from .referenceProxy import REFERENCE_PROBE_ENABLED, filter_reachable
+from .resilience import upstreams
+from .sqliteCache import SqliteCache, make_cache_key
+
 # -------------------------------------------------------------------
 # Configuration
 # -------------------------------------------------------------------
 
 SERPAPI_KEY = config("SERPAPI_KEY")
 MAX_CANDIDATES = 5
+
+# Extra candidates are collected so dead hosts can be dropped after probing
+SEARCH_CANDIDATE_POOL = (
+    config("SEARCH_CANDIDATE_POOL", default=10, cast=int)
+    if REFERENCE_PROBE_ENABLED else MAX_CANDIDATES
+)
 ALLOWED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
 
+SERPAPI_PARAMS = {
+    "engine": "google_images",
+    "hl": "en",
+    "gl": "us",
+    "safe": "active",
+}
+
+# -------------------------------------------------------------------
+# Search cache (shared by all workers, survives restarts)
+# -------------------------------------------------------------------
+
+SEARCH_CACHE_ENABLED = config("SEARCH_CACHE_ENABLED", default=True, cast=bool)
+
+search_cache = SqliteCache(
+    path=config(
+        "SEARCH_CACHE_PATH",
+        default=str(Path(__file__).resolve().parents[2] / ".cache" / "search_cache.sqlite3"),
+    ),
+    table="serpapi_results",
+    ttl=config("SEARCH_CACHE_TTL", default=7 * 24 * 3600, cast=float),
+    max_entries=config("SEARCH_CACHE_MAX_ENTRIES", default=5000, cast=int),
+)
+
 # -------------------------------------------------------------------
 # Helpers
 # -------------------------------------------------------------------
@@ -20,21 +56,55 @@ def is_renderable_image_url(url: str) -> bool:
 def is_http_url(url: str) -> bool:
     return url.startswith("http://") or url.startswith("https://")
 
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
 # -------------------------------------------------------------------
 # SerpAPI (Google Images)
 # -------------------------------------------------------------------
 
+class PooledGoogleSearch(GoogleSearch):
+    """GoogleSearch over the registry's keep-alive session (the stock
+    client opens a new connection per call via requests.get)."""
+
+    BACKEND = SERPAPI_BASE_URL.rstrip("/")
+
+    def get_response(self, path="/search"):
+        url, parameter = self.construct_url(path)
+        return upstreams["serpapi"].call(self._get, url, parameter)
+
+    @staticmethod
+    def _get(url, parameter):
+        response = get_serpapi_session().get(url, params=parameter, timeout=SERPAPI_TIMEOUT)
+        # Raised so a failure is never cached (429 / 5xx are also retried)
+        response.raise_for_status()
+        return response
+
 def fetch_serpapi_candidates(query: str) -> List[Dict]:
-    search = GoogleSearch({
+    cache_key = make_cache_key({
+        "q": normalize_query(query),
+        "max_candidates": SEARCH_CANDIDATE_POOL,
+        **SERPAPI_PARAMS,
+    })
+
+    if SEARCH_CACHE_ENABLED:
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            print(f"SerpAPI cache hit for query: {query}")
+            return cached
+
+    search = PooledGoogleSearch({
         "api_key": SERPAPI_KEY,
-        "engine": "google_images",
         "q": query,
-        "hl": "en",
-        "gl": "us",
-        "safe": "active",
+        **SERPAPI_PARAMS,
     })
 
     results = search.get_dict()
+    if results.get("error"):
+        # Bad key, exhausted quota or no results: not worth caching
+        print(f"SerpAPI error for query: {query} ({results['error']})")
+        return []
+
     images = results.get("images_results", [])
 
     candidates = []
@@ -57,11 +127,13 @@ def fetch_serpapi_candidates(query: str) -> List[Dict]:
             "confidence": "google images"
         })
 
-        if len(candidates) >= MAX_CANDIDATES:
+        if len(candidates) >= SEARCH_CANDIDATE_POOL:
             break
     print(f"Fetched {len(candidates)} candidates from SerpAPI for query: {query}")
-    print(candidates[0])
-    print()
+
+    if SEARCH_CACHE_ENABLED:
+        search_cache.set(cache_key, candidates)
+
     return candidates
 
 # -------------------------------------------------------------------
@@ -77,4 +149,15 @@ def fetch_reference_images(query: str) -> List[Dict]:
         The LLM MUST choose the most relevant one or reject all.
     """
     print(f"Fetching reference images for query: {query}")
-    return fetch_serpapi_candidates(query)
+
+    # Only candidates whose host actually serves the image reach the LLM
+    return filter_reachable(fetch_serpapi_candidates(query))[:MAX_CANDIDATES]
+
+async def afetch_reference_images(query: str) -> List[Dict]:
+    """
+    Async wrapper around fetch_reference_images.
+
+    SerpAPI only ships a blocking client, so the search runs in a worker
+    thread instead of on the event loop.
+    """
+    return await asyncio.to_thread(fetch_reference_images, query)
@@ -0,0 +1,303 @@
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+from typing import Any, Dict, List, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Scenario → user messages (one per turn, cycled)
+SCENARIOS = {
+    "text": ["Tell me how the library could feel in 2045."],
+    "reference": ["Show me a photo of a reading room with big windows."],
+    "generate": ["Draw a futuristic reading room full of plants."],
+}
+SCENARIOS["mixed"] = SCENARIOS["text"] + SCENARIOS["reference"] + SCENARIOS["generate"]
+
+# Metrics compared against --baseline (lower is better)
+TRACKED_METRICS = ("time_to_first_event_s", "time_to_first_text_s", "turn_s")
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        "mean": round(statistics.fmean(ordered), 4),
+        "p50": round(ordered[len(ordered) // 2], 4),
+        "p95": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def _deployments(spec: str) -> Dict[str, Tuple[float, float]]:
+    """"east=1,west=3,flaky=1:0.3" → name → (latency multiplier, error rate)."""
+    deployments = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, values = item.partition("=")
+        factor, _, error_rate = (values or "1").partition(":")
+        deployments[name] = (float(factor), float(error_rate or 0))
+    return deployments
+
+
+def _decoder(encoding: str):
+    """chunk → decoded bytes, for a Content-Encoding the views may pick."""
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress
+    if encoding == "br":
+        import brotli
+
+        return brotli.Decompressor().process
+    return lambda chunk: chunk
+
+
+def _max_rss_kb() -> int:
+    # Linux reports kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the /api/chat pipeline against local Azure OpenAI, Gemini and "
+        "SerpAPI stand-ins with N concurrent SSE clients and reports latency, "
+        "throughput and memory as JSON. Needs no API keys."
+    )
+
+    # System checks import the URLconf (and so the views) before handle();
+    # the views must only be imported once the stub environment is set
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=8,
+                            help="Concurrent SSE clients")
+        parser.add_argument("--turns", type=int, default=2,
+                            help="Turns per client (same session)")
+        parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+        parser.add_argument("--profile", choices=["realistic", "fast"], default="realistic",
+                            help="Upstream latency / payload profile")
+        parser.add_argument("--latency-scale", type=float, default=1.0,
+                            help="Multiply every upstream delay by this")
+        parser.add_argument("--agent-mode", choices=["routed", "stream"], default="routed",
+                            help="AGENT_MODE for the run")
+        parser.add_argument("--azure-deployments", default="",
+                            help="Stub Azure pool, e.g. east=1,west=3,flaky=1:0.3 "
+                                 "(name=latency multiplier[:error rate])")
+        parser.add_argument("--azure-hedge", action="store_true",
+                            help="Enable hedged Azure requests (AZURE_HEDGE_ENABLED)")
+        parser.add_argument("--accept-encoding", default="",
+                            help="Accept-Encoding sent by the clients, e.g. \"gzip, br\"")
+        parser.add_argument("--output", help="Also write the JSON report to this file")
+        parser.add_argument("--baseline", help="Fail if slower than this earlier report")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="Allowed slowdown vs. the baseline (0.2 = 20%%)")
+
+    # ---------------------------------------------------------------
+    # Environment
+    # ---------------------------------------------------------------
+
+    def _configure(self, stubs, workdir: str, agent_mode: str, hedge: bool):
+        os.environ.update(stubs.env())
+        os.environ["AGENT_MODE"] = agent_mode
+        os.environ["AZURE_HEDGE_ENABLED"] = str(hedge)
+        os.environ.setdefault("AZURE_API_VERSION", "2024-06-01")
+        os.environ.setdefault("GPT_COMPLETION_MODEL", "stub-model")
+        os.environ.update({
+            # Fresh caches: never read or pollute the real ones
+            "IMAGE_STORE_DIR": os.path.join(workdir, "images"),
+            "SEARCH_CACHE_PATH": os.path.join(workdir, "search.sqlite3"),
+            "REFERENCE_CACHE_PATH": os.path.join(workdir, "references.sqlite3"),
+            "TURN_CACHE_PATH": os.path.join(workdir, "turns.sqlite3"),
+            "SESSION_STORE_PATH": os.path.join(workdir, "sessions.sqlite3"),
+        })
+
+    # ---------------------------------------------------------------
+    # One SSE client
+    # ---------------------------------------------------------------
+
+    async def _turn(self, chat, factory, message: str, session_id: str, accept_encoding: str = "") -> Dict[str, Any]:
+        payload = {"message": message}
+        if session_id:
+            payload["session_id"] = session_id
+
+        started = time.perf_counter()
+        request = factory.post(
+            "/api/chat",
+            data=json.dumps(payload),
+            content_type="application/json",
+            headers={"Accept-Encoding": accept_encoding} if accept_encoding else None,
+        )
+        response = await chat(request)
+        decode = _decoder(response.get("Content-Encoding", ""))
+
+        result = {
+            "first_event": None,
+            "first_text": None,
+            "events": 0,
+            "writes": 0,
+            "bytes": 0,
+            "wire_bytes": 0,
+            "session_id": session_id,
+            "error": None,
+        }
+
+        async for chunk in response.streaming_content:
+            now = time.perf_counter() - started
+            chunk = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            result["writes"] += 1
+            result["wire_bytes"] += len(chunk)
+            text = decode(chunk).decode("utf-8")
+            result["bytes"] += len(text.encode("utf-8"))
+
+            for frame in text.split("\n\n"):
+                # Each event is "id: <turn>-<seq>\ndata: ..." (see turnReplay)
+                if frame.startswith("id: "):
+                    frame = frame.partition("\n")[2]
+                if not frame.startswith("data: "):
+                    continue
+                result["events"] += 1
+                if result["first_event"] is None:
+                    result["first_event"] = now
+                if frame == "data: [DONE]":
+                    continue
+
+                event = json.loads(frame[len("data: "):])
+                if event.get("type") == "session":
+                    result["session_id"] = event["session_id"]
+                elif event.get("type") == "text" and result["first_text"] is None:
+                    result["first_text"] = now
+                elif event.get("type") == "error":
+                    result["error"] = event.get("message")
+
+        result["total"] = time.perf_counter() - started
+        return result
+
+    async def _client(self, chat, factory, messages: List[str], turns: int, offset: int, accept_encoding: str):
+        session_id = ""
+        results = []
+        for turn in range(turns):
+            result = await self._turn(
+                chat, factory, messages[(offset + turn) % len(messages)], session_id, accept_encoding
+            )
+            session_id = result["session_id"]
+            results.append(result)
+        return results
+
+    async def _run(self, stubs, options) -> Dict[str, Any]:
+        from django.test import AsyncRequestFactory
+
+        from api.views import chat
+
+        factory = AsyncRequestFactory()
+        messages = SCENARIOS[options["scenario"]]
+
+        # Warm imports, pools and caches outside the measurement
+        await self._turn(chat, factory, SCENARIOS["text"][0], "")
+        stubs.calls.clear()
+
+        rss_before = _max_rss_kb()
+        started = time.perf_counter()
+        per_client = await asyncio.gather(*(
+            self._client(chat, factory, messages, options["turns"], offset, options["accept_encoding"])
+            for offset in range(options["clients"])
+        ))
+        wall = time.perf_counter() - started
+        rss_growth = max(_max_rss_kb() - rss_before, 0)
+
+        turns = [r for results in per_client for r in results]
+        return {
+            "wall": wall,
+            "turns": turns,
+            "rss_growth_kb": rss_growth,
+        }
+
+    # ---------------------------------------------------------------
+    # Report
+    # ---------------------------------------------------------------
+
+    def _check_baseline(self, report: Dict[str, Any], path: str, tolerance: float):
+        with open(path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for metric in TRACKED_METRICS:
+            for stat in ("p50", "p95"):
+                before = baseline.get(metric, {}).get(stat)
+                after = report.get(metric, {}).get(stat)
+                if before and after and after > before * (1 + tolerance):
+                    regressions.append(f"{metric}.{stat} {before:.3f} s → {after:.3f} s")
+        return regressions
+
+    def handle(self, *args, **options):
+        from api.core.upstreamStubs import UpstreamStubs
+
+        stubs = UpstreamStubs(
+            options["profile"],
+            options["latency_scale"],
+            deployments=_deployments(options["azure_deployments"]),
+        ).start()
+        try:
+            # The pipeline logs with print(); keep stdout for the report
+            with tempfile.TemporaryDirectory(prefix="bench-chat-") as workdir, \
+                    contextlib.redirect_stdout(sys.stderr):
+                self._configure(stubs, workdir, options["agent_mode"], options["azure_hedge"])
+                run = asyncio.run(self._run(stubs, options))
+        finally:
+            stubs.stop()
+
+        turns = run["turns"]
+        completed = [t for t in turns if t["error"] is None]
+        events = sum(t["events"] for t in turns)
+        writes = sum(t["writes"] for t in turns)
+        streamed_bytes = sum(t["bytes"] for t in turns)
+        wire_bytes = sum(t["wire_bytes"] for t in turns)
+
+        report = {
+            "benchmark": "chat_pipeline",
+            "scenario": options["scenario"],
+            "profile": options["profile"],
+            "latency_scale": options["latency_scale"],
+            "agent_mode": options["agent_mode"],
+            "azure_deployments": options["azure_deployments"] or None,
+            "azure_hedge": options["azure_hedge"],
+            "clients": options["clients"],
+            "turns_per_client": options["turns"],
+            "turns_completed": len(completed),
+            "errors": len(turns) - len(completed),
+            "wall_s": round(run["wall"], 3),
+            "time_to_first_event_s": _summary([t["first_event"] for t in completed if t["first_event"] is not None]),
+            "time_to_first_text_s": _summary([t["first_text"] for t in completed if t["first_text"] is not None]),
+            "turn_s": _summary([t["total"] for t in completed]),
+            "events_per_s": round(events / run["wall"], 1),
+            "bytes_per_s": round(streamed_bytes / run["wall"]),
+            # What went over the wire (after batching / content-encoding)
+            "accept_encoding": options["accept_encoding"] or None,
+            "events_per_write": round(events / writes, 2) if writes else None,
+            "wire_bytes_per_s": round(wire_bytes / run["wall"]),
+            "wire_ratio": round(wire_bytes / streamed_bytes, 3) if streamed_bytes else None,
+            # Peak RSS growth during the run, split across concurrent streams
+            "memory_per_stream_kb": round(run["rss_growth_kb"] / options["clients"], 1),
+            "upstream_calls": dict(sorted(stubs.calls.items())),
+        }
+
+        regressions = []
+        if options["baseline"]:
+            regressions = self._check_baseline(report, options["baseline"], options["tolerance"])
+            report["baseline"] = options["baseline"]
+            report["regressions"] = regressions
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(output + "\n")
+
+        if report["errors"]:
+            raise CommandError(f"{report['errors']} turn(s) ended with an error event")
+        if regressions:
+            raise CommandError("Regression vs. baseline: " + "; ".join(regressions))
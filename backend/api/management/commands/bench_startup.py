@@ -0,0 +1,105 @@
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from decouple import config
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Process start → first served request must stay under this (seconds)
+STARTUP_BUDGET_SECONDS = config("STARTUP_BUDGET_SECONDS", default=5.0, cast=float)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Boots the production server (gunicorn + uvicorn worker) and measures "
+        "the time from process start to the first served request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3)
+        parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_SECONDS,
+                            help="Fail if the median startup exceeds this (seconds)")
+        parser.add_argument("--no-warmup", action="store_true",
+                            help="Skip tool import and upstream pre-connect at boot")
+        parser.add_argument("--timeout", type=float, default=60.0)
+        parser.add_argument("--output", help="Also write the JSON report to this file")
+
+    def _measure(self, options) -> float:
+        port = _free_port()
+        env = dict(os.environ)
+        if options["no_warmup"]:
+            env["TOOL_WARMUP"] = "False"
+            env["UPSTREAM_WARMUP"] = "False"
+
+        started = time.monotonic()
+        server = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn",
+                "--workers=1",
+                "--worker-class=uvicorn_worker.UvicornWorker",
+                "--preload",
+                "--bind", f"127.0.0.1:{port}",
+                "--log-level", "warning",
+                "backend.asgi:application",
+            ],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        try:
+            url = f"http://127.0.0.1:{port}/api/health"
+            while time.monotonic() - started < options["timeout"]:
+                if server.poll() is not None:
+                    raise CommandError(f"Server exited with code {server.returncode}")
+                try:
+                    with urllib.request.urlopen(url, timeout=1) as response:
+                        if response.status == 200:
+                            return time.monotonic() - started
+                except (urllib.error.URLError, ConnectionError, OSError):
+                    time.sleep(0.02)
+            raise CommandError(f"No response within {options['timeout']} s")
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    def handle(self, *args, **options):
+        runs = [self._measure(options) for _ in range(options["runs"])]
+        median = statistics.median(runs)
+
+        report = {
+            "benchmark": "startup_to_first_request",
+            "warmup": not options["no_warmup"],
+            "runs_s": [round(r, 3) for r in runs],
+            "median_s": round(median, 3),
+            "budget_s": options["budget"],
+            "ok": median <= options["budget"],
+        }
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(output + "\n")
+
+        if not report["ok"]:
+            raise CommandError(
+                f"Startup regression: median {median:.2f} s > budget {options['budget']:.2f} s"
+            )
@@ -1,3 +1,674 @@
-from django.test import TestCase
+import asyncio
+import io
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .core.imageSelection import asplit_selection_header, parse_selection
+from .core.imageStore import image_path, prune_images, put_image
+from .core.imageVariants import is_valid_upload
+from .core.resilience import (
+    CircuitBreaker,
+    TokenBucket,
+    Upstream,
+    UpstreamUnavailable,
+)
+from .core.singleFlight import SingleFlight
+from .core.sseFramer import acoalesce_deltas, amerge, negotiate_encoding
+from .core.turnReplay import (
+    ReplayUnavailable,
+    TurnBuffer,
+    TurnReplayStore,
+    parse_event_id,
+)
+
+
+class UpstreamError(Exception):
+    """Looks like an SDK error: status code and response headers."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = mock.Mock(headers={"retry-after": retry_after} if retry_after else {})
+
+
+class Clock:
+    """Stands in for time.monotonic() in resilience."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _calls(*outcomes):
+    """A callable that raises or returns each outcome in turn."""
+    outcomes = list(outcomes)
+    calls = []
+
+    def fn():
+        calls.append(len(calls))
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    return fn, calls
+
+# -------------------------------------------------------------------
+# Token bucket
+# -------------------------------------------------------------------
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("api.core.resilience.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=2.0, burst=3)
+        self.assertEqual([bucket.take() for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(bucket.take(), 0.5)
+
+    def test_refills_up_to_burst(self):
+        bucket = TokenBucket(rate=2.0, burst=3)
+        for _ in range(3):
+            bucket.take()
+
+        self.clock.now += 0.5
+        self.assertEqual(bucket.take(), 0.0)
+        self.assertGreater(bucket.take(), 0.0)
+
+        self.clock.now += 60
+        self.assertEqual([bucket.take() for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertGreater(bucket.take(), 0.0)
+
+# -------------------------------------------------------------------
+# Circuit breaker
+# -------------------------------------------------------------------
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("api.core.resilience.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failures=3, cooldown=30.0)
+
+    def _open(self):
+        for _ in range(3):
+            self.breaker.failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.allow(), (None, False))
+
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        wait, probe = self.breaker.allow()
+        self.assertAlmostEqual(wait, 30.0)
+        self.assertFalse(probe)
+
+    def test_success_resets_the_count(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_one_probe_after_cooldown(self):
+        self._open()
+        self.clock.now += 30
+
+        self.assertEqual(self.breaker.allow(), (None, True))
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        wait, probe = self.breaker.allow()
+        self.assertIsNotNone(wait)
+        self.assertFalse(probe)
+
+    def test_probe_success_closes(self):
+        self._open()
+        self.clock.now += 30
+        self.breaker.allow()
+
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.allow(), (None, False))
+
+    def test_probe_failure_reopens(self):
+        self._open()
+        self.clock.now += 30
+        self.breaker.allow()
+
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertIsNotNone(self.breaker.allow()[0])
+
+    def test_release_lets_the_next_request_probe(self):
+        self._open()
+        self.clock.now += 30
+        self.breaker.allow()
+
+        self.breaker.release()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(self.breaker.allow(), (None, True))
+
+# -------------------------------------------------------------------
+# Upstream (retry state machine)
+# -------------------------------------------------------------------
+
+class UpstreamTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.sleeps = []
+        patches = [
+            mock.patch("api.core.resilience.time.monotonic", self.clock),
+            mock.patch("api.core.resilience.time.sleep", self.sleeps.append),
+            # Jitter off: the full backoff delay
+            mock.patch("api.core.resilience.random.uniform", lambda low, high: high),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _upstream(self, **overrides):
+        options = {
+            "rate": 0, "burst": 1, "queue_max": 10, "queue_timeout": 5.0,
+            "retries": 2, "failures": 3, "cooldown": 30.0,
+        }
+        options.update(overrides)
+        return Upstream("test", **options)
+
+    def _half_open(self, upstream):
+        for _ in range(upstream.breaker.failures):
+            upstream.breaker.failure()
+        self.clock.now += upstream.breaker.cooldown
+
+    def test_retries_with_backoff_then_succeeds(self):
+        fn, calls = _calls(UpstreamError(503), UpstreamError(429), "ok")
+        self.assertEqual(self._upstream().call(fn), "ok")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.sleeps, [0.5, 1.0])
+
+    def test_uses_retry_after(self):
+        fn, _ = _calls(UpstreamError(429, retry_after="2"), "ok")
+        self._upstream().call(fn)
+        self.assertEqual(self.sleeps, [2.0])
+
+    def test_gives_up_on_a_long_retry_after(self):
+        fn, calls = _calls(UpstreamError(429, retry_after="600"), "ok")
+        with self.assertRaises(UpstreamError):
+            self._upstream().call(fn)
+        self.assertEqual(len(calls), 1)
+
+    def test_gives_up_after_max_retries(self):
+        fn, calls = _calls(*[UpstreamError(500)] * 3)
+        with self.assertRaises(UpstreamError):
+            self._upstream().call(fn)
+        self.assertEqual(len(calls), 3)
+
+    def test_no_retry_past_the_deadline(self):
+        fn, calls = _calls(UpstreamError(503), "ok")
+        with self.assertRaises(UpstreamError):
+            self._upstream().call(fn, deadline=self.clock.now + 0.25)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_does_not_retry_a_bad_request(self):
+        upstream = self._upstream()
+        upstream.breaker.failure()
+        fn, calls = _calls(UpstreamError(400))
+        with self.assertRaises(UpstreamError):
+            upstream.call(fn)
+        self.assertEqual(len(calls), 1)
+        # The upstream answered: that counts for its health
+        self.assertEqual(upstream.breaker.consecutive, 0)
+
+    def test_open_circuit_refuses_without_calling(self):
+        upstream = self._upstream()
+        fn, calls = _calls(*[UpstreamError(503)] * 3)
+        with self.assertRaises(UpstreamError):
+            upstream.call(fn)
+        self.assertEqual(upstream.breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(UpstreamUnavailable) as refused:
+            upstream.call(fn)
+        self.assertEqual(len(calls), 3)
+        self.assertAlmostEqual(refused.exception.retry_after, 30.0)
+
+    def test_probe_with_a_bad_request_closes_the_circuit(self):
+        upstream = self._upstream()
+        self._half_open(upstream)
+
+        fn, _ = _calls(UpstreamError(400), "ok")
+        with self.assertRaises(UpstreamError):
+            upstream.call(fn)
+        self.assertEqual(upstream.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(upstream.call(fn), "ok")
+
+    def test_cancelled_probe_frees_the_trial(self):
+        upstream = self._upstream()
+        self._half_open(upstream)
+        consecutive = upstream.breaker.consecutive
+
+        async def hang():
+            await asyncio.sleep(3600)
+
+        async def probe_and_cancel():
+            task = asyncio.ensure_future(upstream.acall(hang))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(probe_and_cancel())
+        # No verdict either way, and the next request may probe
+        self.assertEqual(upstream.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(upstream.breaker.consecutive, consecutive)
+        self.assertEqual(upstream.breaker.allow(), (None, True))
+
+    def test_probe_refused_by_the_rate_limit_frees_the_trial(self):
+        upstream = self._upstream(rate=0.01, burst=1, queue_timeout=1.0)
+        upstream.bucket.take()
+        self._half_open(upstream)
+
+        fn, calls = _calls("ok")
+        with self.assertRaises(UpstreamUnavailable):
+            upstream.call(fn)
+        self.assertEqual(calls, [])
+        self.assertEqual(upstream.breaker.allow(), (None, True))
+
+    def test_async_retries(self):
+        sleeps = []
+
+        async def fake_sleep(delay):
+            sleeps.append(delay)
+
+        outcomes = [UpstreamError(502), "ok"]
+
+        async def fn():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        with mock.patch("api.core.resilience.asyncio.sleep", fake_sleep):
+            result = asyncio.run(self._upstream().acall(fn))
+        self.assertEqual(result, "ok")
+        self.assertEqual(sleeps, [0.5])
+
+# -------------------------------------------------------------------
+# Image selection (header parsing)
+# -------------------------------------------------------------------
+
+CANDIDATES = [{"id": "SERP_1"}, {"id": "SERP_2"}]
+
+
+async def _deltas(*parts):
+    for part in parts:
+        yield part
+
+
+def _split(*parts):
+    """Runs asplit_selection_header; returns (chosen ids, visible text)."""
+    async def run():
+        chosen, rest = await asplit_selection_header(_deltas(*parts), CANDIDATES)
+        return [img["id"] for img in chosen], "".join([delta async for delta in rest])
+
+    return asyncio.run(run())
+
+
+class ParseSelectionTests(SimpleTestCase):
+    def test_chosen_id(self):
+        self.assertEqual(parse_selection("CHOSEN_IMAGE_ID: SERP_2", CANDIDATES), (True, [CANDIDATES[1]]))
+
+    def test_markdown_wrapped(self):
+        for reply in ("**CHOSEN_IMAGE_ID: SERP_1**", "`CHOSEN_IMAGE_ID: SERP_1`", "**CHOSEN_IMAGE_ID:** _SERP_1_"):
+            self.assertEqual(parse_selection(reply, CANDIDATES), (True, [CANDIDATES[0]]), reply)
+        self.assertEqual(parse_selection("**NO_SUITABLE_IMAGE**", CANDIDATES), (True, []))
+
+    def test_unknown_id_counts_as_no_image(self):
+        self.assertEqual(parse_selection("CHOSEN_IMAGE_ID: SERP_9", CANDIDATES), (True, []))
+
+    def test_not_a_selection(self):
+        self.assertEqual(parse_selection("The library opened in 2015.", CANDIDATES), (False, []))
+
+
+class SplitSelectionHeaderTests(SimpleTestCase):
+    def test_header_across_deltas(self):
+        self.assertEqual(
+            _split("CHOSEN_IMA", "GE_ID: SERP_2\n", "\n", "Here it is."),
+            (["SERP_2"], "Here it is."),
+        )
+
+    def test_markdown_header(self):
+        self.assertEqual(
+            _split("**CHOSEN_IMAGE_ID: ", "SERP_1**\n\nHere it is."),
+            (["SERP_1"], "Here it is."),
+        )
+
+    def test_unknown_id_is_hidden_and_chooses_nothing(self):
+        self.assertEqual(_split("CHOSEN_IMAGE_ID: SERP_9\n\nText."), ([], "Text."))
+
+    def test_no_image_header(self):
+        self.assertEqual(_split("NO_SUITABLE_IMAGE\n", "Text."), ([], "Text."))
+
+    def test_missing_header_passes_through(self):
+        self.assertEqual(_split("**Dokk1** is", " a library."), ([], "**Dokk1** is a library."))
+
+# -------------------------------------------------------------------
+# Single flight
+# -------------------------------------------------------------------
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.flight = SingleFlight("test")
+
+    def test_async_callers_share_one_call(self):
+        calls = []
+
+        async def fetch(query):
+            calls.append(query)
+            await asyncio.sleep(0.01)
+            return {"images": [query]}
+
+        async def run():
+            return await asyncio.gather(*[
+                self.flight.ado("dokk1", fetch, "dokk1") for _ in range(3)
+            ])
+
+        results = asyncio.run(run())
+        self.assertEqual(calls, ["dokk1"])
+        self.assertEqual(results, [{"images": ["dokk1"]}] * 3)
+        # Joiners get their own copy
+        self.assertIsNot(results[0], results[1])
+
+    def test_async_followers_get_the_leaders_exception(self):
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream down")
+
+        async def run():
+            return await asyncio.gather(
+                *[self.flight.ado("key", fail) for _ in range(2)],
+                return_exceptions=True,
+            )
+
+        for outcome in asyncio.run(run()):
+            self.assertIsInstance(outcome, ValueError)
+
+    def test_cancelled_follower_leaves_the_leader_running(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return "ok"
+
+        async def run():
+            leader = asyncio.ensure_future(self.flight.ado("key", fetch))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(self.flight.ado("key", fetch))
+            await asyncio.sleep(0)
+            follower.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await follower
+            return await leader
+
+        self.assertEqual(asyncio.run(run()), "ok")
+        self.assertEqual(calls, [1])
+
+    def test_call_is_cancelled_when_nobody_waits(self):
+        cancelled = []
+
+        async def hang():
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def run():
+            task = asyncio.ensure_future(self.flight.ado("key", hang))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        self.assertEqual(cancelled, [True])
+
+    def test_thread_followers_get_the_leaders_result_or_exception(self):
+        for outcome in ("ok", ValueError("upstream down")):
+            started, release = threading.Event(), threading.Event()
+            calls, results = [], []
+
+            def fetch():
+                calls.append(1)
+                started.set()
+                release.wait(5)
+                if isinstance(outcome, Exception):
+                    raise outcome
+                return outcome
+
+            def caller():
+                try:
+                    results.append(self.flight.do("key", fetch))
+                except ValueError as exc:
+                    results.append(exc)
+
+            leader = threading.Thread(target=caller)
+            leader.start()
+            started.wait(5)
+            follower = threading.Thread(target=caller)
+            follower.start()
+            # The follower is waiting on the leader's call
+            while self.flight._calls["key"].waiters < 2:
+                time.sleep(0.001)
+            release.set()
+            leader.join(5)
+            follower.join(5)
+
+            self.assertEqual(calls, [1])
+            self.assertEqual(results, [outcome, outcome])
+
+# -------------------------------------------------------------------
+# Turn replay (Last-Event-ID resume)
+# -------------------------------------------------------------------
+
+def _frame(n):
+    return f"data: {n}\n\n"
+
+
+def _read(buffer, after):
+    async def run():
+        return [frame async for frame in buffer.asubscribe(after)]
+
+    return asyncio.run(run())
+
+
+class TurnReplayTests(SimpleTestCase):
+    def _finished(self, count, max_events=100):
+        buffer = TurnBuffer("turn", max_events=max_events, max_bytes=1 << 20)
+        for n in range(1, count + 1):
+            buffer.append(_frame(n))
+        buffer.close()
+        return buffer
+
+    def test_resume_replays_what_was_missed(self):
+        frames = _read(self._finished(4), after=2)
+        self.assertEqual(frames, [
+            "id: turn-3\n" + _frame(3),
+            "id: turn-4\n" + _frame(4),
+        ])
+
+    def test_id_before_the_start_of_the_buffer(self):
+        buffer = self._finished(5, max_events=3)
+        with self.assertRaises(ReplayUnavailable):
+            _read(buffer, after=1)
+        # The oldest event still buffered is fine
+        self.assertEqual(len(_read(buffer, after=2)), 3)
+
+    def test_resume_after_done(self):
+        buffer = self._finished(2)
+        buffer.append("data: [DONE]\n\n")
+        self.assertEqual(_read(buffer, after=3), [])
+        with self.assertRaises(ReplayUnavailable):
+            _read(buffer, after=4)
+
+    def test_unknown_turn(self):
+        store = TurnReplayStore(ttl=300.0, total_bytes=1 << 20)
+        buffer = store.create()
+        self.assertIs(store.get(buffer.turn_id), buffer)
+        self.assertIsNone(store.get("0" * 32))
+        self.assertIsNone(parse_event_id("not-an-id"))
+        self.assertEqual(parse_event_id(f"{buffer.turn_id}-7"), (buffer.turn_id, 7))
+
+    def test_live_subscriber_gets_new_events(self):
+        async def collect(buffer):
+            return [frame async for frame in buffer.asubscribe(0)]
+
+        async def run():
+            buffer = TurnBuffer("turn", max_events=100, max_bytes=1 << 20)
+            buffer.append(_frame(1))
+            reader = asyncio.ensure_future(collect(buffer))
+            await asyncio.sleep(0)
+            buffer.append(_frame(2))
+            buffer.close()
+            return await reader
+
+        self.assertEqual(len(asyncio.run(run())), 2)
+
+# -------------------------------------------------------------------
+# SSE framing
+# -------------------------------------------------------------------
+
+class SSEFramerTests(SimpleTestCase):
+    def test_coalesce_flushes_on_size(self):
+        async def run():
+            deltas = _deltas("ab", "cd", "ef", "g")
+            return [frame async for frame in acoalesce_deltas(deltas, max_bytes=4, flush_interval=60)]
+
+        self.assertEqual(asyncio.run(run()), ["abcd", "efg"])
+
+    def test_coalesce_flushes_on_deadline_while_upstream_stalls(self):
+        frames = []
+
+        async def stalled():
+            yield "Hello"
+            yield ", "
+            await asyncio.sleep(0.2)
+            yield "world"
+
+        async def run():
+            started = asyncio.get_running_loop().time()
+            async for frame in acoalesce_deltas(stalled(), max_bytes=1024, flush_interval=0.02):
+                frames.append((frame, asyncio.get_running_loop().time() - started))
+
+        asyncio.run(run())
+        self.assertEqual([frame for frame, _ in frames], ["Hello, ", "world"])
+        # Sent at the deadline, not when the stalled upstream resumed
+        self.assertLess(frames[0][1], 0.15)
+
+    def test_merge_raises_an_error_from_one_stream_and_stops_the_rest(self):
+        cancelled = []
+
+        async def slow():
+            try:
+                yield "slow"
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise ValueError("render failed")
+            yield
+
+        async def run():
+            items = []
+            with self.assertRaises(ValueError):
+                async for item in amerge(slow(), failing()):
+                    items.append(item)
+            await asyncio.sleep(0.01)
+            return items
+
+        self.assertEqual(asyncio.run(run()), ["slow"])
+        self.assertEqual(cancelled, [True])
+
+    def test_negotiate_encoding(self):
+        with mock.patch("api.core.sseFramer.SSE_COMPRESSION", ["br", "gzip"]):
+            self.assertEqual(negotiate_encoding("gzip, deflate, br"), "br")
+            self.assertEqual(negotiate_encoding("gzip"), "gzip")
+            self.assertEqual(negotiate_encoding("br;q=0, gzip;q=0.5"), "gzip")
+            self.assertEqual(negotiate_encoding("*;q=0"), "")
+            self.assertEqual(negotiate_encoding("gzip;q=0, *"), "br")
+            self.assertEqual(negotiate_encoding(""), "")
+
+# -------------------------------------------------------------------
+# Image store (uploads, eviction)
+# -------------------------------------------------------------------
+
+def _png(width=4, height=4):
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 100, 0)).save(out, format="PNG")
+    return out.getvalue()
+
+
+class ImageUploadTests(SimpleTestCase):
+    def test_accepts_an_image(self):
+        self.assertTrue(is_valid_upload(_png()))
+
+    def test_refuses_other_bytes(self):
+        self.assertFalse(is_valid_upload(b"<svg onload=alert(1)>"))
+        self.assertFalse(is_valid_upload(_png()[:40]))
+
+    def test_refuses_too_many_pixels(self):
+        with mock.patch("api.core.imageVariants.UPLOAD_MAX_PIXELS", 15):
+            self.assertFalse(is_valid_upload(_png()))
+
+
+class ImageStoreEvictionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patches = [
+            mock.patch("api.core.imageStore.IMAGE_STORE_DIR", Path(directory.name)),
+            # put_image would prune on its own
+            mock.patch("api.core.imageStore.IMAGE_STORE_PRUNE_INTERVAL", 3600.0),
+            mock.patch("api.core.imageStore._last_prune", float("inf")),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _put(self, data, age):
+        image_id = put_image(data)
+        stamp = time.time() - age
+        os.utime(image_path(image_id), (stamp, stamp))
+        return image_id
+
+    def test_drops_images_past_the_max_age(self):
+        old = self._put(b"old", age=10 * 24 * 3600)
+        new = self._put(b"new", age=60)
+        self.assertEqual(prune_images(), 1)
+        self.assertFalse(image_path(old).exists())
+        self.assertTrue(image_path(new).exists())
+
+    def test_drops_least_recently_used_over_the_byte_cap(self):
+        ids = [self._put(bytes([n]) * 100, age=300 - n) for n in range(3)]
+        with mock.patch("api.core.imageStore.IMAGE_STORE_MAX_BYTES", 250):
+            self.assertEqual(prune_images(), 1)
+        self.assertEqual([image_path(i).exists() for i in ids], [False, True, True])
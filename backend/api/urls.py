@@ -1,6 +1,12 @@
 from django.urls import path
-from .views import chat
+from .views import chat, health, image, job, job_events, metrics, reference
 
 urlpatterns = [
-    path("chat", chat, name="check")
+    path("chat", chat, name="check"),
+    path("images/<str:image_id>", image, name="image"),
+    path("references/<str:key>", reference, name="reference"),
+    path("jobs/<str:job_id>", job, name="job"),
+    path("jobs/<str:job_id>/events", job_events, name="job_events"),
+    path("health", health, name="health"),
+    path("metrics", metrics, name="metrics"),
 ]
@@ -1,118 +1,733 @@
-from django.http import StreamingHttpResponse
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseNotFound,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
+from functools import lru_cache
 from pathlib import Path
+import asyncio
+import base64
+import binascii
 import json
 import re
+import time
 
 from .core.azureLangchainAgent import (
-    maybe_generate_image,
-    send_chat_completion_stream,
+    AGENT_MODE,
+    GPT_COMPLETION_MODEL,
+    PHASE_LABELS,
+    StreamedAnswer,
+    amaybe_generate_image,
+    arun_late_tool_calls,
+    asend_chat_completion_stream,
+    astream_turn,
+    asummarize_history,
+)
+from .core.azureRouter import azure_router
+from .core.historyManager import afold_turns
+from .core.imageSelection import asplit_selection_header
+from .core.imageStore import get_image, is_image_id, put_image, sniff_mime_type
+from .core.imageVariants import is_valid_upload
+from .core.latencyMetrics import (
+    CACHE_STATS,
+    METRICS_ALLOW_REMOTE,
+    METRICS_ENABLED,
+    STREAM_BYTES,
+    STREAM_CHUNK_INTERVAL_SECONDS,
+    STREAM_CHUNKS,
+    STREAM_RESUMES,
+    TURN_CACHE,
+    TURN_SECONDS,
+    TURNS,
+    TurnTimings,
+    atime_first_delta,
+    current_timings,
+    render_metrics,
+    span,
+)
+from .core.referenceProxy import (
+    ReferenceFetchError,
+    fetch_reference,
+    reference_key,
+    register_reference,
+)
+from .core.renderJobs import JOB_DONE, render_queue
+from .core.resilience import UpstreamUnavailable
+from .core.sessionStore import session_store, to_message_dict
+from .core.sqliteCache import cache_stats
+from .core.sseFramer import (
+    SSE_COMPRESSION,
+    SSE_HEARTBEAT_INTERVAL,
+    acoalesce_deltas,
+    aencode_stream,
+    amerge,
+    negotiate_encoding,
+    sse_comment,
+    sse_event,
 )
+from .core.toolRegistry import tool_status
+from .core.turnCache import (
+    TURN_CACHE_ENABLED,
+    TurnRecorder,
+    turn_cache,
+    turn_cache_key,
+)
+from .core.turnReplay import (
+    REPLAY_ENABLED,
+    ReplayUnavailable,
+    TurnBuffer,
+    arecord_turn,
+    parse_event_id,
+    turn_replay,
+)
+
+@lru_cache(maxsize=1)
+def load_system_prompt() -> str:
+    # Read once per worker instead of on every request
+    prompt_path = Path(__file__).parent / "core" / "prompts" / "gpt_prompt.md"
+
+    with open(prompt_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+# Background summary folds, held so they aren't garbage-collected mid-run
+folding_sessions = set()
+background_tasks = set()
+
+async def fold_session_history(session_id: str):
+    """Folds old turns of a long session into its rolling summary."""
+    if session_id in folding_sessions:
+        return
+    folding_sessions.add(session_id)
+
+    try:
+        turns = await asyncio.to_thread(session_store.get, session_id)
+        folded = await afold_turns(turns or [], asummarize_history)
+        if folded:
+            fold_end, summary = folded
+            await asyncio.to_thread(session_store.compact, session_id, fold_end, [summary])
+    except Exception as exc:
+        print(f"History summary failed for session {session_id}: {exc!r}")
+    finally:
+        folding_sessions.discard(session_id)
+
+async def prefetch_reference(url: str):
+    """Pulls a chosen reference image into the local cache ahead of the client."""
+    try:
+        await asyncio.to_thread(fetch_reference, reference_key(url))
+    except ReferenceFetchError as exc:
+        print(f"Reference prefetch failed for {url}: {exc}")
+
+def render_job_event(image_ref: str, snapshot) -> str:
+    """Finished render → the image itself; otherwise its job status."""
+    if snapshot["status"] == JOB_DONE:
+        # By reference: the client fetches the bytes from /api/images/<id>.
+        # "variants" lists smaller encodings, smallest first; "url" stays
+        # the original.
+        return sse_event({
+            "type": "image",
+            "id": image_ref,
+            "job_id": snapshot["job_id"],
+            "image_id": snapshot["image_id"],
+            "url": snapshot["url"],
+            "variants": snapshot["variants"],
+        })
+
+    return sse_event({"type": "job", "id": image_ref, **snapshot})
+
+async def error_stream(message: str):
+    yield sse_event({
+        "type": "error",
+        "message": message
+    })
+
+async def session_expired_stream():
+    yield sse_event({"type": "session_expired"})
+
+def upstream_error_event(exc: UpstreamUnavailable) -> str:
+    return sse_event({
+        "type": "error",
+        "message": str(exc),
+        "upstream": exc.upstream,
+        "retry_after": None if exc.retry_after is None else round(exc.retry_after, 1),
+    })
+
+def sse_response(request, frames, headers=None) -> StreamingHttpResponse:
+    """An event stream, batched and compressed as far as the client allows."""
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        **(headers or {}),
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if SSE_COMPRESSION:
+        headers["Vary"] = "Accept-Encoding"
+
+    return StreamingHttpResponse(
+        aencode_stream(frames, encoding),
+        content_type="text/event-stream",
+        headers=headers,
+    )
+
+async def subscribe_stream(buffer: TurnBuffer, after: int):
+    try:
+        async for frame in buffer.asubscribe(after):
+            yield frame
+    except ReplayUnavailable as exc:
+        print(f"Resume failed: {exc}")
+        yield sse_event({
+            "type": "error",
+            "message": "Part of this response is no longer available"
+        })
+
+async def record_and_subscribe(buffer: TurnBuffer, frames):
+    """
+    Starts recording the turn on the first read, so the task runs on the
+    loop that serves the response. Under WSGI the view's own event loop
+    is gone by then, and a task started there would die with it.
+    """
+    task = asyncio.ensure_future(arecord_turn(buffer, frames))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    async for frame in subscribe_stream(buffer, 0):
+        yield frame
+
+def resume_turn(request, last_event_id: str):
+    """Replays what a dropped stream missed, then continues live."""
+    parsed = parse_event_id(last_event_id)
+    buffer = turn_replay.get(parsed[0]) if parsed else None
+
+    if METRICS_ENABLED:
+        STREAM_RESUMES.inc(outcome="resumed" if buffer else "expired")
+
+    if buffer is None:
+        return StreamingHttpResponse(
+            error_stream("This response is no longer available"),
+            content_type="text/event-stream"
+        )
+
+    return sse_response(request, subscribe_stream(buffer, parsed[1]), {
+        "X-Turn-Id": buffer.turn_id,
+    })
 
 @csrf_exempt
-def chat(request):
+async def chat(request):
+    # Reconnect of a dropped stream: no new upstream work, the turn is
+    # already running (or done) in the replay buffer
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    if last_event_id and REPLAY_ENABLED:
+        return resume_turn(request, last_event_id)
+
+    # Per-phase spans → Server-Timing header, "timing" event and /api/metrics
+    timings = TurnTimings()
+    current_timings.set(timings)
+
     # --------------------------------------------------
     # Parse JSON body
     # --------------------------------------------------
     try:
         body = json.loads(request.body.decode("utf-8"))
         message = body.get("message")
+        session_id = body.get("session_id") or ""
+        # Legacy clients resend the whole transcript; session clients only
+        # send the new message
         history = body.get("history", [])
-        reference_image = body.get("reference_image", "")
+        reference_image_id = body.get("reference_image_id", "")
+        # Legacy clients still upload the previous image inline
+        legacy_reference_image = body.get("reference_image", "")
     except json.JSONDecodeError:
         return StreamingHttpResponse(
-            "data: " + json.dumps({
-                "type": "error",
-                "message": "Invalid JSON"
-            }) + "\n\n",
+            error_stream("Invalid JSON"),
             content_type="text/event-stream"
         )
 
     if not message:
         return StreamingHttpResponse(
-            "data: " + json.dumps({
-                "type": "error",
-                "message": "No message provided"
-            }) + "\n\n",
+            error_stream("No message provided"),
             content_type="text/event-stream"
         )
 
+    if legacy_reference_image and not reference_image_id:
+        try:
+            upload = base64.b64decode(legacy_reference_image, validate=True)
+        except (binascii.Error, ValueError):
+            upload = b""
+        # Only real images reach the store (and, later, Gemini)
+        if not upload or not await asyncio.to_thread(is_valid_upload, upload):
+            return StreamingHttpResponse(
+                error_stream("Invalid reference_image"),
+                content_type="text/event-stream"
+            )
+        reference_image_id = await asyncio.to_thread(put_image, upload)
+
     # --------------------------------------------------
-    # Load system prompt
+    # Resolve the conversation session
     # --------------------------------------------------
-    current_dir = Path(__file__).parent
-    prompt_path = current_dir / "core" / "prompts" / "gpt_prompt.md"
+    with span("session_load"):
+        stored_turns = (
+            await asyncio.to_thread(session_store.get, session_id) if session_id else None
+        )
 
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        system_prompt = f.read()
+    if stored_turns is None and session_id and not history:
+        # The session is gone (expired, evicted, a restart, or it lives in
+        # another worker's memory): answering now would drop the context.
+        # The client resends its local transcript instead
+        return StreamingHttpResponse(
+            session_expired_stream(),
+            content_type="text/event-stream"
+        )
+
+    if stored_turns is None:
+        # New (or expired) session: seed it from the legacy history, if any.
+        # IMPORTANT: images are handled as events, not text
+        stored_turns = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in history
+            if msg.get("content")
+        ]
+        # Legacy history already ends with the new user message
+        if stored_turns and stored_turns[-1] == {"role": "user", "content": message}:
+            stored_turns.pop()
+
+        session_id = await asyncio.to_thread(session_store.create, stored_turns)
 
     # --------------------------------------------------
     # Build conversation history
     # IMPORTANT:
     # - NO placeholder instructions
-    # - Images are handled as events, not text
+    # - Stored turns include tool calls and tool results
     # --------------------------------------------------
+    with span("prompt_load"):
+        system_prompt = load_system_prompt()
+
     full_history = [
-        {"role": "system", "content": system_prompt}
+        {"role": "system", "content": system_prompt},
+        *stored_turns,
+        {"role": "user", "content": message},
     ]
+    turn_start = len(full_history) - 1
 
-    for msg in history:
-        if msg.get("content"):
-            full_history.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+    # --------------------------------------------------
+    # Turn cache (opt-in): a repeated prompt replays the recorded turn.
+    # The reference image is part of the key
+    # --------------------------------------------------
+    cache_key = None
+    cached_turn = None
+    if TURN_CACHE_ENABLED:
+        with span("turn_cache"):
+            cache_key = turn_cache_key(
+                system_prompt, stored_turns, message, GPT_COMPLETION_MODEL, reference_image_id
+            )
+            cached_turn = await asyncio.to_thread(turn_cache.get, cache_key)
+        if METRICS_ENABLED:
+            TURN_CACHE.inc(outcome="hit" if cached_turn else "miss")
+
+    recorder = TurnRecorder() if cache_key and cached_turn is None else None
 
     # --------------------------------------------------
     # SSE event stream
     # --------------------------------------------------
-    def event_stream():
-        # 1️⃣ Let the agent handle tools + image decisions
-        updated_history, reference_images, generated_images = (
-            maybe_generate_image(full_history, reference_image=reference_image)
-        )
+    # Async generator: Django's ASGI handler drives it on the event loop,
+    # so a single worker can keep many streams open at once.
+    async def turn_events():
+        # 0️⃣ Tell the client which session this turn belongs to
+        yield sse_event({
+            "type": "session",
+            "session_id": session_id,
+        })
 
-        # 2️⃣ Send reference images chosen by the LLM (FIRST)
-        for img in reference_images:
-            payload = json.dumps({
-                "type": "image",
-                "id": img["id"],
-                "url": img["url"],
-                "source": img.get("source"),
-                "title": img.get("title"),
-            })
-            print(f"Reference image: {img}")
-            yield f"data: {payload}\n\n"
-
-        # 3️⃣ Send AI-generated images (SECOND)
-        for img in generated_images:
-            payload = json.dumps({
-                "type": "image",
-                "id": img["id"],
-                "b64": img["b64"],
-            })
-            print(f"Generated image")
-            yield f"data: {payload}\n\n"
+        # 1️⃣ Let the agent handle tools + image decisions in the background,
+        #    streaming its phase changes while it works
+        progress = asyncio.Queue()
+
+        def on_progress(phase: str, status: str):
+            progress.put_nowait(sse_event({
+                "type": "progress",
+                "phase": phase,
+                "status": status,
+                "label": PHASE_LABELS.get(phase, phase),
+            }))
+
+        async def agent_events(output: list, agent, *args, **kwargs):
+            """Progress events (and heartbeats) while the agent works; its result goes to output."""
+            agent_task = asyncio.ensure_future(agent(*args, **kwargs))
+            agent_task.add_done_callback(lambda _: progress.put_nowait(None))
+
+            try:
+                while True:
+                    try:
+                        event = await asyncio.wait_for(
+                            progress.get(), timeout=SSE_HEARTBEAT_INTERVAL
+                        )
+                    except asyncio.TimeoutError:
+                        yield sse_comment()
+                        continue
+                    if event is None:
+                        break
+                    yield event
+            finally:
+                # Client went away mid-phase → stop the upstream work too
+                if not agent_task.done():
+                    agent_task.cancel()
+
+            output.append(agent_task.result())
+
+        async def deliver(agent_result, narration, answer):
+            """Steps 2️⃣-4️⃣: images, then narration with renders in between."""
+            updated_history, reference_images, generated_images, pending_candidates = agent_result
+            render_jobs = [render_queue.get(img["job_id"]) for img in generated_images]
 
-        def strip_image_urls(text: str) -> str:
-            return re.sub(r'https?://\S+\.(jpg|jpeg|png|webp)\S*', '', text)
+            if narration is None:
+                narration = asend_chat_completion_stream(updated_history)
 
-        for chunk in send_chat_completion_stream(updated_history):
-            clean = strip_image_urls(chunk)
-            payload = json.dumps({
-                "type": "text",
-                "delta": clean
+            # Inline selection: the narration's hidden first line picks the image,
+            # so read it off before sending any images or text
+            narration = atime_first_delta(narration, "stream_start")
+            if pending_candidates:
+                inline_choice, narration = await asplit_selection_header(
+                    narration, pending_candidates
+                )
+                reference_images = reference_images + inline_choice
+
+            # 2️⃣ Send reference images chosen by the LLM (FIRST), through our
+            #    proxy: the origin is fetched once (starting now) and every
+            #    headset loads it from us
+            for img in reference_images:
+                print(f"Reference image: {img}")
+                proxy_url = await asyncio.to_thread(register_reference, img["url"])
+
+                task = asyncio.ensure_future(prefetch_reference(img["url"]))
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+
+                yield sse_event({
+                    "type": "image",
+                    "id": img["id"],
+                    "url": proxy_url,
+                    "origin_url": img["url"],
+                    "source": img.get("source"),
+                    "title": img.get("title"),
+                })
+
+            # 3️⃣ Announce AI-generated images (SECOND): they render on the
+            #    render queue; the client can re-attach with the job id
+            for img, render_job in zip(generated_images, render_jobs):
+                yield render_job_event(img["id"], render_queue.snapshot(render_job))
+
+            def strip_image_urls(text: str) -> str:
+                return re.sub(r'https?://\S+\.(jpg|jpeg|png|webp)\S*', '', text)
+
+            # 4️⃣ Stream narration, merged into a few frames instead of one
+            #    event per character
+            async def narration_events():
+                narration_text = []
+                last_chunk_at = None
+                with span("narration"):
+                    async for chunk in acoalesce_deltas(narration):
+                        clean = strip_image_urls(chunk)
+                        narration_text.append(clean)
+                        yield sse_event({
+                            "type": "text",
+                            "delta": clean
+                        })
+
+                        if METRICS_ENABLED:
+                            now = time.perf_counter()
+                            if last_chunk_at is not None:
+                                STREAM_CHUNK_INTERVAL_SECONDS.observe(now - last_chunk_at)
+                            last_chunk_at = now
+                            STREAM_CHUNKS.inc()
+                            STREAM_BYTES.inc(len(clean.encode("utf-8")))
+
+                # Tool calls still to run after this text: the turn is
+                # persisted after their narration instead
+                if answer is not None and answer.tool_calls:
+                    return
+
+                # Persist this turn (user message, tool calls, tool results,
+                # answer) as soon as the narration ends, even if the client
+                # leaves while an image is still rendering; per-turn system
+                # instructions are not kept
+                turn = [
+                    msg for msg in map(to_message_dict, updated_history[turn_start:])
+                    if msg.get("role") != "system"
+                ]
+                turn.append({"role": "assistant", "content": "".join(narration_text)})
+                await asyncio.to_thread(session_store.append, session_id, turn)
+                if recorder is not None:
+                    recorder.turn = turn
+
+                # Summarize outside the turn so it never delays a response
+                task = asyncio.ensure_future(fold_session_history(session_id))
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+
+            # ... while generated images are sent the moment their render ends
+            #    (with progress until then), in between narration frames
+            async def render_events(image_ref: str, render_job):
+                async for snapshot in render_queue.awatch(render_job):
+                    yield render_job_event(image_ref, snapshot)
+
+            async for event in amerge(
+                narration_events(),
+                *(render_events(img["id"], render_job) for img, render_job in zip(generated_images, render_jobs)),
+            ):
+                yield event
+
+        # AGENT_MODE=stream: one streaming call with tools; a text answer
+        # comes back already streaming (see astream_turn)
+        agent = astream_turn if AGENT_MODE == "stream" else amaybe_generate_image
+        output = []
+        async for event in agent_events(
+            output, agent, full_history,
+            reference_image_id=reference_image_id, on_progress=on_progress,
+        ):
+            yield event
+
+        if AGENT_MODE == "stream":
+            *agent_result, narration = output[0]
+        else:
+            agent_result, narration = output[0], None
+
+        answer = narration if isinstance(narration, StreamedAnswer) else None
+        async for event in deliver(agent_result, narration, answer):
+            yield event
+
+        # A streamed answer that called tools after its text: run them now,
+        # then narrate their results
+        if answer is not None and answer.tool_calls:
+            output = []
+            async for event in agent_events(
+                output, arun_late_tool_calls, agent_result[0], answer,
+                reference_image_id=reference_image_id, on_progress=on_progress,
+            ):
+                yield event
+            async for event in deliver(output[0], None, None):
+                yield event
+
+        # 5️⃣ Where the time went, then end of stream
+        yield timing_event()
+        yield "data: [DONE]\n\n"
+
+    async def cached_turn_events():
+        # Same images and text as the recorded turn, with no upstream
+        # calls; the session gets the recorded turn too
+        yield sse_event({
+            "type": "session",
+            "session_id": session_id,
+        })
+        for payload in cached_turn["events"]:
+            yield sse_event(payload)
+
+        await asyncio.to_thread(session_store.append, session_id, cached_turn["turn"])
+
+        yield timing_event()
+        yield "data: [DONE]\n\n"
+
+    def timing_event() -> str:
+        return sse_event({
+            "type": "timing",
+            "spans_ms": timings.as_dict(),
+            "total_ms": round(timings.elapsed() * 1000, 1),
+        })
+
+    async def event_stream():
+        # The generator runs in the ASGI handler's context, not the view's
+        current_timings.set(timings)
+        outcome = "error"
+        try:
+            events = turn_events() if cached_turn is None else cached_turn_events()
+            async for event in events:
+                if recorder is not None:
+                    recorder.observe(event)
+                yield event
+
+            entry = recorder.entry() if recorder is not None else None
+            if entry is not None:
+                await asyncio.to_thread(turn_cache.set, cache_key, entry)
+                if METRICS_ENABLED:
+                    TURN_CACHE.inc(outcome="stored")
+            outcome = "ok"
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "disconnected"
+            raise
+        except UpstreamUnavailable as exc:
+            # Rate limited / circuit open: fail fast with a clean error
+            # event instead of a broken stream
+            print(f"Turn refused by {exc.upstream}: {exc}")
+            outcome = "unavailable"
+            yield upstream_error_event(exc)
+            yield "data: [DONE]\n\n"
+        except Exception as exc:
+            # Upstream still failing after retries, or a bug
+            print(f"Turn failed: {exc!r}")
+            yield sse_event({
+                "type": "error",
+                "message": "Something went wrong, please try again"
             })
-            yield f"data: {payload}\n\n"
+            yield "data: [DONE]\n\n"
+        finally:
+            if METRICS_ENABLED:
+                TURN_SECONDS.observe(timings.elapsed(), outcome=outcome)
+                TURNS.inc(outcome=outcome)
+
+    headers = {
+        "X-Session-Id": session_id,
+        # Only what ran before the stream; later spans are in the
+        # final "timing" event
+        "Server-Timing": timings.server_timing(),
+    }
+
+    if not REPLAY_ENABLED:
+        return sse_response(request, event_stream(), headers)
+
+    # The turn runs to the end into a replay buffer even if the client
+    # drops; every event gets an id, so a reconnect with Last-Event-ID
+    # picks up where it left off
+    buffer = turn_replay.create()
+    headers["X-Turn-Id"] = buffer.turn_id
+    return sse_response(request, record_and_subscribe(buffer, event_stream()), headers)
+
 
-        # 5️⃣ End of stream
+# --------------------------------------------------
+# Content-addressed image store
+# --------------------------------------------------
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def ranged_response(request, data: bytes) -> HttpResponse:
+    """Full response, or a single byte range (206) if the client asked for one."""
+    content_type = sniff_mime_type(data)
+    match = RANGE_RE.match(request.headers.get("Range", "").strip())
+
+    if match is None or not any(match.groups()):
+        response = HttpResponse(data, content_type=content_type)
+    else:
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(len(data) - int(last), 0)
+            end = len(data) - 1
+
+        if start > end or start >= len(data):
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{len(data)}"
+        else:
+            response = HttpResponse(data[start:end + 1], status=206, content_type=content_type)
+            response["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+async def serve_image(request, image_id: str) -> HttpResponse:
+    # Ids are content hashes: the same id always means the same bytes
+    etag = f'"{image_id}"'
+    cache_control = "public, max-age=31536000, immutable"
+
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponse(status=304)
+    else:
+        data = await asyncio.to_thread(get_image, image_id)
+        if data is None:
+            return HttpResponseNotFound()
+        response = ranged_response(request, data)
+
+    response["ETag"] = etag
+    response["Cache-Control"] = cache_control
+    return response
+
+@require_GET
+async def image(request, image_id: str):
+    if not is_image_id(image_id):
+        return HttpResponseNotFound()
+
+    return await serve_image(request, image_id)
+
+
+# --------------------------------------------------
+# Render jobs (poll, or re-attach after a disconnect)
+# --------------------------------------------------
+@require_GET
+async def job(request, job_id: str):
+    render_job = render_queue.get(job_id)
+    if render_job is None:
+        return HttpResponseNotFound()
+
+    return JsonResponse(render_queue.snapshot(render_job))
+
+@require_GET
+async def job_events(request, job_id: str):
+    render_job = render_queue.get(job_id)
+    if render_job is None:
+        return HttpResponseNotFound()
+
+    # Same events as in the chat stream; ?id= is the image id (IMAGE_n)
+    image_ref = request.GET.get("id", "")
+
+    async def event_stream():
+        yield render_job_event(image_ref, render_queue.snapshot(render_job))
+        async for snapshot in render_queue.awatch(render_job):
+            yield render_job_event(image_ref, snapshot)
         yield "data: [DONE]\n\n"
 
-    return StreamingHttpResponse(
-        event_stream(),
-        content_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-        },
-    )
+    return sse_response(request, event_stream())
+
+
+# --------------------------------------------------
+# Reference image proxy (third-party images, fetched once)
+# --------------------------------------------------
+@require_GET
+async def reference(request, key: str):
+    started = time.perf_counter()
+    try:
+        with span("reference_fetch"):
+            image_id = await asyncio.to_thread(fetch_reference, key)
+    except ReferenceFetchError as exc:
+        print(f"Reference proxy failed for {key}: {exc}")
+        return HttpResponse(status=502)
+
+    if image_id is None:
+        return HttpResponseNotFound()
+
+    response = await serve_image(request, image_id)
+    response["Server-Timing"] = f"reference_fetch;dur={(time.perf_counter() - started) * 1000:.1f}"
+    return response
+
+
+# --------------------------------------------------
+# Metrics (Prometheus text format, this worker only)
+# --------------------------------------------------
+@require_GET
+async def metrics(request):
+    if not METRICS_ENABLED:
+        return HttpResponseNotFound()
+
+    if not METRICS_ALLOW_REMOTE and request.META.get("REMOTE_ADDR") not in ("127.0.0.1", "::1"):
+        return HttpResponseForbidden()
+
+    # Caches keep their own counters; copy them in at scrape time
+    for cache, stats in cache_stats().items():
+        for stat, value in stats.items():
+            CACHE_STATS.set(value, cache=cache, stat=stat)
+
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4")
+
+
+# --------------------------------------------------
+# Health (used by the startup benchmark; never loads tools)
+# --------------------------------------------------
+@require_GET
+async def health(request):
+    return JsonResponse({
+        "status": "ok",
+        "tools": tool_status(),
+        "azure_deployments": azure_router.status(),
+    })
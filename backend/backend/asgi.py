@@ -3,6 +3,10 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is the production entrypoint: gunicorn runs it with
+``uvicorn_worker.UvicornWorker`` so the async ``api.views.chat`` view can keep
+many SSE streams open per worker.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -13,4 +17,35 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+import asyncio  # noqa: E402
+
+from api.core.clientRegistry import UPSTREAM_WARMUP, aclose, awarmup  # noqa: E402
+from api.core.historyManager import load_tokenizer  # noqa: E402
+from api.core.toolRegistry import TOOL_WARMUP, warmup_tools  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """
+    Django's ASGI handler doesn't speak the lifespan protocol, so it is
+    handled here: each worker loads the tokenizer, imports its tools,
+    builds and pre-connects its upstream clients at startup and closes
+    them on shutdown.
+    """
+    if scope["type"] != "lifespan":
+        return await django_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await asyncio.to_thread(load_tokenizer)
+            if TOOL_WARMUP:
+                await asyncio.to_thread(warmup_tools)
+            if UPSTREAM_WARMUP:
+                await awarmup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from decouple import config
 import json
 
@@ -34,6 +35,9 @@ CORS_ALLOWED_ORIGINS = json.loads(config("CORS_ALLOWED_ORIGINS"))
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Resuming a dropped chat stream sends Last-Event-ID
+CORS_ALLOW_HEADERS = (*default_headers, "last-event-id")
+
 if DEBUG:
     CSRF_COOKIE_SECURE = False
     SESSION_COOKIE_SECURE = False
@@ -48,7 +52,11 @@ SESSION_COOKIE_SAMESITE = "Lax"
 CSRF_USE_SESSIONS = False
 CSRF_COOKIE_HTTPONLY = False
 
-DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10 MB
+# Images travel by id (/api/images/<id>), so chat bodies stay small.
+# Raise this only for legacy clients that still upload reference_image inline.
+DATA_UPLOAD_MAX_MEMORY_SIZE = config(
+    "DATA_UPLOAD_MAX_MEMORY_SIZE", default=2 * 1024 * 1024, cast=int
+)  # 2 MB
 
 # Application definition
 
@@ -60,6 +68,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'corsheaders',
+    'api',
 ]
 
 MIDDLEWARE = [
@@ -93,6 +102,11 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+# Production runs under gunicorn + uvicorn workers (see docker-compose.yml).
+# Sessions live in worker memory by default: with more than one worker set
+# SESSION_BACKING=sqlite so every worker sees every session
+ASGI_APPLICATION = 'backend.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases